@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gz21_ocean_momentum.lib.benchmark as lib
+import gz21_ocean_momentum.lib.data as data
+import gz21_ocean_momentum.common.cli as cli
+
+import configargparse
+
+import json
+import logging
+
+# Description of this module
+_cli_desc = "Benchmark the data step's forcing computation on synthetic \
+CM2.6 data: stages separately and end to end, swept over Dask schedulers, \
+worker counts, chunk sizes and factors. Writes the results to a JSON file."
+
+p = configargparse.ArgParser(description=_cli_desc)
+p.add("--config-file", is_config_file=True, help="config file path")
+p.add("--out-file", type=str, required=True, help="JSON file to write results to")
+p.add("--ny",       type=int, default=540, help="number of latitude points")
+p.add("--nx",       type=int, default=720, help="number of longitude points")
+p.add("--ntimes",   type=int, default=8, help="number of time points")
+p.add("--factor",   type=int, nargs="+", default=[4], help="coarsening factors to benchmark")
+p.add("--stages",   type=str, nargs="+", default=list(lib.STAGES), choices=lib.STAGES, help="stages to benchmark")
+p.add("--schedulers", type=str, nargs="+", default=["threads"], choices=lib.SCHEDULERS, help="Dask schedulers for the end_to_end stage")
+p.add("--workers",  type=int, nargs="+", help="Dask worker counts for the end_to_end stage. Default: one per core")
+p.add("--time-chunks", type=int, nargs="+", default=[1], help="input time chunk sizes for the end_to_end stage")
+p.add("--tile-sizes", type=int, nargs="+", metavar="NY NX", help="tile sizes for the end_to_end stage, as pairs of numbers. Default: untiled")
+p.add("--filter-backend", type=str, default="direct", choices=list(data.SPATIAL_FILTER_BACKENDS), help="Gaussian filtering implementation")
+p.add("--precision", type=str, default="float64", choices=["float64", "float32"], help="floating point precision of the computation")
+p.add("--repeats",  type=int, default=3, help="runs per case; the fastest is reported")
+p.add("--label",    type=str, help="label recorded with the results, e.g. a build or commit name")
+
+def main():
+    options = p.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    tile_sizes = [None]
+    if options.tile_sizes is not None:
+        if len(options.tile_sizes) % 2 != 0:
+            cli.fail(2, "--tile-sizes takes pairs of numbers", f"got {options.tile_sizes}")
+        tile_sizes = list(zip(options.tile_sizes[::2], options.tile_sizes[1::2]))
+
+    report = lib.run_data_benchmarks(
+            options.ny, options.nx, options.ntimes, options.factor,
+            options.stages, options.schedulers, options.workers or [None],
+            options.time_chunks, tile_sizes, options.filter_backend,
+            options.precision, options.repeats)
+    report["label"] = options.label
+
+    with open(options.out_file, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"wrote {len(report['results'])} benchmark results to {options.out_file}")
+
+if __name__ == "__main__":
+    main()
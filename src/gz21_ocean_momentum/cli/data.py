@@ -3,14 +3,22 @@
 
 import gz21_ocean_momentum.lib.data as lib
 import gz21_ocean_momentum.common.cli as cli
+import gz21_ocean_momentum.common.cluster as cluster
+import gz21_ocean_momentum.common.output_cache as output_cache
+from   gz21_ocean_momentum.common.read_ahead import ReadAhead
 from   gz21_ocean_momentum.common.bounding_box import BoundingBox
 import gz21_ocean_momentum.common.bounding_box as bounding_box
 
 import configargparse
 
+import dask
 import dask.diagnostics
+import json
 import logging
+import math
+import os
 
+import numpy as np
 import xarray as xr
 import dask.multiprocessing
 
@@ -21,87 +29,395 @@ and generate forcings. Saves result to disk in zarr format."
 # up to date as of 2023-09-01
 DEF_CATALOG_URI = "https://raw.githubusercontent.com/pangeo-data/pangeo-datastore/d684158e92fb3f3ad3b34e7dc5bba52b22a3ba80/intake-catalogs/ocean.yaml"
 
+# options that do not change the output, left out of its --output-cache-dir key
+# (the bounding boxes file is replaced by the boxes it holds)
+_OUTPUT_CACHE_IGNORED_OPTIONS = {
+    "config_file", "out_dir", "bounding_boxes_file", "verbose", "dry_run",
+    "dask_workers", "dask_local_cluster", "dask_scheduler",
+    "dask_threads_per_worker", "dask_memory_limit", "dask_spill_dir",
+    "grid_cache_dir", "chunk_cache_dir", "chunk_cache_size",
+    "read_ahead", "read_ahead_budget", "resumable", "slab_size",
+    "precision_report", "output_cache_dir", "output_cache_link",
+    "output_cache_copy", "output_cache_max_age", "output_cache_max_size",
+}
+
 p = configargparse.ArgParser(description=_cli_desc)
 p.add("--config-file", is_config_file=True, help="config file path")
 p.add("--out-dir",  type=str,   required=True, help="folder to save generated forcings to (in zarr format)" )
-p.add("--lat-min",  type=float, required=True, help="bounding box minimum latitude")
-p.add("--lat-max",  type=float, required=True, help="bounding box maximum latitude")
-p.add("--long-min", type=float, required=True, help="bounding box minimum longitude")
-p.add("--long-max", type=float, required=True, help="bounding box maximum longitude")
-p.add("--cyclize",  action="store_true", help="global data; make cyclic along longitude")
+p.add("--lat-min",  type=float, help="bounding box minimum latitude")
+p.add("--lat-max",  type=float, help="bounding box maximum latitude")
+p.add("--long-min", type=float, help="bounding box minimum longitude")
+p.add("--long-max", type=float, help="bounding box maximum longitude")
+p.add("--bounding-boxes-file", type=str, help="YAML file of bounding boxes (see the --subdomains-file of the train step), instead of --lat-min etc. Input shared by several boxes is read once; each box's forcings are written to zarr group box_<N> (then factor_<M> for several factors)")
+p.add("--cyclize",  action="store_true", help="global data; make cyclic along longitude. Unless --tile-size is given, tiles follow the input chunks")
 p.add("--ntimes",   type=int,   help="number of time points to process, starting from the first. Note that the CM2.6 dataset is daily, so this would be number of days. If unset, uses whole dataset.")
+p.add("--time-start", type=str, help="first date to process, e.g. 0181-01-01. Applied before --ntimes. Default: the first time point")
+p.add("--time-end", type=str, help="last date to process, inclusive. Default: the last time point")
+p.add("--time-stride", type=int, default=1, help="process every N-th time point of the date range, e.g. 5 for one day in five. Only input chunks holding selected points are read")
 p.add("--co2-increase", action="store_true", help="use 1%% annual CO2 increase CM2.6 dataset. By default, uses control (no increase)")
-p.add("--factor",   type=int,   required=True, help="resolution degradation factor")
+p.add("--factor",   type=int,   required=True, nargs="+", help="resolution degradation factor. Several factors may be given, sharing the reading and high-resolution work; each is then written to zarr group factor_<N>")
 p.add("--pangeo-catalog-uri", type=str, default=DEF_CATALOG_URI, help="URI to Pangeo ocean dataset intake catalog file")
+p.add("--chunk-cache-dir", type=str, help="directory to cache input chunks read from the catalog's zarr stores in, reused by later runs. Entries are checksummed; the least recently used are evicted past --chunk-cache-size")
+p.add("--chunk-cache-size", type=str, default="20GB", help="size bound of the --chunk-cache-dir cache, e.g. 20GB")
+p.add("--read-ahead", type=int, default=0, metavar="N", help="read the input chunks of the next N time slabs concurrently, in background threads, while the current slab is computed. Output is then written slab by slab, as with --resumable. Not with a dask.distributed cluster")
+p.add("--read-ahead-budget", type=str, default="2GB", help="memory for input chunks read ahead with --read-ahead and not used yet, e.g. 2GB")
+p.add("--output-cache-dir", type=str, help="directory of finished outputs keyed by a hash of the options and library version. A run matching a cached output reuses it instead of computing; otherwise its output is added (see cli/output_cache.py to list entries)")
+p.add("--output-cache-link", action="store_true", help="reuse cached outputs by making --out-dir a symbolic link to them, rather than a copy")
+p.add("--output-cache-copy", action="store_true", help="add outputs to --output-cache-dir as copies, rather than by moving them there and making --out-dir a symbolic link to them")
+p.add("--output-cache-max-age", type=float, metavar="DAYS", help="after adding an output to --output-cache-dir, evict the outputs unused for this many days")
+p.add("--output-cache-max-size", type=str, help="after adding an output to --output-cache-dir, evict the least recently used outputs past this total size, e.g. 500GB")
 p.add("--verbose", action="store_true", help="be more verbose (displays progress, debug messages)")
-p.add("--dask-workers", type=int, help="num_workers for Dask computations, higher is more parallel & memory hungry")
-
-options = p.parse_args()
-
-# set up logging immediately after parsing CLI options (need to check verbosity)
-# (would like to simplify this, maybe with `basicConfig(force=True)`)
-if options.verbose:
-    logging.basicConfig(level=logging.DEBUG)
-    dask.diagnostics.ProgressBar().register()
-    logger = logging.getLogger(__name__)
-    logger.debug("verbose mode; displaying all debug messages, progress bars)")
-else:
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-if options.dask_workers is not None:
-    dask.config.set(num_workers=options.dask_workers)
-
-cli.fail_if_path_is_nonempty_dir(
-        1, f"--out-dir \"{options.out_dir}\" invalid", options.out_dir)
-
-# store bounding box in a struct-like
-bbox = BoundingBox(
-        options.lat_min,  options.lat_max,
-        options.long_min, options.long_max)
-if not bounding_box.validate_nonempty(bbox):
-    cli.fail(2, f"provided bounding box describes an empty region: {bbox}")
-
-logger.info("retrieving CM2.6 dataset via Pangeo Cloud Datastore...")
-surface_fields, grid = lib.retrieve_cm2_6(options.pangeo_catalog_uri, options.co2_increase)
-
-logger.debug("dropping irrelevant data variables...")
-surface_fields = surface_fields[["usurf", "vsurf"]]
-
-logger.info("selecting input data bounding box...")
-surface_fields = bounding_box.bound_dataset("yu_ocean", "xu_ocean", surface_fields, bbox)
-grid           = bounding_box.bound_dataset("yu_ocean", "xu_ocean", grid,           bbox)
-
-if options.ntimes is not None:
-    logger.info(f"slicing {options.ntimes} time points...")
-    surface_fields = surface_fields.isel(time=slice(0, options.ntimes))
-
-logger.debug("placing grid dataset into local memory...")
-grid = grid.compute()
-
-if options.cyclize:
-    logger.info("making dataset cyclic along longitude...")
-    logger.info("WARNING: may be nonfunctional or have poor performance")
-    surface_fields = lib.cyclize(
-            surface_fields, "xu_ocean", options.factor)
-    grid = lib.cyclize(
-            grid,           "xu_ocean", options.factor)
-
-    logger.debug("rechunking along cyclized dimension...")
-    surface_fields = surface_fields.chunk({"xu_ocean": -1})
-    grid = grid.chunk({"xu_ocean": -1})
-
-# we may compute by running the function normally, but Dask may schedule poorly,
-# so be explicit with `map_blocks`
-# (dask.array.map_blocks may also work, `meta=` instead of `template=`)
-logger.info("computing forcings...")
-shape = lib.compute_forcings_and_coarsen_cm2_6_shape(surface_fields, options.factor)
-f = lambda x: lib.compute_forcings_and_coarsen_cm2_6(x, grid, options.factor)
-forcings = xr.map_blocks(f, surface_fields, template=shape)
-
-logger.info("selecting forcing bounding box...")
-forcings = bounding_box.bound_dataset("yu_ocean", "xu_ocean", forcings, bbox)
-
-# to_zarr below now finally incurs the data processing computation
-logger.info(f"writing forcings zarr to directory: {options.out_dir}")
-forcings.to_zarr(options.out_dir)
+p.add("--dry-run", action="store_true", help="print the estimated input, peak memory and output sizes of the computation (see --memory-budget), then exit without computing")
+p.add("--memory-budget", type=str, help="memory available to the computation, e.g. 16GB. Time chunks and tiles (from --tile-size or the input chunks) are shrunk until the estimated peak memory of all workers fits")
+p.add("--dask-workers", type=int, help="num_workers for Dask computations, higher is more parallel & memory hungry. With --dask-local-cluster, the number of worker processes")
+p.add("--dask-local-cluster", action="store_true", help="compute on a local dask.distributed cluster of worker processes, with per-worker memory limits and spilling to disk. Requires the distributed package")
+p.add("--dask-scheduler", type=str, metavar="ADDRESS", help="compute on the dask.distributed cluster with the scheduler at this address, e.g. tcp://127.0.0.1:8786")
+p.add("--dask-threads-per-worker", type=int, default=1, help="threads per worker process with --dask-local-cluster")
+p.add("--dask-memory-limit", type=str, default="auto", help="memory limit per worker with --dask-local-cluster, e.g. 4GB. auto shares the machine's memory between workers")
+p.add("--dask-spill-dir", type=str, help="directory workers spill data to with --dask-local-cluster. Default: a temporary directory")
+p.add("--filter-backend", type=str, default="auto", choices=["auto", *lib.SPATIAL_FILTER_BACKENDS], help="Gaussian filtering implementation. auto benchmarks the backends on the input block shape and picks the fastest")
+p.add("--grid-cache-dir", type=str, help="directory to cache grid-derived filter terms in, reused by later runs on the same region and factor")
+p.add("--tile-size", type=int, nargs=2, metavar=("NY", "NX"), help="split the domain into spatial tiles of this many high-resolution points (rounded up to a multiple of the factors), each computed with a halo. Bounds per-task memory. If unset, each input chunk is processed whole")
+p.add("--resumable", action="store_true", help="write output in time slabs, recording progress in a manifest. Rerunning with the same options on an interrupted output directory only computes the missing slabs")
+p.add("--slab-size", type=int, help="number of time points per slab in --resumable mode (rounded up to a multiple of the time chunk size). Default: the time chunk size")
+p.add("--precision", type=str, default="input", choices=["input", "float64", "float32"], help="floating point precision of the computation and output: that of the input velocities (CM2.6's are float32), or float64 or float32. float32 halves memory use and output size of float64")
+p.add("--precision-report", type=str, help="before computing, compare float32 against float64 results on a sample region for each factor, and write the report to this JSON file")
+p.add("--output-layout", type=str, default="default", choices=["default", "training"], help="output chunking preset. training: --training-batch-size time points per chunk, whole spatial extent, Blosc zstd compression")
+p.add("--training-batch-size", type=int, default=4, help="time chunk size of the training output layout; should match the training batch size")
+p.add("--output-chunks", type=str, nargs="*", metavar="DIM=SIZE", help="output chunk size per dimension (-1 for whole), e.g. time=4 yu_ocean=-1. Overrides the layout preset")
+p.add("--compression", type=str, choices=list(lib.ZARR_COMPRESSIONS), help="output compression: zarr default codecs, Blosc zstd with bit-shuffle, or none. Default: per --output-layout")
+p.add("--compression-level", type=int, default=5, help="compression level for blosc-zstd")
+p.add("--var-dtype", type=str, nargs="*", metavar="VAR=DTYPE", help="on-disk dtype per output variable, e.g. S_x=float32")
+
+def main():
+    options = p.parse_args()
+
+    # set up logging immediately after parsing CLI options (need to check verbosity)
+    # (would like to simplify this, maybe with `basicConfig(force=True)`)
+    if options.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+        dask.diagnostics.ProgressBar().register()
+        logger = logging.getLogger(__name__)
+        logger.debug("verbose mode; displaying all debug messages, progress bars)")
+    else:
+        logging.basicConfig(level=logging.INFO)
+        logger = logging.getLogger(__name__)
+
+    read_ahead = None
+    if options.read_ahead > 0:
+        if options.dask_local_cluster or options.dask_scheduler is not None:
+            cli.fail(2, "--read-ahead needs the local threaded scheduler",
+                     "drop --dask-local-cluster or --dask-scheduler")
+        try:
+            read_ahead = ReadAhead(max_bytes=dask.utils.parse_bytes(options.read_ahead_budget))
+        except ValueError as e:
+            cli.fail(2, f"invalid --read-ahead-budget \"{options.read_ahead_budget}\"", str(e))
+
+    if options.dask_local_cluster or options.dask_scheduler is not None:
+        if options.dask_local_cluster and options.dask_scheduler is not None:
+            cli.fail(2, "--dask-local-cluster and --dask-scheduler are mutually exclusive")
+        try:
+            cluster.start_dask_client(
+                    options.dask_scheduler, options.dask_workers,
+                    options.dask_threads_per_worker, options.dask_memory_limit,
+                    options.dask_spill_dir)
+        except ImportError as e:
+            cli.fail(2, "cannot start Dask cluster", str(e))
+    elif options.dask_workers is not None:
+        dask.config.set(num_workers=options.dask_workers)
+
+    if options.resumable and os.path.exists(
+            os.path.join(options.out_dir, lib.SLAB_MANIFEST_NAME)):
+        logger.info(f"--out-dir \"{options.out_dir}\" has a slab manifest, resuming")
+    else:
+        cli.fail_if_path_is_nonempty_dir(
+                1, f"--out-dir \"{options.out_dir}\" invalid", options.out_dir)
+
+    if options.bounding_boxes_file is not None:
+        if any(x is not None for x in (
+                options.lat_min, options.lat_max, options.long_min, options.long_max)):
+            cli.fail(2, "--bounding-boxes-file and --lat-min etc. are mutually exclusive")
+        try:
+            bboxes = bounding_box.load_bounding_boxes_yaml(options.bounding_boxes_file)
+        except (OSError, KeyError, TypeError) as e:
+            cli.fail(2, f"cannot load --bounding-boxes-file \"{options.bounding_boxes_file}\"", repr(e))
+    elif any(x is None for x in (
+            options.lat_min, options.lat_max, options.long_min, options.long_max)):
+        cli.fail(2, "need a bounding box: --lat-min, --lat-max, --long-min and --long-max, or --bounding-boxes-file")
+    else:
+        # store bounding box in a struct-like
+        bboxes = [BoundingBox(
+                options.lat_min,  options.lat_max,
+                options.long_min, options.long_max)]
+    for bbox in bboxes:
+        if not bounding_box.validate_nonempty(bbox):
+            cli.fail(2, f"provided bounding box describes an empty region: {bbox}")
+
+    output_cache_key = None
+    if options.output_cache_dir is not None and not options.dry_run:
+        output_cache_max_size = None
+        if options.output_cache_max_size is not None:
+            try:
+                output_cache_max_size = dask.utils.parse_bytes(options.output_cache_max_size)
+            except ValueError as e:
+                cli.fail(2, f"invalid --output-cache-max-size \"{options.output_cache_max_size}\"", str(e))
+        cache_params = {
+                k: v for k, v in vars(options).items()
+                if k not in _OUTPUT_CACHE_IGNORED_OPTIONS}
+        cache_params["bounding_boxes"] = [vars(bbox) for bbox in bboxes]
+        cache_params["pangeo_catalog_uri"] = output_cache.input_file_param(
+                options.pangeo_catalog_uri)
+        output_cache_key = output_cache.output_key(cache_params)
+        cached_output = output_cache.lookup_output(options.output_cache_dir, output_cache_key)
+        # (a partial output being resumed is completed instead)
+        if cached_output is not None and cli.path_is_nonexist_or_empty_dir(options.out_dir):
+            logger.info(
+                    f"reusing cached output {output_cache_key} computed with "
+                    f"the same options: {cached_output}")
+            output_cache.reuse_output(
+                    cached_output, options.out_dir, options.output_cache_link)
+            return
+        logger.info(f"no cached output for these options, key {output_cache_key}")
+
+    logger.info("retrieving CM2.6 dataset via Pangeo Cloud Datastore...")
+    chunk_cache_size = None
+    if options.chunk_cache_dir is not None:
+        try:
+            chunk_cache_size = dask.utils.parse_bytes(options.chunk_cache_size)
+        except ValueError as e:
+            cli.fail(2, f"invalid --chunk-cache-size \"{options.chunk_cache_size}\"", str(e))
+        logger.info(f"caching input chunks in {options.chunk_cache_dir}")
+
+    surface_fields, grid = lib.retrieve_cm2_6(
+            options.pangeo_catalog_uri, options.co2_increase,
+            options.chunk_cache_dir, chunk_cache_size)
+
+    logger.debug("dropping irrelevant data variables...")
+    surface_fields = surface_fields[["usurf", "vsurf"]]
+
+    if (options.time_start is not None or options.time_end is not None
+            or options.time_stride != 1):
+        logger.info(
+                f"selecting time points from {options.time_start or 'start'} to "
+                f"{options.time_end or 'end'}, every {options.time_stride}...")
+        try:
+            surface_fields = lib.select_times(
+                    surface_fields, options.time_start, options.time_end,
+                    options.time_stride)
+        except ValueError as e:
+            cli.fail(2, "invalid time selection", str(e))
+
+    if options.ntimes is not None:
+        logger.info(f"slicing {options.ntimes} time points...")
+        surface_fields = surface_fields.isel(time=slice(0, options.ntimes))
+
+    factors = options.factor
+    spatial_dims = ["yu_ocean", "xu_ocean"]
+    dtype = lib.forcing_dtype(
+        surface_fields, None if options.precision == "input" else options.precision)
+
+    tile_size = options.tile_size
+    if options.cyclize:
+        # pad each end with enough points for forcings at the edges to be
+        # computed as on a periodic domain (trimmed with the bounding boxes)
+        halo = lib.forcing_halo(factors)
+        logger.info(f"making dataset cyclic along longitude ({halo} points each side)...")
+        surface_fields = lib.cyclize("xu_ocean", surface_fields, halo)
+        grid           = lib.cyclize("xu_ocean", grid,           halo)
+        if tile_size is None:
+            # the padded ends are separate chunks, so tile with halos to compute
+            # across chunk edges, keeping the input's spatial chunking
+            chunksizes = surface_fields["usurf"].data.chunksize
+            tile_size = [
+                chunksizes[surface_fields["usurf"].dims.index(dim)]
+                for dim in spatial_dims]
+            logger.info(f"using tiles of input chunk size {tile_size}...")
+
+    # each box is computed on its own region, extended by a filter halo. The
+    # regions are sliced from the same lazy input and computed together, so
+    # input chunks shared by several regions are read once
+    logger.info("selecting input data bounding boxes...")
+    try:
+        regions = lib.bounding_box_regions(surface_fields, bboxes, factors)
+    except ValueError as e:
+        cli.fail(2, "bounding box too small", str(e))
+    if surface_fields.chunks:
+        chunks = [lib.region_input_chunks(surface_fields, region) for region, _ in regions]
+        logger.info(
+            f"reading {len(set().union(*chunks))} spatial input chunks for "
+            f"{len(bboxes)} bounding box(es), {sum(map(len, chunks))} if read per box")
+    # the grid is needed over the union of the regions
+    hull = BoundingBox(*(
+        surface_fields[dim].values[index].item()
+        for dim in spatial_dims
+        for index in (min(r[dim].start for r, _ in regions),
+                      max(r[dim].stop for r, _ in regions) - 1)))
+    grid = bounding_box.bound_dataset("yu_ocean", "xu_ocean", grid, hull)
+    # planning, calibration and the precision report use the largest region
+    sample = max(
+        (surface_fields.isel(region) for region, _ in regions),
+        key=lambda ds: ds.sizes["yu_ocean"] * ds.sizes["xu_ocean"])
+
+    if read_ahead is not None:
+        # before any rechunking, so that store chunks are read once, even
+        # when split into several computed chunks
+        surface_fields = read_ahead.wrap(surface_fields)
+
+    if options.dry_run or options.memory_budget is not None:
+        memory_budget = None
+        if options.memory_budget is not None:
+            try:
+                memory_budget = dask.utils.parse_bytes(options.memory_budget)
+            except ValueError as e:
+                cli.fail(2, f"invalid --memory-budget \"{options.memory_budget}\"", str(e))
+        # tasks running at once, as Dask's schedulers default to one per core
+        concurrency = options.dask_workers or os.cpu_count()
+        if options.dask_local_cluster and options.dask_workers is not None:
+            concurrency *= options.dask_threads_per_worker
+        plan = lib.plan_forcing_chunks(
+                sample, factors, memory_budget, concurrency, tile_size, dtype)
+        print(f"chunk plan for {concurrency} concurrent tasks:")
+        print(lib.format_chunk_plan(plan))
+        if options.dry_run:
+            return
+        if not plan["fits"]:
+            cli.fail(2, "no chunking fits --memory-budget",
+                     "increase it, or reduce --dask-workers")
+        surface_fields = surface_fields.chunk({"time": plan["time_chunk"]})
+        sample = sample.chunk({"time": plan["time_chunk"]})
+        tile_size = plan["tile_size"]
+
+    logger.debug("placing grid dataset into local memory...")
+    grid = grid.compute()
+
+    block_shape = lib.forcing_block_shape(sample, factors, tile_size)
+    if options.filter_backend == "auto":
+        logger.info(f"calibrating spatial filter backends on block shape {block_shape}...")
+    filter_backends = lib.resolve_spatial_filter_backends(
+            options.filter_backend, block_shape, factors, dtype)
+    for factor in factors:
+        logger.info(f"using spatial filter backend for factor {factor}: {filter_backends[factor]}")
+
+    logger.info("computing grid-derived filter terms...")
+    grid_terms = {
+            factor: lib.grid_filter_terms(
+                grid, factor/2, dtype, cache_dir=options.grid_cache_dir)
+            for factor in factors}
+
+    if options.precision_report is not None:
+        logger.info("comparing float32 against float64 results on a sample region...")
+        report = {}
+        for factor in factors:
+            report[f"factor_{factor}"] = lib.precision_report(
+                    sample, grid, factor,
+                    filter_backend=filter_backends[factor])
+            for name, stats in report[f"factor_{factor}"].items():
+                logger.info(
+                    f"factor {factor}, {name}: relative RMS error "
+                    f"{stats['relative_rms_error']:.2e}, max abs error "
+                    f"{stats['max_abs_error']:.2e}, {stats['nan_mismatch']} NaN mismatches")
+        with open(options.precision_report, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"wrote precision report to {options.precision_report}")
+
+    # we may compute by running the function normally, but Dask may schedule poorly,
+    # so be explicit with `map_blocks` (done by `map_forcings_over_blocks`).
+    # All factors are computed by the same tasks, sharing reads and advection.
+    logger.info("computing forcings...")
+    if tile_size is not None:
+        logger.info(f"splitting domains into tiles of {tile_size} points...")
+    align = math.lcm(*factors)
+    box_forcings = []
+    for bbox, (region, keep) in zip(bboxes, regions):
+        u_v = surface_fields.isel(region)
+        labels = {dim: u_v[dim].values for dim in spatial_dims}
+        forcings = lib.map_forcings_over_blocks(
+                u_v, grid.sel(labels), factors, tile_size,
+                filter_backend=filter_backends,
+                grid_terms={f: terms.sel(labels) for f, terms in grid_terms.items()},
+                dtype=dtype)
+        for factor in factors:
+            # trim the halo
+            forcings[factor] = forcings[factor].isel(keep[factor])
+            forcings[factor].attrs.update(
+                    {k.replace("_", "-"): v for k, v in vars(bbox).items()})
+            if tile_size is not None:
+                # zarr needs uniform chunks, which trimming may have broken at the edges
+                forcings[factor] = forcings[factor].chunk({
+                    dim: -(-tile // align) * align // factor
+                    for dim, tile in zip(spatial_dims, tile_size)})
+        box_forcings.append(forcings)
+
+    # a single box and factor is written at the store root, several to one
+    # group each
+    groups = {}
+    for i, forcings in enumerate(box_forcings):
+        for factor in factors:
+            path = []
+            if options.bounding_boxes_file is not None:
+                path.append(f"box_{i}")
+            if len(factors) > 1:
+                path.append(f"factor_{factor}")
+            groups["/".join(path) or None] = forcings[factor]
+
+    output_chunks = cli.parse_key_value_pairs(
+            2, "--output-chunks", options.output_chunks, int)
+    var_dtypes = cli.parse_key_value_pairs(2, "--var-dtype", options.var_dtype)
+    compression = options.compression
+    if options.output_layout == "training":
+        output_chunks = {
+                **lib.training_output_chunks(options.training_batch_size),
+                **output_chunks}
+        if compression is None:
+            compression = "blosc-zstd"
+    encodings = {}
+    for group, ds in groups.items():
+        try:
+            groups[group], encodings[group] = lib.zarr_output_layout(
+                    ds, output_chunks, compression or "default",
+                    options.compression_level, var_dtypes)
+        except (ValueError, TypeError) as e:
+            cli.fail(2, "invalid output layout", str(e))
+
+    # to_zarr below now finally incurs the data processing computation
+    logger.info(f"writing forcings zarr to directory: {options.out_dir}")
+    if options.resumable or read_ahead is not None:
+        prefetch = release = None
+        if read_ahead is not None:
+            def prefetch(times):
+                for region, _ in regions:
+                    read_ahead.prefetch({"time": times, **region})
+            def release(times):
+                read_ahead.release_before(times.stop)
+        try:
+            if None in groups:
+                lib.write_forcings_in_slabs(
+                        groups[None], options.out_dir, options.slab_size,
+                        encodings[None], prefetch, options.read_ahead, release)
+            else:
+                lib.write_forcings_in_slabs(
+                        groups, options.out_dir, options.slab_size, encodings,
+                        prefetch, options.read_ahead, release)
+        except ValueError as e:
+            cli.fail(3, f"cannot resume writing to --out-dir \"{options.out_dir}\"", str(e))
+    else:
+        if None not in groups:
+            logger.info(f"writing groups: {', '.join(groups)}")
+        dask.compute(*(
+            ds.to_zarr(options.out_dir, group=group, encoding=encodings[group],
+                       compute=False)
+            for group, ds in groups.items()))
+
+    if output_cache_key is not None:
+        output_cache.store_output(
+                options.output_cache_dir, output_cache_key, options.out_dir,
+                cache_params, options.output_cache_copy)
+        if options.output_cache_max_age is not None or output_cache_max_size is not None:
+            max_age = None
+            if options.output_cache_max_age is not None:
+                max_age = options.output_cache_max_age * 24 * 3600
+            output_cache.evict_outputs(
+                    options.output_cache_dir, max_age, output_cache_max_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gz21_ocean_momentum.common.output_cache as lib
+import gz21_ocean_momentum.common.cli as cli
+
+import configargparse
+
+import dask.utils
+import datetime
+import json
+import logging
+
+# Description of this module
+_cli_desc = "List the outputs in a data step --output-cache-dir, least \
+recently used first, with the options they were computed with. Optionally \
+evict outputs by age or total size."
+
+p = configargparse.ArgParser(description=_cli_desc)
+p.add("--config-file", is_config_file=True, help="config file path")
+p.add("--cache-dir", type=str, required=True, help="output cache directory, as given to the data step's --output-cache-dir")
+p.add("--max-age",  type=float, metavar="DAYS", help="evict the outputs unused for this many days")
+p.add("--max-size", type=str, help="evict the least recently used outputs past this total size, e.g. 500GB")
+p.add("--json",     action="store_true", help="print the entries' metadata as JSON")
+
+def main():
+    options = p.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    max_bytes = None
+    if options.max_size is not None:
+        try:
+            max_bytes = dask.utils.parse_bytes(options.max_size)
+        except ValueError as e:
+            cli.fail(2, f"invalid --max-size \"{options.max_size}\"", str(e))
+    if options.max_age is not None or max_bytes is not None:
+        max_age = None if options.max_age is None else options.max_age * 24 * 3600
+        lib.evict_outputs(options.cache_dir, max_age, max_bytes)
+
+    entries = lib.list_outputs(options.cache_dir)
+    if options.json:
+        print(json.dumps(entries, indent=2, default=str))
+        return
+    for meta in entries:
+        last_used = datetime.datetime.fromtimestamp(meta["last_used"])
+        print(
+            f"{meta['key']}  {dask.utils.format_bytes(meta['size_bytes']):>10}  "
+            f"last used {last_used:%Y-%m-%d %H:%M}  version {meta['version']}")
+        params = meta["params"]
+        print(
+            f"    factor {params.get('factor')}, ntimes {params.get('ntimes')}, "
+            f"co2_increase {params.get('co2_increase')}, "
+            f"boxes {params.get('bounding_boxes')}")
+    total = sum(meta["size_bytes"] for meta in entries)
+    print(f"{len(entries)} cached output(s), {dask.utils.format_bytes(total)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gz21_ocean_momentum.lib.synthetic as lib
+import gz21_ocean_momentum.common.cli as cli
+
+import configargparse
+
+import dask.diagnostics
+import logging
+
+# Description of this module
+_cli_desc = "Generate synthetic CM2.6 surface velocity and grid datasets with \
+an intake catalog, for running the data step offline. Pass the printed \
+catalog path to the data step's --pangeo-catalog-uri."
+
+p = configargparse.ArgParser(description=_cli_desc)
+p.add("--config-file", is_config_file=True, help="config file path")
+p.add("--out-dir",  type=str,   required=True, help="folder to save the zarr stores and catalog to")
+p.add("--ntimes",   type=int,   default=10, help="number of (daily) time points")
+p.add("--ny",       type=int,   default=2700, help="number of latitude points. Default: as CM2.6")
+p.add("--nx",       type=int,   default=3600, help="number of longitude points. Default: as CM2.6")
+p.add("--time-chunk", type=int, default=1, help="time points per chunk of the surface datasets")
+p.add("--land-fraction", type=float, default=0.3, help="fraction of land outside Antarctica")
+p.add("--speed",    type=float, default=0.2, help="RMS speed of the eddies, in m/s")
+p.add("--seed",     type=int,   default=0, help="random seed")
+p.add("--verbose",  action="store_true", help="be more verbose (displays progress, debug messages)")
+
+options = p.parse_args()
+
+if options.verbose:
+    logging.basicConfig(level=logging.DEBUG)
+    dask.diagnostics.ProgressBar().register()
+else:
+    logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+cli.fail_if_path_is_nonempty_dir(
+        1, f"--out-dir \"{options.out_dir}\" invalid", options.out_dir)
+if not 0 <= options.land_fraction < 1:
+    cli.fail(2, f"--land-fraction must be in [0, 1), got {options.land_fraction}")
+
+catalog_path = lib.write_synthetic_cm2_6(
+        options.out_dir, options.ntimes, options.ny, options.nx,
+        options.time_chunk, options.land_fraction, options.speed, options.seed)
+logger.info(f"wrote synthetic CM2.6 catalog: {catalog_path}")
+print(catalog_path)
@@ -16,6 +16,7 @@ from gz21_ocean_momentum.data.datasets import Subset_, ConcatDataset_
 
 import configargparse
 
+import copy
 import os
 
 import xarray as xr
@@ -36,8 +37,9 @@ Uses data generated by the GZ21 data step script.
 
 p = configargparse.ArgParser(description=_cli_desc)
 p.add("--config-file", is_config_file=True, help="config file path")
-p.add("--in-train-data-dir",         type=str,   required=True, help="training data in zarr format, containing ocean velocities and forcings")
-p.add("--subdomains-file",           type=str,   required=True, help="YAML file describing subdomains to split input data into (see readme for format)")
+p.add("--in-train-data-dir",         type=str,   help="training data in zarr format, containing ocean velocities and forcings")
+p.add("--subdomains-file",           type=str,   help="YAML file describing subdomains to split input data into (see readme for format). Required with --in-train-data-dir")
+p.add("--in-train-shards-dir",       type=str,   help="training data as shards written by --write-shards, instead of --in-train-data-dir and --subdomains-file")
 p.add("--batch-size",                type=int,   required=True, help="PyTorch DataLoader batch size")
 p.add("--epochs",                    type=int,   required=True, help="number of epochs to train for")
 p.add("--out-model",                 type=str,   required=True, help="save trained model to this path")
@@ -49,27 +51,47 @@ p.add("--weight-decay",              type=float, default=0.0, help="Weight decay
 p.add("--train-split-end",  type=float, required=True, help="0>=x>=1. Use 0->x of input dataset for training")
 p.add("--test-split-start", type=float, required=True, help="0>=x>=1. Use x->end of input dataset for testing. Must be greater than --train-split-start")
 p.add("--printevery", type=int, default=20)
+p.add("--materialize-subdomains", action="store_true", help="load each subdomain's scaled features and targets into memory once, as float32 arrays, instead of reading every sample from the zarr store each epoch. Subdomains must fit in memory")
+p.add("--write-shards", type=str, metavar="DIR", help="write the prepared training samples (scaled, and cropped to the model's shapes) to memory-mapped .npy shards in this new directory, then train from them. Later runs can train from them with --in-train-shards-dir")
+p.add("--shard-size",   type=int, default=256, help="number of samples per shard written with --write-shards")
 options = p.parse_args()
 
 if not common.list_is_strictly_increasing(options.decay_at_epoch_milestones):
     cli.fail(2, "epoch milestones list is not strictly increasing")
+if (options.in_train_data_dir is None) == (options.in_train_shards_dir is None):
+    cli.fail(2, "expected exactly one of --in-train-data-dir and --in-train-shards-dir")
+if options.in_train_data_dir is not None and options.subdomains_file is None:
+    cli.fail(2, "--in-train-data-dir requires --subdomains-file")
+if options.write_shards is not None:
+    if options.in_train_shards_dir is not None:
+        cli.fail(2, "--write-shards requires --in-train-data-dir",
+                 "training data given with --in-train-shards-dir is already sharded")
+    if os.path.exists(options.write_shards):
+        cli.fail(2, f"--write-shards directory {options.write_shards} already exists")
+    if options.shard_size < 1:
+        cli.fail(2, "--shard-size must be positive")
 
 torch.autograd.set_detect_anomaly(True)
 
-# dataset prep: load data, select subdomains via provided bounding boxes
-ds_xr = xr.open_zarr(options.in_train_data_dir)
-bboxes = bounding_box.load_bounding_boxes_yaml(options.subdomains_file)
-sds_xr = [ bounding_box.bound_dataset("yu_ocean", "xu_ocean", ds_xr, bbox) for bbox in bboxes ]
-
 # dataset prep: transform, wrap into PyTorch dataset
 def _transform_and_to_torch(ds_xr):
     """Attach a transformation to an xarray dataset, then convert to PyTorch."""
     # must deepcopy due to transformation implementation!
     ds_xr = copy.deepcopy(submodels.transform3).fit_transform(ds_xr)
     #ds_xr = ds_xr.compute() # should we force compute underlying xarray?
-    ds_torch = lib.gz21_train_data_subdomain_xr_to_torch(ds_xr)
+    ds_torch = lib.gz21_train_data_subdomain_xr_to_torch(
+            ds_xr, options.materialize_subdomains)
     return ds_torch
-datasets = [ _transform_and_to_torch(sd_xr) for sd_xr in sds_xr ]
+
+if options.in_train_shards_dir is not None:
+    # samples already prepared, one dataset per subdomain
+    datasets = lib.load_training_shards(options.in_train_shards_dir)
+else:
+    # dataset prep: load data, select subdomains via provided bounding boxes
+    ds_xr = xr.open_zarr(options.in_train_data_dir)
+    bboxes = bounding_box.load_bounding_boxes_yaml(options.subdomains_file)
+    sds_xr = [ bounding_box.bound_dataset("yu_ocean", "xu_ocean", ds_xr, bbox) for bbox in bboxes ]
+    datasets = [ _transform_and_to_torch(sd_xr) for sd_xr in sds_xr ]
 
 train_dataloader, test_dataloader = lib.prep_train_test_dataloaders(
         datasets,
@@ -85,8 +107,18 @@ net.final_transformation = transformation
 
 # add automatic feature & target transforms to datasets using model
 # e.g. reshape targets to match model output shape
-for dataset in datasets:
-    dataset.add_transforms_from_model(net)
+# (shards hold samples with these transforms applied already)
+if options.in_train_shards_dir is None:
+    for dataset in datasets:
+        dataset.add_transforms_from_model(net)
+
+if options.write_shards is not None:
+    lib.write_training_shards(datasets, options.write_shards, options.shard_size)
+    datasets = lib.load_training_shards(options.write_shards)
+    train_dataloader, test_dataloader = lib.prep_train_test_dataloaders(
+            datasets,
+            options.train_split_end, options.test_split_start,
+            options.batch_size)
 
 # -------------------
 # TRAINING OF NETWORK
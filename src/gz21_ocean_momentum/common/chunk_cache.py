@@ -0,0 +1,227 @@
+"""Persistent on-disk cache of remote file reads, such as zarr chunks.
+
+Wraps an fsspec filesystem so that whole-file reads are served from a local
+directory when possible. Entries are checksummed, and the least recently used
+are evicted to keep the cache under a size bound. The zarr stores of a dataset
+can then be opened through it with `open_cached_zarr`.
+"""
+
+import fsspec
+from fsspec.spec import AbstractFileSystem
+import xarray as xr
+
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict
+from typing import Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_SIZE = 32
+
+# fraction of the size bound evicted down to, so that evictions, which scan
+# the whole cache directory, are not repeated on every write once it is full
+EVICTION_LOW_WATER = 0.9
+
+class _CacheDirectory:
+    """Size accounting and eviction of a cache directory, shared by its users in a process."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def add(self, size: int) -> None:
+        with self.lock:
+            self.size += size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        """
+        Delete least recently used entries until the cache is down to
+        `EVICTION_LOW_WATER` of its bound, with the lock held.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        self.size = sum(size for _, size, _ in entries)
+        for entry, size, _ in entries:
+            if self.size <= EVICTION_LOW_WATER * self.max_bytes:
+                break
+            if _remove(entry):
+                self.size -= size
+        logger.debug(f"evicted chunk cache entries down to {self.size} bytes")
+
+    def entries(self):
+        """Cache entries, as tuples `(path, size, mtime)`."""
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                yield os.path.join(root, name), stat.st_size, stat.st_mtime
+
+_directories: Dict[str, _CacheDirectory] = {}
+_directories_lock = threading.Lock()
+
+def _cache_directory(path: str, max_bytes: int) -> _CacheDirectory:
+    """The accounting of the cache directory at `path`, under the latest bound."""
+    path = os.path.abspath(path)
+    with _directories_lock:
+        directory = _directories.get(path)
+        if directory is None:
+            directory = _directories[path] = _CacheDirectory(path, max_bytes)
+    with directory.lock:
+        directory.max_bytes = max_bytes
+        if directory.size > max_bytes:
+            directory.evict()
+    return directory
+
+class ChunkCacheFileSystem(AbstractFileSystem):
+    """
+    Read-only fsspec filesystem caching the whole-file reads of another one.
+
+    Each cached file is stored under `cache_dir` with a BLAKE2b checksum of
+    its contents, checked on every read: corrupt entries are dropped and read
+    again from the target. Hits refresh an entry's modification time, and
+    when the cache grows over `max_bytes` the entries modified least recently
+    are deleted, down to `EVICTION_LOW_WATER` of the bound. Instances using
+    the same directory in a process, e.g. for the stores of a dataset, share
+    its size accounting. Entries are written atomically, so several
+    processes may share a cache directory (the size bound is then
+    approximate). Partial reads and listings go to the target filesystem.
+
+    Parameters
+    ----------
+    fs : fsspec filesystem
+        Filesystem to cache reads from.
+    cache_dir : str
+        Cache directory, created if needed.
+    max_bytes : int
+        Size bound of the cache, in bytes.
+    """
+    protocol = "chunkcache"
+    cachable = False
+
+    def __init__(self, fs: AbstractFileSystem, cache_dir: str, max_bytes: int, **kwargs):
+        super().__init__(fs=fs, cache_dir=cache_dir, max_bytes=max_bytes, **kwargs)
+        self.fs = fs
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._directory = _cache_directory(cache_dir, max_bytes)
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        if start not in (None, 0) or end is not None:
+            return self.fs.cat_file(path, start=start, end=end, **kwargs)
+        entry = self._entry_path(path)
+        data = self._read_entry(entry)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        data = self.fs.cat_file(path, **kwargs)
+        self._write_entry(entry, data)
+        return data
+
+    def ls(self, path, detail=True, **kwargs):
+        return self.fs.ls(path, detail=detail, **kwargs)
+
+    def info(self, path, **kwargs):
+        return self.fs.info(path, **kwargs)
+
+    def _open(self, path, mode="rb", **kwargs):
+        if mode != "rb":
+            raise PermissionError("the chunk cache filesystem is read-only")
+        return self.fs._open(path, mode=mode, **kwargs)
+
+    def clear(self):
+        """Delete all cache entries."""
+        directory = self._directory
+        with directory.lock:
+            for entry, _, _ in directory.entries():
+                _remove(entry)
+            directory.size = 0
+
+    def _entry_path(self, path: str) -> str:
+        # keyed by the target's protocol too, as paths may omit it
+        protocol = self.fs.protocol if isinstance(self.fs.protocol, str) else self.fs.protocol[0]
+        key = hashlib.blake2b(
+            f"{protocol}://{self.fs._strip_protocol(path)}".encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _read_entry(self, entry: str) -> Optional[bytes]:
+        try:
+            with open(entry, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        digest, data = content[:_DIGEST_SIZE], content[_DIGEST_SIZE:]
+        if hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest() != digest:
+            logger.warning(f"dropping corrupt chunk cache entry {entry}")
+            with self._directory.lock:
+                if _remove(entry):
+                    self._directory.size -= len(content)
+            return None
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            # evicted meanwhile, by another process
+            pass
+        return data
+
+    def _write_entry(self, entry: str, data: bytes) -> None:
+        size = _DIGEST_SIZE + len(data)
+        if size > self.max_bytes:
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest())
+            f.write(data)
+        os.replace(tmp, entry)
+        self._directory.add(size)
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def open_cached_zarr(
+    urlpath: str,
+    cache_dir: str,
+    max_bytes: int,
+    storage_options: Optional[dict] = None,
+    **kwargs,
+) -> xr.Dataset:
+    """
+    Open a zarr store with `xarray.open_zarr`, reading through a
+    `ChunkCacheFileSystem` in `cache_dir`.
+
+    Parameters
+    ----------
+    urlpath : str
+        Path or URL of the zarr store.
+    cache_dir : str
+        Cache directory, which may be shared between stores.
+    max_bytes : int
+        Size bound of the cache, in bytes.
+    storage_options : dict, optional
+        Options of the store's fsspec filesystem.
+    **kwargs
+        Passed to `xarray.open_zarr`.
+    """
+    fs, path = fsspec.core.url_to_fs(urlpath, **(storage_options or {}))
+    cached = ChunkCacheFileSystem(fs, cache_dir, max_bytes)
+    return xr.open_zarr(cached.get_mapper(path), **kwargs)
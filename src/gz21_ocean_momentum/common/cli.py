@@ -1,7 +1,9 @@
 import os
 import sys
 
+from typing import Callable
 from typing import Optional
+from typing import Sequence
 
 def path_is_nonexist_or_empty_dir(path) -> bool:
     """Is the given path either nonexistent or an empty directory?"""
@@ -48,3 +50,21 @@ def fail(err_code: int, msg: str, hint: Optional[str] = None):
     if hint is not None:
         print(f"hint: {hint}")
     sys.exit(err_code)
+
+def parse_key_value_pairs(
+        err_code: int, option: str, pairs: Optional[Sequence[str]],
+        value_type: Callable = str) -> dict:
+    """Parse `KEY=VALUE` CLI arguments into a dict.
+
+    Exits the program with the given error code if an argument is malformed.
+    """
+    parsed = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition("=")
+        try:
+            if not sep or not key:
+                raise ValueError
+            parsed[key] = value_type(value)
+        except ValueError:
+            fail(err_code, f"{option}: invalid argument \"{pair}\"", "expected KEY=VALUE")
+    return parsed
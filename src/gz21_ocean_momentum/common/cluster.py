@@ -0,0 +1,92 @@
+"""Dask distributed cluster setup for the CLI steps.
+
+`dask.distributed` is an optional dependency (install the `DISTRIBUTED`
+extra), imported only when a cluster is requested.
+"""
+
+import dask
+
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Fractions of each worker's memory limit at which it spills data to disk,
+# pauses running tasks, and is restarted. Spilling starts early, as filtering
+# a block needs several block-sized temporaries on top of held results.
+WORKER_MEMORY_THRESHOLDS = {
+    "distributed.worker.memory.target": 0.6,
+    "distributed.worker.memory.spill": 0.7,
+    "distributed.worker.memory.pause": 0.8,
+    "distributed.worker.memory.terminate": 0.95,
+}
+
+
+def start_dask_client(
+        scheduler_address: Optional[str] = None,
+        n_workers: Optional[int] = None,
+        threads_per_worker: int = 1,
+        memory_limit: str = "auto",
+        spill_dir: Optional[str] = None,
+        processes: bool = True,
+        ):
+    """
+    Start a `dask.distributed` client, registered as the default scheduler.
+
+    Connects to the scheduler at `scheduler_address` if given. Otherwise
+    starts a `LocalCluster` of worker processes on this machine, which
+    avoids GIL contention between tasks, bounds each worker's memory and
+    spills to disk under memory pressure. The workers get the memory
+    thresholds of `WORKER_MEMORY_THRESHOLDS`, without changing the global
+    Dask configuration.
+
+    Scripts calling this must run their main code under
+    `if __name__ == "__main__":`, as worker processes import the main module.
+
+    Parameters
+    ----------
+    scheduler_address : str, optional
+        Address of a running scheduler, e.g. `tcp://127.0.0.1:8786`.
+    n_workers : int, optional
+        Number of worker processes. Dask picks one from the CPU count by
+        default.
+    threads_per_worker : int, optional
+        Threads per worker process. The default is 1.
+    memory_limit : str, optional
+        Memory limit per worker, e.g. "4GB", or "auto" to share the machine's
+        memory between workers. The default is "auto".
+    spill_dir : str, optional
+        Directory for workers' spilled data. The default is a temporary
+        directory.
+    processes : bool, optional
+        Whether workers are processes, rather than threads of this process.
+        The default is True.
+
+    Returns
+    -------
+    client : dask.distributed.Client
+    """
+    try:
+        from dask.distributed import Client, LocalCluster
+    except ImportError as e:
+        raise ImportError(
+            "dask.distributed is required for a Dask cluster: "
+            "install the DISTRIBUTED extra, or the `distributed` package"
+            ) from e
+
+    if scheduler_address is not None:
+        logger.info(f"connecting to Dask scheduler at {scheduler_address}")
+        return Client(scheduler_address)
+
+    # workers read the configuration as they start
+    with dask.config.set(WORKER_MEMORY_THRESHOLDS):
+        cluster = LocalCluster(
+            n_workers=n_workers,
+            threads_per_worker=threads_per_worker,
+            memory_limit=memory_limit,
+            local_directory=spill_dir,
+            processes=processes,
+        )
+    client = Client(cluster)
+    logger.info(f"started local Dask cluster, dashboard at {client.dashboard_link}")
+    return client
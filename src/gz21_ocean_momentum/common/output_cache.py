@@ -0,0 +1,210 @@
+"""Content-addressed cache of finished outputs, such as the data step's.
+
+Outputs are stored under a key hashing the parameters they were computed with
+and the library version, so that a run with the same parameters can reuse an
+earlier output instead of recomputing it. Each entry is a directory
+`<cache_dir>/<key>` holding the output directory as `output`, and a metadata
+file recording the parameters, creation time and size. Entries are renamed
+into place once complete, so runs may share a cache directory.
+"""
+
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_CACHE_META_NAME = "meta.json"
+
+def library_version() -> str:
+    """Installed version of this package, or "unknown"."""
+    try:
+        return importlib.metadata.version("gz21_ocean_momentum")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+def output_key(params: Mapping, version: Optional[str] = None) -> str:
+    """
+    Cache key of an output: a digest of its JSON-serialisable parameters,
+    independent of their order, and of the library version (by default the
+    installed one).
+    """
+    if version is None:
+        version = library_version()
+    canonical = json.dumps(
+        {"params": params, "version": version}, sort_keys=True, default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+def input_file_param(uri: str) -> str:
+    """
+    Parameter standing for an input file, such as a catalog, given by URI or
+    path. Local paths are made absolute, as they are relative to the working
+    directory, and followed by a digest of the file's contents, so that
+    editing the file changes the key. Remote URIs are kept as given.
+    """
+    if uri.startswith("file://"):
+        path = uri[len("file://"):]
+    elif "://" in uri:
+        return uri
+    else:
+        path = uri
+    path = os.path.abspath(path)
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    except OSError:
+        # left for reading the input to fail on
+        return path
+    return f"{path}#{digest.hexdigest()}"
+
+def lookup_output(cache_dir: str, key: str) -> Optional[str]:
+    """
+    Path of the cached output with this key, or None. Marks the entry as
+    used, for eviction by age.
+    """
+    meta_path = os.path.join(cache_dir, key, OUTPUT_CACHE_META_NAME)
+    try:
+        os.utime(meta_path)
+    except FileNotFoundError:
+        return None
+    return os.path.join(cache_dir, key, "output")
+
+def store_output(
+    cache_dir: str,
+    key: str,
+    out_dir: str,
+    params: Mapping,
+    copy: bool = False,
+) -> str:
+    """
+    Add the finished output in `out_dir` to the cache under `key`, unless
+    an entry already has this key. The output is moved into the cache, and
+    `out_dir` replaced by a symbolic link to it, so that it is not stored
+    twice; it then disappears when the entry is evicted. With `copy`, the
+    output is copied instead, leaving `out_dir` as it was. Returns the path
+    of the cached output.
+    """
+    entry = os.path.join(cache_dir, key)
+    if os.path.exists(entry):
+        return os.path.join(entry, "output")
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_entry = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}.", suffix=".tmp")
+    tmp_output = os.path.join(tmp_entry, "output")
+    moved = False
+    try:
+        if copy:
+            shutil.copytree(out_dir, tmp_output, symlinks=True)
+        else:
+            shutil.move(out_dir, tmp_output)
+            moved = True
+        meta = {
+            "key": key,
+            "params": params,
+            "version": library_version(),
+            "created": time.time(),
+            "size_bytes": _tree_size(os.path.join(tmp_entry, "output")),
+        }
+        with open(os.path.join(tmp_entry, OUTPUT_CACHE_META_NAME), "w") as f:
+            json.dump(meta, f, indent=2, default=str)
+        os.rename(tmp_entry, entry)
+        logger.info(f"cached output {out_dir} as {key} ({meta['size_bytes']} bytes)")
+    except OSError:
+        if moved:
+            shutil.move(tmp_output, out_dir)
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        if not os.path.exists(entry):
+            raise
+        # stored meanwhile by another run
+        return os.path.join(entry, "output")
+    if moved:
+        os.symlink(os.path.abspath(os.path.join(entry, "output")), out_dir,
+                   target_is_directory=True)
+    return os.path.join(entry, "output")
+
+def reuse_output(cached_output: str, out_dir: str, link: bool = False) -> None:
+    """
+    Make `out_dir` (nonexistent or an empty directory) hold a cached output:
+    a copy, or a symbolic link to it with `link`. Linked outputs disappear
+    when the entry is evicted.
+    """
+    if os.path.isdir(out_dir) and not os.path.islink(out_dir):
+        os.rmdir(out_dir)
+    if link:
+        os.symlink(os.path.abspath(cached_output), out_dir, target_is_directory=True)
+    else:
+        shutil.copytree(cached_output, out_dir, symlinks=True)
+
+def list_outputs(cache_dir: str) -> List[Dict]:
+    """
+    Metadata of the cached outputs, least recently used first, with their
+    "path" and "last_used" time added.
+    """
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for name in os.listdir(cache_dir):
+        if name.startswith("."):
+            # entries being stored or evicted
+            continue
+        meta_path = os.path.join(cache_dir, name, OUTPUT_CACHE_META_NAME)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            last_used = os.stat(meta_path).st_mtime
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            # partial or foreign entries
+            continue
+        meta.update(path=os.path.join(cache_dir, name, "output"), last_used=last_used)
+        entries.append(meta)
+    return sorted(entries, key=lambda meta: meta["last_used"])
+
+def evict_outputs(
+    cache_dir: str,
+    max_age: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+) -> List[str]:
+    """
+    Delete cached outputs unused for over `max_age` seconds, then the least
+    recently used until the rest total at most `max_bytes`. Returns the keys
+    of the deleted entries.
+    """
+    entries = list_outputs(cache_dir)
+    total = sum(meta["size_bytes"] for meta in entries)
+    now = time.time()
+    evicted = []
+    for meta in entries:
+        too_old = max_age is not None and now - meta["last_used"] > max_age
+        too_big = max_bytes is not None and total > max_bytes
+        if not (too_old or too_big):
+            continue
+        # rename first, so the entry is never seen partially deleted
+        trash = tempfile.mkdtemp(dir=cache_dir, prefix=f".{meta['key']}.", suffix=".tmp")
+        try:
+            os.rename(os.path.join(cache_dir, meta["key"]), os.path.join(trash, "entry"))
+        except FileNotFoundError:
+            # evicted meanwhile by another run
+            os.rmdir(trash)
+            continue
+        shutil.rmtree(trash)
+        total -= meta["size_bytes"]
+        evicted.append(meta["key"])
+        logger.info(f"evicted cached output {meta['key']}")
+    return evicted
+
+def _tree_size(path: str) -> int:
+    """Total size of the files under a directory, in bytes."""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files)
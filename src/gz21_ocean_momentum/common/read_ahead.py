@@ -0,0 +1,239 @@
+"""Concurrent read-ahead of the chunks of Dask-backed datasets.
+
+Chunks of remote zarr stores are read one task at a time as the Dask scheduler
+reaches them, so computation waits on the store's latency. `ReadAhead` wraps
+a dataset so that its chunks can be read ahead of their use, concurrently in
+background threads and within a byte budget: explicitly, e.g. for the next
+time slabs of a computation, or following sequential reads along time.
+"""
+
+import dask.array as da
+from dask.local import get_sync
+from dask.optimization import cull
+import numpy as np
+import xarray as xr
+
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
+import math
+import threading
+from typing import Dict
+from typing import Mapping
+from typing import Sequence
+from typing import Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ReadAhead:
+    """
+    Reader of the chunks of Dask-backed datasets ahead of their use.
+
+    Datasets passed through `wrap` read each chunk from a buffer if it was
+    read ahead, and otherwise compute it on the spot, as usual. `prefetch`
+    reads the chunks overlapping a selection in background threads; with
+    `depth`, reading a chunk also reads the next `depth` chunks along `dim`.
+    Chunks read ahead are reserved their size against `max_bytes` until
+    used, or released once the computation has passed them without using
+    them (see `release_before`), and no more are read ahead while the
+    budget is used up.
+
+    The wrapped datasets only compute in this process, with Dask's threaded
+    or synchronous schedulers.
+
+    Parameters
+    ----------
+    depth : int, optional
+        Number of chunks to read ahead along `dim` of each chunk read. The
+        default is 0, to read ahead with `prefetch` only.
+    max_bytes : int, optional
+        Budget of chunks read ahead and not used yet, in bytes. The default
+        is 1 GiB.
+    max_workers : int, optional
+        Number of reading threads. The default is 8.
+    dim : str, optional
+        Dimension to read ahead along with `depth`. The default is "time".
+    """
+
+    def __init__(
+        self,
+        depth: int = 0,
+        max_bytes: int = 2**30,
+        max_workers: int = 8,
+        dim: str = "time",
+    ):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+        self.reserved_bytes = 0
+        self.peak_reserved_bytes = 0
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="read-ahead")
+        self._lock = threading.Lock()
+        # wrapped arrays, as (Dask array, dimension names)
+        self._arrays = []
+        # materialised graphs of the wrapped arrays, to cull per chunk cheaply
+        self._graphs: Dict[int, dict] = {}
+        # (array index, chunk index) -> (future of the chunk, bytes reserved)
+        self._ahead: Dict[Tuple[int, Tuple[int, ...]], tuple] = {}
+
+    def wrap(self, ds: xr.Dataset) -> xr.Dataset:
+        """
+        Copy of `ds` whose Dask-backed data variables read through this.
+
+        Each chunk of the wrapped variables is computed on its own, so wrap
+        datasets as opened, before any rechunking: a store chunk split into
+        several chunks by a rechunking done before wrapping would be read
+        once per chunk.
+        """
+        ds = ds.copy()
+        for name, var in ds.data_vars.items():
+            if not isinstance(var.data, da.Array):
+                continue
+            index = len(self._arrays)
+            self._arrays.append((var.data, var.dims))
+            data = da.map_blocks(
+                functools.partial(self._get_chunk, index),
+                chunks=var.data.chunks, dtype=var.dtype, meta=var.data._meta,
+                name=f"read-ahead-{id(self):x}-{var.data.name}")
+            ds[name] = var.copy(data=data)
+        return ds
+
+    def prefetch(self, selection: Mapping[str, slice]) -> int:
+        """
+        Read ahead the chunks of the wrapped datasets overlapping positional
+        `selection` (as for `isel`), in the order of their indices, until the
+        budget is used up. Returns the number of chunks now being read ahead.
+        """
+        started = 0
+        for index, (array, dims) in enumerate(self._arrays):
+            ranges = [
+                _chunk_range(chunks, selection.get(dim, slice(None)))
+                for chunks, dim in zip(array.chunks, dims)]
+            for chunk in itertools.product(*ranges):
+                status = self._start(index, chunk)
+                if status is None:
+                    return started
+                started += status
+        return started
+
+    def release_before(self, position: int) -> int:
+        """
+        Drop the chunks read ahead, but not used, that end at or before
+        `position` along `dim`, e.g. of slabs already computed, freeing their
+        budget. Returns the number of chunks dropped.
+        """
+        with self._lock:
+            behind = []
+            for index, chunk in self._ahead:
+                array, dims = self._arrays[index]
+                if self.dim in dims:
+                    axis = dims.index(self.dim)
+                    if sum(array.chunks[axis][: chunk[axis] + 1]) <= position:
+                        behind.append((index, chunk))
+            self._drop(behind)
+        return len(behind)
+
+    def close(self) -> None:
+        """Stop the reading threads, and drop the chunks read ahead."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._ahead.clear()
+            self.reserved_bytes = 0
+
+    def _get_chunk(self, index: int, block_id: Tuple[int, ...] = None) -> np.ndarray:
+        chunk = tuple(block_id)
+        with self._lock:
+            ahead = self._ahead.pop((index, chunk), None)
+            if self.depth:
+                # reads along dim have passed the chunks over `depth` before
+                # this one, allowing for reads out of order within it
+                self._drop(self._skipped(index, chunk))
+        if self.depth:
+            self._read_ahead_along(index, chunk)
+        if ahead is None:
+            with self._lock:
+                self.misses += 1
+            return self._compute_chunk(index, chunk)
+        future, nbytes = ahead
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self.hits += 1
+                self.reserved_bytes -= nbytes
+
+    def _skipped(self, index: int, chunk: Tuple[int, ...]) -> list:
+        """
+        Chunks read ahead over `depth` chunks before `chunk` along `dim`, at
+        the same position otherwise.
+        """
+        _, dims = self._arrays[index]
+        if self.dim not in dims:
+            return []
+        axis = dims.index(self.dim)
+        return [
+            (i, c) for i, c in self._ahead
+            if i == index and c[axis] < chunk[axis] - self.depth
+            and c[:axis] + c[axis + 1:] == chunk[:axis] + chunk[axis + 1:]]
+
+    def _drop(self, keys) -> None:
+        """Drop chunks read ahead, with the lock held."""
+        for key in keys:
+            future, nbytes = self._ahead.pop(key)
+            future.cancel()
+            self.reserved_bytes -= nbytes
+            self.released += 1
+
+    def _read_ahead_along(self, index: int, chunk: Tuple[int, ...]) -> None:
+        array, dims = self._arrays[index]
+        if self.dim not in dims:
+            return
+        axis = dims.index(self.dim)
+        for step in range(1, self.depth + 1):
+            if chunk[axis] + step >= array.numblocks[axis]:
+                return
+            if self._start(index, chunk[:axis] + (chunk[axis] + step,) + chunk[axis + 1:]) is None:
+                return
+
+    def _start(self, index: int, chunk: Tuple[int, ...]):
+        """
+        Start reading a chunk ahead. Returns 1 if started, 0 if already read
+        ahead, and None if the budget is used up.
+        """
+        array, _ = self._arrays[index]
+        nbytes = math.prod(c[i] for c, i in zip(array.chunks, chunk)) * array.dtype.itemsize
+        with self._lock:
+            if (index, chunk) in self._ahead:
+                return 0
+            if self.reserved_bytes + nbytes > self.max_bytes:
+                logger.debug("read-ahead budget used up")
+                return None
+            self.reserved_bytes += nbytes
+            self.peak_reserved_bytes = max(self.peak_reserved_bytes, self.reserved_bytes)
+            self._ahead[index, chunk] = (
+                self._pool.submit(self._compute_chunk, index, chunk), nbytes)
+        return 1
+
+    def _compute_chunk(self, index: int, chunk: Tuple[int, ...]) -> np.ndarray:
+        array, _ = self._arrays[index]
+        with self._lock:
+            if index not in self._graphs:
+                self._graphs[index] = dict(array.__dask_graph__())
+            graph = self._graphs[index]
+        key = (array.name, *chunk)
+        return get_sync(cull(graph, [key])[0], key)
+
+def _chunk_range(chunks: Sequence[int], selection: slice) -> range:
+    """Indices of the chunks overlapping a slice (with unit step)."""
+    start, stop, _ = selection.indices(sum(chunks))
+    if start >= stop:
+        return range(0)
+    bounds = np.cumsum((0,) + tuple(chunks))
+    first = np.searchsorted(bounds, start, side="right") - 1
+    last = np.searchsorted(bounds, stop, side="left") - 1
+    return range(int(first), int(last) + 1)
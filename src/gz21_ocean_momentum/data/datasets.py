@@ -7,12 +7,15 @@ TODO:
 """
 import warnings
 import bisect
+import json
+import os
 from copy import deepcopy
 from abc import ABC, abstractmethod
 
 import numpy as np
 import torch
 import torch.utils.data as torch
+from torch import from_numpy
 from torch.utils.data import Dataset, ConcatDataset, Subset
 import xarray as xr
 
@@ -115,10 +118,115 @@ def prod(l):
     return l[0] * prod(l[1:])
 
 
+def get_batch(dataset, indices):
+    """
+    Features and targets of the samples of a dataset at `indices`, stacked
+    along a first axis: through the dataset's `get_batch` when it has one,
+    else sample by sample.
+    """
+    if hasattr(dataset, "get_batch"):
+        return dataset.get_batch(indices)
+    samples = [dataset[int(i)] for i in indices]
+    return (np.stack([np.asarray(sample[0]) for sample in samples]),
+            np.stack([np.asarray(sample[1]) for sample in samples]))
+
+
+def _batch_indices(indices, length: int) -> np.ndarray:
+    """Indices of a batch as an integer array, with negative ones wrapped."""
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    if ((indices < -length) | (indices >= length)).any():
+        raise IndexError(f"batch indices out of range for {length} samples")
+    return np.where(indices < 0, indices + length, indices)
+
+
+class _DatasetBatches:
+    """Iterable of the batches of features and targets of a dataset."""
+
+    def __init__(self, dataset, batch_size: int):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for start in range(0, len(self.dataset), self.batch_size):
+            stop = min(start + self.batch_size, len(self.dataset))
+            yield get_batch(self.dataset, np.arange(start, stop))
+
+
 class ArrayTransform(ABC):
+    # whether the transform only selects points of samples, as described by
+    # select_points and plan_key, so that it can be compiled into an
+    # indexing plan
+    selects_points = False
+    # whether fitting depends on the data values rather than, at most, on
+    # their shape. Transforms that do can only be fitted on batches (see
+    # fit_batches) if they implement partial_fit
+    fit_depends_on_values = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # selects_points may be a property, true for some instances
+        if cls.selects_points is not False and cls.plan_key is ArrayTransform.plan_key:
+            raise TypeError(
+                f"{cls.__name__} selects points of samples but does not implement plan_key")
+
     def __call__(self, x):
         return self.transform(x)
 
+    @property
+    def fits_on_batches(self) -> bool:
+        """Whether the transform can be fitted on batches of samples."""
+        return (not self.fit_depends_on_values
+                or type(self).partial_fit is not ArrayTransform.partial_fit)
+
+    def select_points(self, axis: int, length: int):
+        """
+        For transforms that only select points of samples, the positions of
+        the points selected along sample `axis` of `length` points, and the
+        offsets added to their coordinates; None if the axis is unchanged.
+        """
+        return None
+
+    def plan_key(self) -> tuple:
+        """
+        For transforms that only select points of samples, the parameters
+        the selected points depend on, so that compiled plans are rebuilt
+        when they change. Required of such transforms.
+        """
+        raise NotImplementedError
+
+    def start_fit(self) -> bool:
+        """
+        Start a fit by successive calls to `partial_fit`, discarding any
+        previous one. Returns False if the transform keeps its current fit
+        instead, in which case `partial_fit` is not called.
+        """
+        return True
+
+    def partial_fit(self, x):
+        """
+        Update the fit with a batch of samples. Transforms whose fit depends
+        on the data values must implement this to be fitted on batches; the
+        default fits on the batch otherwise.
+        """
+        if self.fit_depends_on_values:
+            raise NotImplementedError(
+                f"{type(self).__name__} cannot be fitted on batches of samples")
+        self.fit(x)
+
+    def fit_batches(self, batches):
+        """
+        Fit on the batches of samples of an iterable, in one pass and
+        constant memory, through `partial_fit`. Transforms whose fit does not
+        depend on the data values are fitted on the first batch only.
+        """
+        if not self.fit_depends_on_values:
+            for batch in batches:
+                self.fit(batch)
+                return
+        elif self.start_fit():
+            for batch in batches:
+                self.partial_fit(batch)
+
     @abstractmethod
     def fit(self, x):
         pass
@@ -127,6 +235,14 @@ class ArrayTransform(ABC):
     def transform(self, x):
         pass
 
+    def transform_batch(self, x):
+        """
+        Apply the transform to a batch of samples stacked along a first axis.
+        Transforms that can, override this to transform the whole batch at
+        once.
+        """
+        return np.stack([self.transform(sample) for sample in x])
+
     @abstractmethod
     def transform_coordinate(self, coord, dim):
         pass
@@ -189,27 +305,55 @@ class DatasetTransformer:
             )
         self.transforms["targets"].add_transform(transform)
 
-    def fit(self, x: Dataset):
+    def fit(self, x: Dataset, batch_size: int = 256):
         """
         Call the fit method of all array transforms in the list
         of features and target transforms on the passed Dataset.
         # TODO Arthur check whether we actually still use this
 
+        The dataset is read in batches, so that it need not fit in memory,
+        and each batch feeds both the features and the targets transforms.
+        A pass over the dataset fits, on each side, the next transform whose
+        fit depends on the data values (e.g. a normalizer), so the dataset is
+        read as many times as the side with the most such transforms has;
+        once in the usual case of at most one per side. Transforms fitted on
+        the shapes only, such as crops, cost no pass: with none of the other
+        kind only the first batch is read. Transforms that cannot be fitted
+        on batches (see `ArrayTransform.fits_on_batches`) are fitted on the
+        whole dataset, read at once.
+
         Parameters
         ----------
         x : torch.utils.data.Dataset
             Pytorch Dataset to use for fitting.
+        batch_size : int, optional
+            Number of samples per batch read from the dataset.
 
         Returns
         -------
         self : DatasetTransformer
             The DatasetTransformer after applying the fitting.
         """
-        # TODO Arthur check this
-        features, targets = x[:]
-        print("TODO HI this is almost certainly used")
-        self.transforms["features"].fit(features)
-        self.transforms["targets"].fit(targets)
+        transforms = (self.transforms["features"], self.transforms["targets"])
+        if not all(t.fits_on_batches for t in transforms):
+            arrays = x[:]
+            for transform, array in zip(transforms, arrays):
+                if not transform.fits_on_batches:
+                    transform.fit(array)
+        fits = [_StreamingFit(t) if t.fits_on_batches else None for t in transforms]
+        if not any(fits):
+            return self
+        for _ in range(max(max(fit.passes for fit in fits if fit), 1)):
+            for fit in filter(None, fits):
+                fit.start_pass()
+            for batch in _DatasetBatches(x, batch_size):
+                for fit, items in zip(fits, batch):
+                    if fit:
+                        fit.update(items)
+                if not any(fit.needs_batches for fit in fits if fit):
+                    break
+            for fit in filter(None, fits):
+                fit.end_pass()
         return self
 
     def transform(self, x):
@@ -231,6 +375,25 @@ class DatasetTransformer:
         new_targets = self.transforms["targets"].transform(targets)
         return new_features, new_targets
 
+    def transform_batch(self, x):
+        """
+        Applies features and targets transforms to batches of samples.
+
+        Parameters
+        ----------
+        x : tuple of (numpy array, numpy array)
+            Features and targets of samples, stacked along a first axis
+
+        Returns
+        -------
+        new_features, new_targets : tuple of (numpy array, numpy array)
+            Transformed features and transformed targets
+        """
+        features, targets = x
+        new_features = self.transforms["features"].transform_batch(features)
+        new_targets = self.transforms["targets"].transform_batch(targets)
+        return new_features, new_targets
+
     def get_features_coords(self, coords):
         """
         Get the coordinates of the transformed features. These might change for instance
@@ -314,22 +477,81 @@ class DatasetTransformer:
 
 
 class ComposeTransforms(ArrayTransform):
+    """
+    Chain of transforms. Runs of consecutive transforms that only select
+    points, such as crops and cyclic repeats, are compiled into one indexing
+    of samples, computed once per sample shape: a view where the selected
+    points are contiguous, else a single gather.
+    """
+
     def __init__(self, *transforms):
         self.transforms = list(transforms)
+        self._plan = None
+
+    @property
+    def fit_depends_on_values(self):
+        return any(t.fit_depends_on_values for t in self.transforms)
+
+    @property
+    def fits_on_batches(self):
+        return all(t.fits_on_batches for t in self.transforms)
 
     def fit(self, x):
         for transform in self.transforms:
             transform.fit(x)
-            y = []
-            for i in range(x.shape[0]):
-                y.append(transform(x[i, ...]))
-            x = np.array(y)
+            x = transform.transform_batch(x)
+
+    def fit_batches(self, batches):
+        """
+        Fit the transforms in order on an iterable of batches, each on the
+        batches transformed by those before it, in constant memory: one
+        pass over the batches per transform whose fit depends on the data
+        values. With several, the iterable must give the same batches on
+        each iteration, as a list or DataLoader does.
+        """
+        fit = _StreamingFit(self)
+        if fit.passes > 1 and iter(batches) is batches:
+            raise TypeError("fitting a chain of transforms requires an iterable "
+                            "giving the batches on each iteration, not an iterator")
+        for _ in range(max(fit.passes, 1)):
+            fit.start_pass()
+            for batch in batches:
+                fit.update(batch)
+                if not fit.needs_batches:
+                    break
+            fit.end_pass()
 
     def transform(self, x):
-        for transform in self.transforms:
-            x = transform(x)
+        for step in self.compile():
+            x = step.transform(x)
         return x
 
+    def transform_batch(self, x):
+        for step in self.compile():
+            x = step.transform_batch(x)
+        return x
+
+    def compile(self) -> list:
+        """
+        Steps applying the chain: transforms of the values as they are, and
+        runs of point-selecting transforms merged into `_IndexPlan`s. Cached
+        until the transforms or their parameters change.
+        """
+        key = tuple(
+            (id(t), t.plan_key()) if t.selects_points else id(t)
+            for t in self.transforms)
+        if self._plan is None or self._plan[0] != key:
+            steps = []
+            for transform in self.transforms:
+                if not transform.selects_points:
+                    steps.append(transform)
+                elif steps and isinstance(steps[-1], _IndexPlan):
+                    steps[-1].transforms.append(transform)
+                else:
+                    steps.append(_IndexPlan([transform]))
+            self._plan = (key, steps)
+        return self._plan[1]
+
     def inverse_transform(self, x):
         for transform in self.transforms[::-1]:
             if hasattr(transform, "inverse_transform"):
@@ -337,22 +559,150 @@ class ComposeTransforms(ArrayTransform):
         return x
 
     def transform_coordinate(self, coord, dim):
-        x = coord
-        for transform in self.transforms:
-            # TODO arthur line below is ugly
-            if isinstance(transform, (CropToNewShape, CyclicRepeat)):
-                x = transform.transform_coordinate(coord, dim)
-        return x
+        # each point-selecting transform knows which sample axis a
+        # coordinate is along, the others leave coordinates unchanged
+        for transform in _chained_transforms(self):
+            if transform.selects_points:
+                coord = transform.transform_coordinate(coord, dim)
+        return coord
 
     def add_transform(self, transform):
         self.transforms.append(transform)
 
 
+def _chained_transforms(transform: ArrayTransform) -> list:
+    """Transforms applied in turn by a transform, nested chains flattened."""
+    if isinstance(transform, ComposeTransforms):
+        return [t for sub in transform.transforms for t in _chained_transforms(sub)]
+    return [transform]
+
+
+class _StreamingFit:
+    """
+    Fit of a chain of transforms on batches pushed to it, over passes
+    through the same stream. Each pass fits, through its `partial_fit`, the
+    next transform whose fit depends on the data values, on the batches
+    transformed by those before it. The other transforms are fitted on the
+    first batch of a pass, or the last one, that reaches them.
+    """
+
+    def __init__(self, transform: ArrayTransform):
+        self.transforms = _chained_transforms(transform)
+        self.passes = sum(t.fit_depends_on_values for t in self.transforms)
+        # number of leading transforms fitted
+        self._fitted = 0
+        self._started = self._fitting = False
+        self._last_batch = None
+
+    @property
+    def needs_batches(self) -> bool:
+        return not self._started or self._fitting
+
+    def start_pass(self):
+        self._started = self._fitting = False
+        self._last_batch = None
+
+    def update(self, batch):
+        if not self.needs_batches:
+            return
+        self._last_batch = batch
+        x = self._apply_fitted(batch)
+        if not self._started:
+            self._started = True
+            x = self._fit_on_shapes(x)
+            if self._fitted < len(self.transforms):
+                self._fitting = self.transforms[self._fitted].start_fit()
+        if self._fitting:
+            self.transforms[self._fitted].partial_fit(x)
+
+    def end_pass(self):
+        if self._started and self._fitted < len(self.transforms):
+            self._fitted += 1
+            self._fit_on_shapes(self._apply_fitted(self._last_batch))
+        self._fitting = False
+
+    def _apply_fitted(self, x):
+        for transform in self.transforms[: self._fitted]:
+            x = transform.transform_batch(x)
+        return x
+
+    def _fit_on_shapes(self, x):
+        """Fit the next transforms up to one depending on the data values."""
+        while (self._fitted < len(self.transforms)
+               and not self.transforms[self._fitted].fit_depends_on_values):
+            transform = self.transforms[self._fitted]
+            transform.fit(x)
+            x = transform.transform_batch(x)
+            self._fitted += 1
+        return x
+
+
+class _IndexPlan:
+    """
+    Run of point-selecting transforms, applied as one indexing of samples.
+    The indexing is computed once per sample shape.
+    """
+
+    def __init__(self, transforms: list):
+        self.transforms = transforms
+        self._indexers = {}
+
+    def axis_points(self, axis: int, length: int):
+        """
+        Positions of the points selected along sample `axis` of `length`
+        points, and offsets of their coordinates, through all transforms.
+        """
+        positions = np.arange(length)
+        offsets = np.zeros(length)
+        for transform in self.transforms:
+            selected = transform.select_points(axis, len(positions))
+            if selected is not None:
+                selected_positions, selected_offsets = selected
+                positions = positions[selected_positions]
+                offsets = offsets[selected_positions] + selected_offsets
+        return positions, offsets
+
+    def indexer(self, shape: tuple) -> tuple:
+        """Index of samples of `shape`."""
+        indexer = self._indexers.get(shape)
+        if indexer is not None:
+            return indexer
+        indexer = []
+        for axis, length in enumerate(shape):
+            positions, _ = self.axis_points(axis, length)
+            if len(positions) == length and (positions == np.arange(length)).all():
+                indexer.append(slice(None))
+            elif len(positions) > 0 and (np.diff(positions) == 1).all():
+                indexer.append(slice(positions[0], positions[-1] + 1))
+            else:
+                indexer.append(positions)
+        gathered = [axis for axis, i in enumerate(indexer) if not isinstance(i, slice)]
+        if len(gathered) > 1:
+            # one gather over the axes from the first to the last gathered,
+            # which keeps them in place
+            axes = range(gathered[0], gathered[-1] + 1)
+            grids = np.ix_(*(
+                np.arange(shape[axis])[indexer[axis]] for axis in axes))
+            for axis, grid in zip(axes, grids):
+                indexer[axis] = grid
+        indexer = tuple(indexer)
+        self._indexers[shape] = indexer
+        return indexer
+
+    def transform(self, x):
+        return x[self.indexer(x.shape)]
+
+    def transform_batch(self, x):
+        return x[(slice(None),) + self.indexer(x.shape[1:])]
+
+
 class CropToNewShape(ArrayTransform):
     """Crops to a new shape. Keeps the array centered, modulo 1 in which case
     the top left is priviledged. If the passed data is smaller than the
     requested shape, the data is unchanged."""
 
+    fit_depends_on_values = False
+
     def __init__(self, height=None, width=None):
         self.height = height
         self.width = width
@@ -360,6 +710,24 @@ class CropToNewShape(ArrayTransform):
     def fit(self, x):
         pass
 
+    @property
+    def selects_points(self):
+        # until fitted, for subclasses fitting on the data
+        return self.height is not None and self.width is not None
+
+    def select_points(self, axis: int, length: int):
+        # samples are cropped along their last two axes, see transform
+        if axis == 1:
+            positions = np.arange(length)[self.get_slice(length, self.height)]
+        elif axis == 2:
+            positions = np.arange(length)[self.get_slice(length, self.width)]
+        else:
+            return None
+        return positions, np.zeros(len(positions))
+
+    def plan_key(self):
+        return (self.height, self.width)
+
     def get_slice(self, length: int, length_to: int):
         d_left = max(0, (length - length_to) // 2)
         d_right = d_left + max(0, (length - length_to)) % 2
@@ -373,12 +741,21 @@ class CropToNewShape(ArrayTransform):
             :, self.get_slice(height, self.height), self.get_slice(width, self.width)
         ]
 
+    def transform_batch(self, x):
+        if self.height is None:
+            self.fit(x)
+        height, width = x.shape[2:]
+        return x[
+            ..., self.get_slice(height, self.height), self.get_slice(width, self.width)
+        ]
+
     def transform_coordinate(self, coords, dim):
         length = len(coords)
         if dim == "height":
             return coords[self.get_slice(length, self.height)]
         if dim == "width":
             return coords[self.get_slice(length, self.width)]
+        return coords
 
     def __repr__(self):
         return f"CropToNewShape({self.height}, {self.width})"
@@ -388,6 +765,9 @@ class CyclicRepeat(ArrayTransform):
     """Repeats the dataset in a cyclic way. The provided data should
     cover a complete cycle, with no repetition."""
 
+    selects_points = True
+    fit_depends_on_values = False
+
     def __init__(self, axis: int, dim_name: str, cycle_length: float, nb_points: int):
         """
         Constructor.
@@ -423,12 +803,33 @@ class CyclicRepeat(ArrayTransform):
     def fit(self, x):
         pass
 
+    def select_points(self, axis: int, length: int):
+        if axis != self.axis:
+            return None
+        nb = self.nb_points
+        points = np.arange(length)
+        positions = np.concatenate((
+            np.take(points, np.arange(-nb, 0)), points, np.take(points, np.arange(nb))))
+        offsets = np.concatenate((
+            np.full(nb, -self.length), np.zeros(length), np.full(nb, self.length)))
+        return positions, offsets
+
+    def plan_key(self):
+        return (self.axis, self.length, self.nb_points)
+
     def transform(self, x):
         nb = self.nb_points
         left = np.take(x, np.arange(-nb, 0), self.axis)
         right = np.take(x, np.arange(nb), self.axis)
         return np.concatenate((left, x, right), axis=self.axis)
 
+    def transform_batch(self, x):
+        nb = self.nb_points
+        axis = self.axis + 1
+        left = np.take(x, np.arange(-nb, 0), axis)
+        right = np.take(x, np.arange(nb), axis)
+        return np.concatenate((left, x, right), axis=axis)
+
     def transform_coordinate(self, coords, dim):
         if dim == self.dim_name:
             left = coords[-self.nb_points :] - self.length
@@ -462,6 +863,8 @@ class CropToMultipleof(CropToNewShape):
 
 
 class SignedSqrt(ArrayTransform):
+    fit_depends_on_values = False
+
     def fit(self, x):
         pass
 
@@ -469,23 +872,132 @@ class SignedSqrt(ArrayTransform):
         x = np.sign(x) * np.sqrt(np.abs(x))
         return x
 
+    def transform_batch(self, x):
+        # elementwise
+        return self.transform(x)
+
     def inverse_transform(self, x):
         return x**2 * torch.sign(x)
 
 
-class PerChannelNormalizer(ArrayTransform):
-    def __init__(self, use_mean=False, fit_only_once=False):
+class RunningMoments:
+    """
+    Mean and variance over some axes of a stream of arrays, in one pass.
+
+    Each batch's moments are computed in two passes over the batch, then
+    merged into the running ones with the pairwise update of Chan et al.
+    Running moments of separate streams, e.g. of subdomains fitted in
+    parallel, merge the same way.
+
+    Parameters
+    ----------
+    axis : int or tuple of int
+        Axes reduced over, kept with length one in the moments.
+    """
+
+    def __init__(self, axis=0):
+        self.axis = axis
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    def update(self, x: np.ndarray):
+        """Add the values of a batch. Returns self."""
+        x = np.asarray(x, dtype=np.float64)
+        count = int(np.prod([x.shape[axis] for axis in np.atleast_1d(self.axis)]))
+        mean = np.mean(x, axis=self.axis, keepdims=True)
+        m2 = np.sum((x - mean) ** 2, axis=self.axis, keepdims=True)
+        self._merge(count, mean, m2)
+        return self
+
+    def merge(self, other: "RunningMoments"):
+        """Add the values of another stream's running moments. Returns self."""
+        self._merge(other.count, other.mean, other._m2)
+        return self
+
+    def _merge(self, count, mean, m2):
+        if count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self._m2 = count, mean, m2
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self._m2 = self._m2 + m2 + delta**2 * (self.count * count / total)
+        self.count = total
+
+    @property
+    def var(self):
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class _MomentsNormalizer(ArrayTransform):
+    """
+    Normalizer by moments over some axes of batches of samples, fitted in
+    one pass over a stream of batches with `RunningMoments`.
+    """
+
+    # axes of batches of samples the moments are taken over
+    moments_axis = 0
+
+    def __init__(self, fit_only_once=False):
         self.fit_only_once = fit_only_once
         self._std = None
         self._mean = None
-        self._use_mean = use_mean
+        self._moments = None
+        self._dtype = None
 
     def fit(self, x: np.ndarray):
-        if (not self.fit_only_once) or (self._mean is None):
-            mean = np.mean(x, axis=(0, 2, 3), keepdims=True)
-            std = np.std(x, axis=(0, 2, 3), keepdims=True)
-            self._mean = mean.reshape(mean.shape[1:])
-            self._std = std.reshape(std.shape[1:])
+        self.fit_batches([x])
+
+    def start_fit(self):
+        if self.fit_only_once and self._mean is not None:
+            return False
+        self._moments = None
+        return True
+
+    def partial_fit(self, x: np.ndarray):
+        if self._moments is None:
+            self._moments = RunningMoments(self.moments_axis)
+            self._dtype = np.result_type(x, np.float32)
+        self._moments.update(x)
+        self._set_moments()
+
+    def merge(self, other: "_MomentsNormalizer"):
+        """
+        Add the moments fitted by another normalizer, e.g. on another
+        subdomain. An unfitted one adds nothing.
+        """
+        if other._moments is None:
+            return self
+        if self._moments is None:
+            self._moments = RunningMoments(self.moments_axis)
+            self._dtype = other._dtype
+        self._moments.merge(other._moments)
+        self._set_moments()
+        return self
+
+    def _set_moments(self):
+        mean, std = self._moments.mean, self._moments.std
+        self._mean = mean.reshape(mean.shape[1:]).astype(self._dtype)
+        self._std = std.reshape(std.shape[1:]).astype(self._dtype)
+
+    def transform_coordinate(self, coord, dim):
+        # values only
+        return coord
+
+
+class PerChannelNormalizer(_MomentsNormalizer):
+    moments_axis = (0, 2, 3)
+
+    def __init__(self, use_mean=False, fit_only_once=False):
+        super().__init__(fit_only_once)
+        self._use_mean = use_mean
 
     def transform(self, x: np.ndarray):
         assert self._mean is not None
@@ -493,6 +1005,10 @@ class PerChannelNormalizer(ArrayTransform):
             x = x - self._mean
         return x / self._std
 
+    def transform_batch(self, x):
+        # per-channel statistics broadcast over the batch
+        return self.transform(x)
+
     def inverse_transform(self, X):
         if self._use_mean:
             return X * self._std + self._mean
@@ -500,12 +1016,18 @@ class PerChannelNormalizer(ArrayTransform):
 
 
 class FixedNormalizer(ArrayTransform):
+    fit_depends_on_values = False
+
     def fit(self, x):
         pass
 
     def transform(self, x):
         return x / self.std
 
+    def transform_batch(self, x):
+        # elementwise
+        return self.transform(x)
+
     def inverse_transform(self, x):
         return x * self.std
 
@@ -530,24 +1052,29 @@ class ArctanPerChannelNormalizer(PerChannelNormalizer):
             x = x - self._mean
         return np.arctan(x)
 
+    def transform_batch(self, x):
+        # per-channel statistics broadcast over the batch
+        return self.transform(x)
 
-class PerLocationNormalizer(ArrayTransform):
-    def __init__(self):
-        self._std = None
-        self._mean = None
 
-    def fit(self, x: np.ndarray):
-        mean = np.mean(x, axis=0, keepdims=True)
-        std = np.std(x, axis=0, keepdims=True)
-        self._mean = mean.reshape(mean.shape[1:])
-        self._std = std.reshape(std.shape[1:])
+class PerLocationNormalizer(_MomentsNormalizer):
+    moments_axis = 0
+
+    def __init__(self):
+        super().__init__()
 
     def transform(self, x: np.ndarray):
         assert self._mean is not None
         return (x - self._mean) / self._std
 
+    def transform_batch(self, x):
+        # per-location statistics broadcast over the batch
+        return self.transform(x)
+
 
 class PerInputNormalizer(ArrayTransform):
+    fit_depends_on_values = False
+
     def fit(self, x):
         pass
 
@@ -566,6 +1093,9 @@ class RawDataFromXrDataset(Dataset):
         self.input_arrays = []
         self.output_arrays = []
         self.index = None
+        # set by materialize
+        self._features_array = None
+        self._targets_array = None
 
     @property
     def output_coords(self):
@@ -584,6 +1114,7 @@ class RawDataFromXrDataset(Dataset):
     @index.setter
     def index(self, index: str):
         self._index = index
+        self._features_array = self._targets_array = None
 
     @property
     def output_arrays(self):
@@ -594,6 +1125,7 @@ class RawDataFromXrDataset(Dataset):
         for array_name in str_list:
             self._check_varname(array_name)
         self._output_arrays = str_list
+        self._features_array = self._targets_array = None
 
     @property
     def input_arrays(self):
@@ -604,6 +1136,7 @@ class RawDataFromXrDataset(Dataset):
         for array_name in str_list:
             self._check_varname(array_name)
         self._input_arrays = str_list
+        self._features_array = self._targets_array = None
 
     @property
     def features(self):
@@ -624,10 +1157,39 @@ class RawDataFromXrDataset(Dataset):
     def add_output(self, varname):
         self._check_varname(varname)
         self._output_arrays.append(varname)
+        self._features_array = self._targets_array = None
 
     def add_input(self, varname: str):
         self._check_varname(varname)
         self._input_arrays.append(varname)
+        self._features_array = self._targets_array = None
+
+    def materialize(self, dtype=np.float32):
+        """
+        Load the features and targets into contiguous in-memory arrays, so
+        that getting samples is a plain array slice rather than an xarray
+        selection and a Dask computation.
+
+        Call once the index, inputs and outputs are set; changing them
+        afterwards reverts to reading from the xarray dataset.
+
+        Parameters
+        ----------
+        dtype : numpy dtype, optional
+            Data type of the arrays. The default is float32.
+
+        Returns
+        -------
+        self : RawDataFromXrDataset
+        """
+        self._features_array = self._to_contiguous(self.features, dtype)
+        self._targets_array = self._to_contiguous(self.targets, dtype)
+        return self
+
+    def _to_contiguous(self, ds: xr.Dataset, dtype) -> np.ndarray:
+        """Variables of `ds` stacked as (index, variable, ...) samples."""
+        array = ds.to_array().transpose(self._index, "variable", ...)
+        return np.ascontiguousarray(array.values, dtype=dtype)
 
     @property
     def width(self):
@@ -660,6 +1222,8 @@ class RawDataFromXrDataset(Dataset):
         return len(self.xr_dataset[y_dim_name])
 
     def __getitem__(self, index):
+        if self._features_array is not None:
+            return self._features_array[index], self._targets_array[index]
         try:
             features = self.features.isel({self._index: index})
             features = features.to_array().data
@@ -680,6 +1244,23 @@ class RawDataFromXrDataset(Dataset):
             targets = targets.compute()
         return features, targets
 
+    def get_batch(self, indices):
+        """
+        Features and targets of the samples at `indices`, stacked along a
+        first axis. The samples are read with one selection, of the sorted
+        unique indices.
+        """
+        indices = _batch_indices(indices, len(self))
+        unique, inverse = np.unique(indices, return_inverse=True)
+        features, targets = self[unique]
+        if len(unique) == len(indices) and (unique == indices).all():
+            return features, targets
+        return features[inverse], targets[inverse]
+
+    def __getitems__(self, indices):
+        features, targets = self.get_batch(indices)
+        return list(zip(features, targets))
+
     def __len__(self):
         """
         Return the number of samples of the datasets. Requires that the
@@ -713,6 +1294,120 @@ class RawDataFromXrDataset(Dataset):
             return getattr(self.xr_dataset, attr_name)
         raise AttributeError()
 
+class ShardDataset(Dataset):
+    """
+    Pytorch Dataset of samples stored in `.npy` shards, as written by
+    `lib.model.write_training_shards`, read through memory maps.
+
+    Samples are zero-copy `torch.from_numpy` views of the shards (after any
+    added transforms, e.g. the crops of `ConcatDataset_`, which are no-ops on
+    shards of a common shape). Shards are mapped lazily in each process, so
+    DataLoader workers share the OS page cache rather than copying data.
+
+    Parameters
+    ----------
+    shard_dir : str
+        Directory of the shards of one subdomain, with their index file.
+    """
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, self.INDEX_NAME)) as f:
+            self.index_meta = json.load(f)
+        sizes = [shard["n_samples"] for shard in self.index_meta["shards"]]
+        self._offsets = np.cumsum([0] + sizes)
+        self.features_transform = ComposeTransforms()
+        self.targets_transform = ComposeTransforms()
+        self._shards = None
+
+    def __getstate__(self):
+        # workers map the shards themselves
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    @property
+    def n_features(self):
+        return self.index_meta["features_shape"][0]
+
+    @property
+    def n_targets(self):
+        return self.index_meta["targets_shape"][0]
+
+    @property
+    def height(self):
+        return self.index_meta["features_shape"][1]
+
+    @property
+    def width(self):
+        return self.index_meta["features_shape"][2]
+
+    @property
+    def output_height(self):
+        return self.index_meta["targets_shape"][1]
+
+    @property
+    def output_width(self):
+        return self.index_meta["targets_shape"][2]
+
+    def add_features_transform(self, transform):
+        self.features_transform.add_transform(transform)
+
+    def add_targets_transform(self, transform):
+        self.targets_transform.add_transform(transform)
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def _mapped_shards(self):
+        """Memory maps of the (features, targets) shards, mapped once per process."""
+        if self._shards is None:
+            # copy-on-write maps are writable, as from_numpy expects
+            self._shards = [
+                tuple(np.load(os.path.join(self.shard_dir, shard[name]), mmap_mode="c")
+                      for name in ("features", "targets"))
+                for shard in self.index_meta["shards"]]
+        return self._shards
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"sample {index} out of range for {len(self)} samples")
+        shard = int(np.searchsorted(self._offsets, index, side="right")) - 1
+        features, targets = self._mapped_shards()[shard]
+        position = index - self._offsets[shard]
+        return (
+            from_numpy(self.features_transform(features[position])),
+            from_numpy(self.targets_transform(targets[position])))
+
+    def get_batch(self, indices):
+        """
+        Features and targets of the samples at `indices`, stacked along a
+        first axis, read from each shard at once.
+        """
+        mapped = self._mapped_shards()
+        indices = _batch_indices(indices, len(self))
+        shards = np.searchsorted(self._offsets, indices, side="right") - 1
+        features = np.empty((len(indices), *self.index_meta["features_shape"]),
+                            self.index_meta["dtype"])
+        targets = np.empty((len(indices), *self.index_meta["targets_shape"]),
+                           self.index_meta["dtype"])
+        for shard in np.unique(shards):
+            selected = shards == shard
+            positions = indices[selected] - self._offsets[shard]
+            features[selected] = mapped[shard][0][positions]
+            targets[selected] = mapped[shard][1][positions]
+        return (self.features_transform.transform_batch(features),
+                self.targets_transform.transform_batch(targets))
+
+    def __getitems__(self, indices):
+        features, targets = self.get_batch(indices)
+        return [(from_numpy(f), from_numpy(t)) for f, t in zip(features, targets)]
+
+
 class DatasetWithTransform:
     def __init__(self, dataset, transform: DatasetTransformer):
         self.dataset = dataset
@@ -764,18 +1459,22 @@ class DatasetWithTransform:
         return self[0][1].shape[2]
 
     def __getitem__(self, index: int):
-        raw_features, raw_targets = self.dataset[index]
-        new_features, new_targets = [], []
         if hasattr(index, "__iter__"):
-            n_samples = raw_features.shape[0]
-            # The following is because the transform applies to a single sample
-            for i in range(n_samples):
-                temp = self.transform((raw_features[i, ...], raw_targets[i, ...]))
-                new_features.append(temp[0])
-                new_targets.append(temp[1])
-            return np.stack(new_features), np.stack(new_targets)
+            return self.get_batch(index)
         return self.transform(self.dataset[index])
 
+    def get_batch(self, indices):
+        """
+        Transformed features and targets of the samples at `indices`,
+        stacked along a first axis: read as one batch from the underlying
+        dataset, then transformed as a batch.
+        """
+        return self.transform.transform_batch(get_batch(self.dataset, indices))
+
+    def __getitems__(self, indices):
+        features, targets = self.get_batch(indices)
+        return list(zip(features, targets))
+
     def __getattr__(self, attr):
         if hasattr(self.dataset, attr):
             return getattr(self.dataset, attr)
@@ -852,6 +1551,18 @@ class Subset_(Subset):
         new_coords["time"] = new_coords["time"][self.indices]
         return new_coords
 
+    def get_batch(self, indices):
+        """
+        Features and targets of the samples at `indices`, stacked along a
+        first axis, read as one batch from the underlying dataset.
+        """
+        indices = _batch_indices(indices, len(self))
+        return get_batch(self.dataset, np.asarray(self.indices)[indices])
+
+    def __getitems__(self, indices):
+        features, targets = self.get_batch(indices)
+        return list(zip(features, targets))
+
     def __getattr__(self, attr):
         if hasattr(self.dataset, attr):
             return getattr(self.dataset, attr)
@@ -913,8 +1624,36 @@ class ConcatDataset_(ConcatDataset):
             dataset.add_features_transform(crop_transform)
             dataset.add_targets_transform(crop_transform)
 
+    def get_batch(self, indices):
+        """
+        Features and targets of the samples at `indices`, stacked along a
+        first axis, read as one batch from each concatenated dataset.
+        """
+        indices = _batch_indices(indices, len(self))
+        which = np.searchsorted(self.cumulative_sizes, indices, side="right")
+        features = targets = None
+        for i in np.unique(which):
+            selected = which == i
+            start = self.cumulative_sizes[i - 1] if i > 0 else 0
+            batch_features, batch_targets = get_batch(
+                self.datasets[i], indices[selected] - start)
+            if features is None:
+                features = np.empty(
+                    (len(indices), *batch_features.shape[1:]), batch_features.dtype)
+                targets = np.empty(
+                    (len(indices), *batch_targets.shape[1:]), batch_targets.dtype)
+            features[selected] = batch_features
+            targets[selected] = batch_targets
+        return features, targets
+
+    def __getitems__(self, indices):
+        features, targets = self.get_batch(indices)
+        return list(zip(features, targets))
+
     def __getattr__(self, attr):
-        if hasattr(self.datasets[0], attr):
+        # not protocol methods such as __getitems__, which the DataLoader
+        # would then call with indices over all datasets
+        if not attr.startswith("__") and hasattr(self.datasets[0], attr):
             return getattr(self.datasets[0], attr)
         raise AttributeError()
 
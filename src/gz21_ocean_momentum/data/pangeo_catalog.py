@@ -6,6 +6,8 @@ import intake
 import xarray as xr
 import numpy as np
 
+from gz21_ocean_momentum.common.read_ahead import ReadAhead
+
 from intake.config import conf
 
 CATALOG_URL = "https://raw.githubusercontent.com/pangeo-data/pangeo-datastore\
@@ -18,6 +20,8 @@ def get_patch(
     bounds: list = None,
     CO2_level=0,
     *selected_vars,
+    read_ahead: int = 0,
+    read_ahead_bytes: int = 2**30,
 ):
     """
     Return a tuple with a patch of uv velocities along with the grid details.
@@ -36,6 +40,13 @@ def get_patch(
         The default is 0.
     *selected_vars : str
         Variables selected from the surface velocities dataset.
+    read_ahead : int, optional
+        Number of time chunks to read ahead of each chunk of velocities read,
+        concurrently in background threads (see `ReadAhead`). Speeds up
+        sequential passes over time. The default is 0, for no read-ahead.
+    read_ahead_bytes : int, optional
+        Memory budget of the chunks read ahead and not used yet, in bytes.
+        The default is 1 GiB.
 
     Returns
     -------
@@ -65,9 +76,11 @@ def get_patch(
     if ntimes is not None:
         uv_data = uv_data.isel(time=slice(0, ntimes))
 
-    if len(selected_vars) == 0:
-        return uv_data, grid_data
-    return uv_data[list(selected_vars)], grid_data
+    if len(selected_vars) > 0:
+        uv_data = uv_data[list(selected_vars)]
+    if read_ahead > 0:
+        uv_data = ReadAhead(read_ahead, read_ahead_bytes).wrap(uv_data)
+    return uv_data, grid_data
 
 
 def get_grid():
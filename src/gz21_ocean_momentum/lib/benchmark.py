@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Data step benchmarks on synthetic CM2.6 data."""
+
+import gz21_ocean_momentum.lib.data as data
+import gz21_ocean_momentum.lib.synthetic as synthetic
+
+import xarray as xr
+import dask
+import numpy as np
+import scipy
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import os
+import platform
+import resource
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stages timed on a whole in-memory block, in a single thread, and the whole
+# computation over Dask chunks, swept over schedulers and worker counts.
+STAGES = ("advection", "filter", "coarsen", "end_to_end")
+SCHEDULERS = ("threads", "processes", "synchronous")
+
+def run_data_benchmarks(
+    ny: int = 540,
+    nx: int = 720,
+    n_times: int = 8,
+    scales: Sequence[int] = (4,),
+    stages: Sequence[str] = STAGES,
+    schedulers: Sequence[str] = ("threads",),
+    workers: Sequence[Optional[int]] = (None,),
+    time_chunks: Sequence[int] = (1,),
+    tile_sizes: Sequence[Optional[Tuple[int, int]]] = (None,),
+    filter_backend: str = "direct",
+    dtype: np.dtype = np.float64,
+    repeats: int = 3,
+    seed: int = 0,
+) -> Dict:
+    """
+    Benchmark the forcing computation on synthetic CM2.6 data (see
+    `lib.synthetic`).
+
+    The "advection", "filter" and "coarsen" stages time `advections`,
+    `spatial_filter_dataset` of the velocities, and the fused filtering and
+    coarsening of the advection terms (`spatial_filter_and_coarsen_dataset`)
+    on the whole in-memory input. "end_to_end" computes
+    `map_forcings_over_blocks` over the input chunked along time, for each
+    combination of scheduler, worker count, time chunk and tile size.
+
+    Parameters
+    ----------
+    ny, nx, n_times : int, optional
+        Input size. The defaults are 540, 720 and 8.
+    scales : sequence of int, optional
+        Coarsening factors, benchmarked separately. The default is (4,).
+    stages : sequence of str, optional
+        Stages to run, among `STAGES`. The default is all.
+    schedulers : sequence of str, optional
+        Dask schedulers for "end_to_end", among `SCHEDULERS`. The default is
+        ("threads",).
+    workers : sequence of int or None, optional
+        Worker counts for "end_to_end"; None is Dask's default (one per core).
+    time_chunks : sequence of int, optional
+        Input time chunk sizes for "end_to_end". The default is (1,).
+    tile_sizes : sequence of (int, int) or None, optional
+        Tile sizes for "end_to_end", see `map_forcings_over_blocks`. The
+        default is (None,), for whole chunks.
+    filter_backend : str, optional
+        Spatial filter backend. The default is "direct".
+    dtype : numpy dtype, optional
+        Precision of the computation. The default is float64.
+    repeats : int, optional
+        Number of runs per case; the fastest is reported. The default is 3.
+    seed : int, optional
+        Random seed of the synthetic data. The default is 0.
+
+    Returns
+    -------
+    report : dict
+        JSON-serialisable "environment" and "config", and "results": one
+        record per case with its parameters, "seconds" (fastest run),
+        "mean_seconds", "points_per_second" (high-resolution grid points
+        times time points, per second), "peak_rss_bytes" (of this process
+        and its children during the fastest run) and "n_tasks" (Dask tasks,
+        None for in-memory stages).
+    """
+    unknown = set(stages) - set(STAGES) | set(schedulers) - set(SCHEDULERS)
+    if unknown:
+        raise ValueError(f"unknown stages or schedulers: {sorted(unknown)}")
+    dtype = np.dtype(dtype)
+
+    logger.info(f"generating synthetic input of {n_times}x{ny}x{nx} points...")
+    grid = synthetic.synthetic_cm2_6_grid(ny, nx, seed=seed)
+    u_v = synthetic.synthetic_cm2_6_surface(grid, n_times, seed=seed).compute()
+    grid = grid.reset_coords()[["dxu", "dyu", "wet"]]
+    u_v = u_v.astype(dtype)
+    # the stages run on land filled with zeros, as in the forcing computation
+    filled = u_v.fillna(0.0)
+    n_points = n_times * ny * nx
+
+    results = []
+
+    def record(stage, scale, run, n_tasks=None, **params):
+        timings = [_time_with_peak_rss(run) for _ in range(repeats)]
+        seconds, peak_rss = min(timings)
+        results.append({
+            "stage": stage, "factor": scale, **params,
+            "seconds": seconds,
+            "mean_seconds": sum(t for t, _ in timings) / len(timings),
+            "points_per_second": n_points / seconds,
+            "peak_rss_bytes": peak_rss,
+            "n_tasks": n_tasks,
+        })
+        logger.info(
+            f"{stage}, factor {scale}, {params}: {seconds:.3f}s, "
+            f"{n_points / seconds:.3g} points/s")
+
+    for scale in scales:
+        sigma = scale / 2
+        terms = data.grid_filter_terms(grid, sigma, dtype)
+        if "advection" in stages:
+            record("advection", scale, lambda: data.advections(filled, grid))
+        if "filter" in stages:
+            record("filter", scale, lambda: data.spatial_filter_dataset(
+                filled, grid, sigma, filter_backend, terms))
+        if "coarsen" in stages:
+            adv = data.advections(filled, grid)
+            record("coarsen", scale, lambda: data.spatial_filter_and_coarsen_dataset(
+                adv, grid, sigma, scale, terms))
+        if "end_to_end" not in stages:
+            continue
+        for scheduler, n_workers, time_chunk, tile_size in itertools.product(
+                schedulers, workers, time_chunks, tile_sizes):
+            forcings = data.map_forcings_over_blocks(
+                u_v.chunk({"time": time_chunk}), grid, [scale], tile_size,
+                filter_backend=filter_backend, grid_terms={scale: terms},
+                dtype=dtype)[scale]
+            config = {"scheduler": scheduler}
+            pool = None
+            if scheduler == "processes":
+                # start the workers beforehand, to time the computation only
+                n_processes = n_workers or os.cpu_count()
+                pool = ProcessPoolExecutor(
+                    n_processes, mp_context=multiprocessing.get_context("spawn"))
+                list(pool.map(abs, range(n_processes)))
+                config["pool"] = pool
+            elif n_workers is not None:
+                config["num_workers"] = n_workers
+            try:
+                record(
+                    "end_to_end", scale,
+                    lambda: dask.compute(forcings, **config),
+                    n_tasks=len(forcings.__dask_graph__()),
+                    scheduler=scheduler, workers=n_workers, time_chunk=time_chunk,
+                    tile_size=None if tile_size is None else list(tile_size))
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+
+    return {
+        "environment": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "dask": dask.__version__,
+            "xarray": xr.__version__,
+        },
+        "config": {
+            "shape": [n_times, ny, nx],
+            "scales": list(scales),
+            "filter_backend": filter_backend,
+            "dtype": dtype.name,
+            "repeats": repeats,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+def _time_with_peak_rss(run: Callable, interval: float = 0.01) -> Tuple[float, int]:
+    """
+    Time `run()`, sampling the resident memory of this process and its
+    children meanwhile. Returns `(seconds, peak_rss_bytes)`.
+    """
+    peak = _rss_bytes()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, _rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        run()
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return seconds, max(peak, _rss_bytes())
+
+def _rss_bytes() -> int:
+    """
+    Resident memory of this process and its child processes, from `/proc`.
+    Falls back to the peak of this process over its lifetime elsewhere.
+    """
+    try:
+        pids = [os.getpid()]
+        for tid in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        total = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except FileNotFoundError:
+                pass
+        return total
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if platform.system() == "Darwin" else maxrss * 1024
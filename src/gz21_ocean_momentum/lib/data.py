@@ -2,19 +2,43 @@
 # -*- coding: utf-8 -*-
 """Data step API: CM2.6 downloading, forcing generation and coarsening."""
 
+from gz21_ocean_momentum.common.bounding_box import BoundingBox
+import gz21_ocean_momentum.common.chunk_cache as chunk_cache
+
 import xarray as xr
 import intake
-from scipy.ndimage import gaussian_filter
+import dask
+from scipy.ndimage import correlate1d
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import fftconvolve
 import numpy as np
 
+from collections import OrderedDict
+from functools import lru_cache
+from functools import partial
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Mapping
 from typing import Optional
+from typing import Sequence
 from typing import Tuple
+from typing import Union
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-def retrieve_cm2_6(catalog_uri: str, co2_increase: bool) -> xr.Dataset:
+def retrieve_cm2_6(
+        catalog_uri: str, co2_increase: bool,
+        cache_dir: Optional[str] = None, cache_size: int = 20 * 2**30,
+        ) -> xr.Dataset:
     """
     Retrieve CM2.6 velocity and grid data (lazily, as Dask arrays)
     via the given Pangeo ocean intake catalog URI.
@@ -23,26 +47,35 @@ def retrieve_cm2_6(catalog_uri: str, co2_increase: bool) -> xr.Dataset:
 
     Will download if given an `http://` URI. Will use local files such as
     `/home/user/catalog.yaml` directly.
+
+    With `cache_dir`, the zarr stores are read through a persistent on-disk
+    chunk cache of up to `cache_size` bytes (see `common.chunk_cache`).
     """
     catalog = intake.open_catalog(catalog_uri)
-    surface_fields = retrieve_cm2_6_velocities(catalog, co2_increase)
-    grid = retrieve_cm2_6_grid(catalog)
+    surface_fields = retrieve_cm2_6_velocities(catalog, co2_increase, cache_dir, cache_size)
+    grid = retrieve_cm2_6_grid(catalog, cache_dir, cache_size)
     return surface_fields, grid
 
-def retrieve_cm2_6_grid(catalog: str) -> xr.Dataset:
+def retrieve_cm2_6_grid(
+        catalog: str,
+        cache_dir: Optional[str] = None, cache_size: int = 20 * 2**30,
+        ) -> xr.Dataset:
     """
     Retrieve CM2.6 grid data (lazily, as a Dask array)
     via the given Pangeo ocean intake catalog.
     """
     grid = catalog.GFDL_CM2_6.GFDL_CM2_6_grid
-    grid = grid.to_dask()
+    grid = _source_to_dask(grid, cache_dir, cache_size)
 
     # transform non-primary coords into vars
     grid = grid.reset_coords()[["dxu", "dyu", "wet"]]
 
     return grid
 
-def retrieve_cm2_6_velocities(catalog: str, co2_increase: bool) -> xr.Dataset:
+def retrieve_cm2_6_velocities(
+        catalog: str, co2_increase: bool,
+        cache_dir: Optional[str] = None, cache_size: int = 20 * 2**30,
+        ) -> xr.Dataset:
     """
     Retrieve CM2.6 velocity data (lazily, as a Dask array)
     via the given Pangeo ocean intake catalog.
@@ -53,24 +86,46 @@ def retrieve_cm2_6_velocities(catalog: str, co2_increase: bool) -> xr.Dataset:
     else:
         logger.info("using control dataset -> no annual CO2 increase")
         surface_fields = catalog.GFDL_CM2_6.GFDL_CM2_6_control_ocean_surface
-    surface_fields = surface_fields.to_dask()
+    surface_fields = _source_to_dask(surface_fields, cache_dir, cache_size)
     return surface_fields
 
+def _source_to_dask(source, cache_dir: Optional[str], cache_size: int) -> xr.Dataset:
+    """
+    Open an intake-xarray zarr source lazily, through the chunk cache in
+    `cache_dir` if given.
+    """
+    if cache_dir is None:
+        return source.to_dask()
+    if hasattr(source, "reader"):
+        # intake 2 reader-based sources
+        data = source.reader.data
+        urlpath, storage_options = data.url, data.storage_options
+        kwargs = {k: v for k, v in source.reader.kwargs.items() if k != "args"}
+    else:
+        urlpath, storage_options = source.urlpath, source.storage_options
+        kwargs = dict(source.kwargs)
+    return chunk_cache.open_cached_zarr(
+        urlpath, cache_dir, cache_size, storage_options, **kwargs)
+
 def cyclize(dim_name: str, ds: xr.Dataset, nb_points: int) -> xr.Dataset:
     """
     Generate a cyclic dataset from non-cyclic input.
 
     Return a cyclic dataset, with `nb_points` added on each end, along
-    the dimension specified by `dim_name`.
+    the dimension specified by `dim_name`. Only the added points are copied
+    (from the opposite end, with coordinates shifted by one cycle), so for
+    Dask-backed input the existing chunks along `dim_name` are kept, with a
+    small chunk added on each end.
 
     Parameters
     ----------
     dim_name: str
         Name of the dimension along which the data is made cyclic.
     ds : xr.Dataset
-        Dataset to process.
+        Dataset to process. Must span one whole cycle along `dim_name`.
     nb_points : int
-        Number of points added on each end.
+        Number of points added on each end. To compute forcings near the
+        edges as on a periodic domain, use at least `forcing_halo(factor)`.
 
     Returns
     -------
@@ -78,18 +133,71 @@ def cyclize(dim_name: str, ds: xr.Dataset, nb_points: int) -> xr.Dataset:
     """
     # 2023-09-20 raehik: old note from original import: "make this flexible"
     cycle_length = 360.0
-    left = ds.roll({dim_name: nb_points}, roll_coords=True)
-    right = left.isel({dim_name: slice(0, 2 * nb_points)})
-    left[dim_name] = xr.concat(
-        (left[dim_name][:nb_points] - cycle_length, left[dim_name][nb_points:]),
-        dim_name,
-    )
-    right[dim_name] = xr.concat(
-        (right[dim_name][:nb_points], right[dim_name][nb_points:] + cycle_length),
-        dim_name,
-    )
-    return xr.concat((left, right), dim_name)
+    if not 0 <= nb_points <= ds.sizes[dim_name]:
+        raise ValueError(
+            f"cannot add {nb_points} points to {dim_name} of size {ds.sizes[dim_name]}")
+    left = ds.isel({dim_name: slice(ds.sizes[dim_name] - nb_points, None)})
+    right = ds.isel({dim_name: slice(0, nb_points)})
+    left = left.assign_coords({dim_name: left[dim_name] - cycle_length})
+    right = right.assign_coords({dim_name: right[dim_name] + cycle_length})
+    return xr.concat((left, ds, right), dim_name)
+
+
+def select_times(
+    u_v_dataset: xr.Dataset,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    stride: int = 1,
+) -> xr.Dataset:
+    """
+    Select time points of a lazy dataset by date range and stride.
+
+    The selection is positional along time, so for Dask-backed input only
+    the time chunks holding selected points are read. Logs a warning when the
+    stride is misaligned with the time chunks, so that these chunks hold more
+    points than are selected and a stride of N cuts reads by less than N.
+
+    Parameters
+    ----------
+    u_v_dataset : xarray Dataset
+        Dataset with a "time" dimension coordinate.
+    start, end : str, optional
+        First and last dates of the range, inclusive, e.g. "0181-01-01".
+        The defaults are the first and last time points.
+    stride : int, optional
+        Select every `stride`-th time point of the range, from its start.
+        The default is 1.
+
+    Returns
+    -------
+    selected : xarray Dataset
+
+    Raises
+    ------
+    ValueError
+        If the stride is not positive, or the range selects no time points.
+    """
+    if stride < 1:
+        raise ValueError(f"time stride must be positive, got {stride}")
+    try:
+        in_range = u_v_dataset.indexes["time"].slice_indexer(start, end)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"invalid time range {start} to {end}: {e!r}") from e
+    positions = np.arange(u_v_dataset.sizes["time"])[in_range][::stride]
+    if len(positions) == 0:
+        raise ValueError(f"time range {start} to {end} selects no time points")
 
+    if u_v_dataset.chunks and stride > 1:
+        chunks = np.array(u_v_dataset.chunks["time"])
+        bounds = np.cumsum(chunks)
+        read = chunks[np.unique(np.searchsorted(bounds, positions, side="right"))].sum()
+        if read > len(positions):
+            logger.warning(
+                f"time stride {stride} is misaligned with input time chunks of "
+                f"{chunks.max()} point(s): reading {read} time points to select "
+                f"{len(positions)}. Reads are cut by the full stride only for "
+                f"input chunked by single time points")
+    return u_v_dataset.isel(time=slice(in_range.start, in_range.stop, stride))
 
 def compute_forcings_and_coarsen_cm2_6_shape(
     u_v_dataset: xr.Dataset,
@@ -107,6 +215,8 @@ def compute_forcings_and_coarsen_cm2_6_shape(
     t2 = t.copy()
     t2 = t2.rename({"usurf": "S_x", "vsurf": "S_y"})
     t = xr.merge((t, t2))
+    for name, type_ in (("S_x", "output"), ("S_y", "output"), ("usurf", "input"), ("vsurf", "input")):
+        t[name].attrs["type"] = type_
 
     return t
 
@@ -116,6 +226,10 @@ def compute_forcings_and_coarsen_cm2_6(
     grid_data: xr.Dataset,
     scale: int,
     nan_or_zero: str = "zero",
+    filter_backend: str = "direct",
+    fused_coarsen: bool = True,
+    grid_terms: Optional[xr.Dataset] = None,
+    dtype: Optional[np.dtype] = None,
 ) -> xr.Dataset:
     """
     Coarsen and compute subgrid forcings for the given ocean surface velocities.
@@ -147,6 +261,22 @@ def compute_forcings_and_coarsen_cm2_6(
         In the second case, remaining zeros after applying the procedure will
         be replaced by NaNs for consistency.
         The default is 'zero'.
+    filter_backend: str, optional
+        Spatial filtering backend, see `spatial_filter_dataset`.
+        The default is 'direct'.
+    fused_coarsen: bool, optional
+        Compute the filtered advection terms directly at low resolution where
+        the grid allows it, see `spatial_filter_and_coarsen_dataset`.
+        The default is True.
+    grid_terms: xarray Dataset, optional
+        Grid-derived terms for sigma `scale / 2` and `dtype`, see
+        `grid_filter_terms`. Computed (or taken from the in-process memo) if
+        not given.
+    dtype: numpy dtype, optional
+        Floating point precision of the computation and of the result.
+        float32 halves memory use and output size, see `precision_report`
+        for its accuracy. The default is the precision of the input
+        velocities (float64 if they are not floating point).
 
     Returns
     -------
@@ -154,32 +284,154 @@ def compute_forcings_and_coarsen_cm2_6(
         Dataset containing the low-resolution velocity field in "usurf" and
         "vsurf", and forcing in data variables "S_x" and "S_y".
     """
+    dtype = forcing_dtype(u_v_dataset, dtype)
+    u_v_dataset = u_v_dataset.astype(dtype)
     # Replace nan values with zeros.
     if nan_or_zero == "zero":
         u_v_dataset = u_v_dataset.fillna(0.0)
 
-    # High res advection terms
-    adv = _advections(u_v_dataset, grid_data)
-    # Filtered advections
-    filtered_adv = _spatial_filter_dataset(adv, grid_data, float(scale)/2)
+    grid_terms = _check_grid_terms(grid_data, scale, grid_terms, dtype)
+    # High res advection terms. The grid metrics serve both advection passes.
+    metrics = _advection_metrics(u_v_dataset, grid_terms)
+    adv = advections(u_v_dataset, grid_data, metrics)
+    return _forcings_from_advections(
+        u_v_dataset, adv, metrics, grid_data, scale, nan_or_zero,
+        filter_backend, fused_coarsen, grid_terms)
+
+def compute_forcings_and_coarsen_cm2_6_multi(
+    u_v_dataset: xr.Dataset,
+    grid_data: xr.Dataset,
+    scales: Sequence[int],
+    nan_or_zero: str = "zero",
+    filter_backend: Union[str, Mapping[int, str]] = "direct",
+    fused_coarsen: bool = True,
+    grid_terms: Optional[Mapping[int, xr.Dataset]] = None,
+    dtype: Optional[np.dtype] = None,
+) -> Dict[int, xr.Dataset]:
+    """
+    `compute_forcings_and_coarsen_cm2_6` for several coarsening factors at
+    once. NaN filling and the high-resolution advection terms are computed
+    once and shared between factors.
+
+    Parameters
+    ----------
+    u_v_dataset, grid_data, nan_or_zero, fused_coarsen, dtype
+        See `compute_forcings_and_coarsen_cm2_6`.
+    scales : sequence of int
+        gaussian filtering & coarsening factors
+    filter_backend : str or mapping from int to str, optional
+        Spatial filtering backend, for all factors or per factor.
+        The default is 'direct'.
+    grid_terms : mapping from int to xarray Dataset, optional
+        Grid-derived terms per factor, see `grid_filter_terms`. Computed (or
+        taken from the in-process memo) for missing factors.
+
+    Returns
+    -------
+    forcings : dict from int to xarray Dataset
+        Forcing dataset per factor.
+    """
+    dtype = forcing_dtype(u_v_dataset, dtype)
+    u_v_dataset = u_v_dataset.astype(dtype)
+    if nan_or_zero == "zero":
+        u_v_dataset = u_v_dataset.fillna(0.0)
+
+    grid_terms = {
+        scale: _check_grid_terms(
+            grid_data, scale, (grid_terms or {}).get(scale), dtype)
+        for scale in scales}
+    # grid metrics are the same for every factor
+    metrics = _advection_metrics(u_v_dataset, grid_terms[scales[0]])
+    adv = advections(u_v_dataset, grid_data, metrics)
+    return {
+        scale: _forcings_from_advections(
+            u_v_dataset, adv, metrics, grid_data, scale, nan_or_zero,
+            _backend_for(filter_backend, scale), fused_coarsen,
+            grid_terms[scale])
+        for scale in scales}
+
+def forcing_dtype(u_v_dataset: xr.Dataset, dtype: Optional[np.dtype]) -> np.dtype:
+    """
+    Precision of the computation: `dtype`, or by default that of the input
+    velocities (float64 if they are not floating point).
+    """
+    if dtype is None:
+        dtype = u_v_dataset["usurf"].dtype
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+    return np.dtype(dtype)
+
+def _check_grid_terms(
+        grid_data: xr.Dataset, scale: int, grid_terms: Optional[xr.Dataset],
+        dtype: np.dtype = np.float64,
+        ) -> xr.Dataset:
+    """
+    Return the given grid terms after checking they are for factor `scale`
+    and `dtype`, or compute them if not given.
+    """
+    sigma = float(scale)/2
+    if grid_terms is None:
+        return grid_filter_terms(grid_data, sigma, dtype)
+    if grid_terms.attrs["sigma"] != sigma:
+        raise ValueError(
+            f"grid terms are for sigma {grid_terms.attrs['sigma']}, not {sigma}")
+    if grid_terms["area_u"].dtype != np.dtype(dtype):
+        raise ValueError(
+            f"grid terms are of dtype {grid_terms['area_u'].dtype}, not {np.dtype(dtype)}")
+    return grid_terms
+
+def _backend_for(filter_backend: Union[str, Mapping[int, str]], scale: int) -> str:
+    """Spatial filtering backend for factor `scale`."""
+    if isinstance(filter_backend, str):
+        return filter_backend
+    return filter_backend[scale]
+
+def _forcings_from_advections(
+    u_v_dataset: xr.Dataset,
+    adv: xr.Dataset,
+    metrics: Tuple[np.ndarray, np.ndarray],
+    grid_data: xr.Dataset,
+    scale: int,
+    nan_or_zero: str,
+    filter_backend: str,
+    fused_coarsen: bool,
+    grid_terms: xr.Dataset,
+) -> xr.Dataset:
+    """
+    Steps of `compute_forcings_and_coarsen_cm2_6` after the high-resolution
+    advection terms `adv` of the (NaN-filled) velocities `u_v_dataset`.
+    """
+    sigma = float(scale)/2
+    def coarsen(ds: xr.Dataset) -> xr.Dataset:
+        return ds.coarsen(
+            {"xu_ocean": scale, "yu_ocean": scale}, boundary="trim"
+        ).mean()
 
     # Filtered u,v field and temperature
-    u_v_filtered = _spatial_filter_dataset(u_v_dataset, grid_data, float(scale)/2)
+    u_v_filtered = spatial_filter_dataset(
+        u_v_dataset, grid_data, sigma, filter_backend, grid_terms)
     # Advection term from filtered velocity field
-    adv_filtered = _advections(u_v_filtered, grid_data)
+    adv_filtered = advections(u_v_filtered, grid_data, metrics)
+
+    # Filtered advections. Only needed at low resolution, so where possible we
+    # filter and coarsen in one go, only evaluating the coarse grid points.
+    # (Coarsening is linear, so coarsening the forcing or each of its terms is
+    # the same.)
+    filtered_adv_coarse = None
+    if fused_coarsen:
+        filtered_adv_coarse = spatial_filter_and_coarsen_dataset(
+            adv, grid_data, sigma, scale, grid_terms)
+    if filtered_adv_coarse is None:
+        filtered_adv_coarse = coarsen(spatial_filter_dataset(
+            adv, grid_data, sigma, filter_backend, grid_terms))
 
     # Forcing
-    ds_forcing = adv_filtered - filtered_adv
+    ds_forcing = coarsen(adv_filtered) - filtered_adv_coarse
     ds_forcing = ds_forcing.rename({"adv_x": "S_x", "adv_y": "S_y"})
     # Merge filtered u,v, temperature and forcing terms
-    ds_merged = ds_forcing.merge(u_v_filtered)
-    logger.debug("uncoarsened forcings follow below:")
-    logger.debug(ds_merged)
-
-    # Coarsen
-    ds_merged_coarse = ds_merged.coarsen(
-        {"xu_ocean": scale, "yu_ocean": scale}, boundary="trim"
-    ).mean()
+    ds_merged_coarse = ds_forcing.merge(coarsen(u_v_filtered))
+    logger.debug("coarsened forcings follow below:")
+    logger.debug(ds_merged_coarse)
 
     if nan_or_zero == "zero":
         # Replace zeros with nans for consistency
@@ -195,10 +447,908 @@ def compute_forcings_and_coarsen_cm2_6(
     return ds_merged_coarse
 
 
-def _advections(u_v_field: xr.Dataset, grid_data: xr.Dataset) -> xr.Dataset:
+def forcing_halo(scale: Union[int, Sequence[int]]) -> int:
+    """
+    Width of the halo, in high-resolution grid points, that a spatial tile
+    needs on each side for `compute_forcings_and_coarsen_cm2_6` to be exact
+    on the tile.
+
+    This is the Gaussian filter radius plus the reach of the advection
+    stencil (two points, see `_advection_kernel`), rounded up to a multiple
+    of `scale` so that tiles stay aligned with the coarse grid. For several
+    factors, the widest halo rounded up to a multiple of all of them.
+    """
+    scales = np.atleast_1d(scale).tolist()
+    radius = max(
+        len(_gaussian_kernel_1d(s)) // 2
+        for scale in scales for s in _spatial_sigmas(float(scale)/2, 2))
+    halo = radius + _ADVECTION_STENCIL_REACH
+    align = math.lcm(*scales)
+    return -(-halo // align) * align
+
+def bounding_box_regions(
+    u_v_dataset: xr.Dataset,
+    bboxes: Sequence[BoundingBox],
+    scales: Sequence[int],
+) -> List[Tuple[Dict[str, slice], Dict[int, Dict[str, slice]]]]:
+    """
+    Input regions needed to compute forcings over bounding boxes.
+
+    Each box's points are extended by a halo of `forcing_halo(scales)` points
+    on each side (within the domain), so forcings at its edges are as if
+    computed over the whole domain. The extension before the box is a
+    multiple of all factors, so coarse cells start at the box's first point.
+
+    Parameters
+    ----------
+    u_v_dataset : xarray Dataset
+        High-resolution dataset with spatial dimensions "yu_ocean" and
+        "xu_ocean".
+    bboxes : sequence of BoundingBox
+        Bounding boxes, inclusive as in `bounding_box.bound_dataset`.
+    scales : sequence of int
+        gaussian filtering & coarsening factors
+
+    Returns
+    -------
+    regions : list of (dict, dict)
+        Per box, the `isel` indexers of its extended input region, and per
+        factor those of the coarse cells of the region's forcings lying within
+        the box.
+    """
+    scales = list(scales)
+    align = math.lcm(*scales)
+    halo = forcing_halo(scales)
+    regions = []
+    for bbox in bboxes:
+        region, keep = {}, {s: {} for s in scales}
+        for dim, lo, hi in (
+                ("yu_ocean", bbox.lat_min, bbox.lat_max),
+                ("xu_ocean", bbox.long_min, bbox.long_max)):
+            coord = u_v_dataset[dim].values
+            start = int(np.searchsorted(coord, lo, side="left"))
+            stop = int(np.searchsorted(coord, hi, side="right"))
+            if stop - start < max(scales):
+                raise ValueError(
+                    f"bounding box {bbox} has fewer than {max(scales)} points along {dim}")
+            ext_start = start - min(halo, start // align * align)
+            region[dim] = slice(ext_start, min(stop + halo, len(coord)))
+            for s in scales:
+                keep[s][dim] = slice((start - ext_start) // s, (stop - ext_start) // s)
+        regions.append((region, keep))
+    return regions
+
+def region_input_chunks(u_v_dataset: xr.Dataset, region: Mapping[str, slice]) -> set:
+    """
+    Spatial chunks of the (Dask-backed) dataset that a region of
+    `bounding_box_regions` reads from, as tuples of chunk indices along
+    "yu_ocean" and "xu_ocean".
+    """
+    indices = []
+    for dim in ("yu_ocean", "xu_ocean"):
+        bounds = np.cumsum((0,) + u_v_dataset.chunks[dim])
+        first = np.searchsorted(bounds, region[dim].start, side="right") - 1
+        last = np.searchsorted(bounds, region[dim].stop, side="left") - 1
+        indices.append(range(first, last + 1))
+    return {(i, j) for i in indices[0] for j in indices[1]}
+
+def compute_forcings_and_coarsen_cm2_6_tiled(
+    u_v_dataset: xr.Dataset,
+    grid_data: xr.Dataset,
+    scale: int,
+    tile_size: Union[int, Sequence[int]],
+    nan_or_zero: str = "zero",
+    filter_backend: str = "direct",
+    fused_coarsen: bool = True,
+    grid_terms: Optional[xr.Dataset] = None,
+    dtype: Optional[np.dtype] = None,
+) -> xr.Dataset:
+    """
+    Compute `compute_forcings_and_coarsen_cm2_6` tile by tile over the spatial
+    domain, with a halo around each tile. See `map_forcings_over_blocks`.
+
+    Parameters
+    ----------
+    u_v_dataset : xarray Dataset
+        High-resolution velocity field in "usurf" and "vsurf".
+    grid_data : xarray Dataset
+        High-resolution grid details.
+    scale : int
+        gaussian filtering & coarsening factor
+    tile_size : int or (int, int)
+        Tile size along "yu_ocean" and "xu_ocean", in high-resolution points,
+        excluding the halo. Rounded up to a multiple of `scale`.
+    nan_or_zero, filter_backend, fused_coarsen, dtype
+        See `compute_forcings_and_coarsen_cm2_6`.
+    grid_terms: xarray Dataset, optional
+        Grid-derived terms over the whole domain, see `grid_filter_terms`.
+
+    Returns
+    -------
+    forcing : xarray Dataset
+        As `compute_forcings_and_coarsen_cm2_6`.
+    """
+    return map_forcings_over_blocks(
+        u_v_dataset, grid_data, [scale], tile_size, nan_or_zero,
+        filter_backend, fused_coarsen,
+        None if grid_terms is None else {scale: grid_terms}, dtype)[scale]
+
+def map_forcings_over_blocks(
+    u_v_dataset: xr.Dataset,
+    grid_data: xr.Dataset,
+    scales: Sequence[int],
+    tile_size: Optional[Union[int, Sequence[int]]] = None,
+    nan_or_zero: str = "zero",
+    filter_backend: Union[str, Mapping[int, str]] = "direct",
+    fused_coarsen: bool = True,
+    grid_terms: Optional[Mapping[int, xr.Dataset]] = None,
+    dtype: Optional[np.dtype] = None,
+) -> Dict[int, xr.Dataset]:
+    """
+    Compute forcings for one or more coarsening factors block by block, with
+    `xarray.map_blocks`.
+
+    Each block is processed by a single task computing all factors (see
+    `compute_forcings_and_coarsen_cm2_6_multi`), so the input is read and
+    advected once whatever the number of factors, as long as the results are
+    computed together (e.g. with one `dask.compute` call).
+
+    Without `tile_size`, blocks are the chunks of the input. With it, the
+    spatial domain is split into tiles aligned with the coarse grids of all
+    factors, each extended by a halo of `forcing_halo(scales)` points on each
+    side (within the domain), processed, and trimmed back to its own coarse
+    cells. The result then matches the computation over the whole domain at
+    once, while per-task memory is bounded by the tile size.
+
+    Parameters
+    ----------
+    u_v_dataset : xarray Dataset
+        High-resolution velocity field in "usurf" and "vsurf". For lazy
+        results, should be Dask-backed.
+    grid_data : xarray Dataset
+        High-resolution grid details.
+    scales : sequence of int
+        gaussian filtering & coarsening factors
+    tile_size : int or (int, int), optional
+        Tile size along "yu_ocean" and "xu_ocean", in high-resolution points,
+        excluding the halo. Rounded up to a multiple of all factors. The
+        default is to process input chunks whole.
+    nan_or_zero, filter_backend, fused_coarsen, dtype
+        See `compute_forcings_and_coarsen_cm2_6_multi`.
+    grid_terms : mapping from int to xarray Dataset, optional
+        Grid-derived terms over the whole domain per factor, see
+        `grid_filter_terms`.
+
+    Returns
+    -------
+    forcings : dict from int to xarray Dataset
+        Forcing dataset per factor.
+    """
+    scales = list(scales)
+    # templates are derived from the input, so it needs the output dtype
+    dtype = forcing_dtype(u_v_dataset, dtype)
+    u_v_dataset = u_v_dataset.astype(dtype)
+    filter_backend = resolve_spatial_filter_backends(
+        filter_backend, forcing_block_shape(u_v_dataset, scales, tile_size),
+        scales, dtype)
+    grid_terms = {
+        scale: _check_grid_terms(
+            grid_data, scale, (grid_terms or {}).get(scale), dtype)
+        for scale in scales}
+
+    def compute_block(u_v, grid, terms, keep):
+        forcings = compute_forcings_and_coarsen_cm2_6_multi(
+            u_v, grid, list(keep), nan_or_zero, filter_backend, fused_coarsen,
+            terms, dtype)
+        return xr.merge(
+            [_pack_factor(forcings[s].isel(keep[s]), s) for s in keep],
+            combine_attrs="drop_conflicts")
+
+    def map_block(u_v, grid, terms, keep):
+        # `keep` maps the factors to compute to the coarse cells to keep
+        template = xr.merge(
+            [_pack_factor(
+                compute_forcings_and_coarsen_cm2_6_shape(u_v, s).isel(keep[s]), s)
+             for s in keep],
+            combine_attrs="drop_conflicts")
+        packed = xr.map_blocks(
+            partial(compute_block, grid=grid, terms=terms, keep=keep),
+            u_v, template=template)
+        return {s: _unpack_factor(packed, s) for s in keep}
+
+    if tile_size is None:
+        no_trim = {s: {} for s in scales}
+        return map_block(u_v_dataset, grid_data, grid_terms, no_trim)
+
+    dims = ["yu_ocean", "xu_ocean"]
+    align = math.lcm(*scales)
+    tile_sizes = [-(-int(t) // align) * align for t in np.broadcast_to(tile_size, 2)]
+    if min(tile_sizes) <= 0:
+        raise ValueError(f"tile size must be positive, got {tile_size}")
+    halo = forcing_halo(scales)
+    logger.debug(f"tiles of {tile_sizes} points with a halo of {halo} points")
+
+    # per dimension, the extended slice of each tile and its coarse cells to
+    # keep for each factor (empty for factors larger than a last partial tile)
+    tiles = []
+    for dim, tile in zip(dims, tile_sizes):
+        n = u_v_dataset.sizes[dim]
+        dim_tiles = []
+        for start in range(0, n, tile):
+            end = min(start + tile, n)
+            lo, hi = max(start - halo, 0), min(end + halo, n)
+            keep = {s: slice((start - lo) // s, (end - lo) // s) for s in scales}
+            dim_tiles.append((slice(lo, hi), keep))
+        tiles.append(dim_tiles)
+
+    rows = {s: [] for s in scales}
+    for y_ext, y_keep in tiles[0]:
+        row = {s: [] for s in scales}
+        for x_ext, x_keep in tiles[1]:
+            u_v = u_v_dataset.isel(dict(zip(dims, (y_ext, x_ext))))
+            keep = {
+                s: dict(zip(dims, (y_keep[s], x_keep[s]))) for s in scales
+                if y_keep[s].stop > y_keep[s].start
+                and x_keep[s].stop > x_keep[s].start}
+            if not keep:
+                continue
+            labels = {dim: u_v[dim].values for dim in dims}
+            grid = grid_data.sel(labels)
+            terms = {s: grid_terms[s].sel(labels) for s in scales}
+            if u_v.chunks:
+                # one block per tile along the spatial dimensions
+                u_v = u_v.chunk({dim: -1 for dim in dims})
+            for s, forcings in map_block(u_v, grid, terms, keep).items():
+                row[s].append(forcings)
+        for s in scales:
+            if row[s]:
+                rows[s].append(row[s])
+    return {
+        s: xr.combine_nested(rows[s], concat_dim=dims, combine_attrs="override")
+        for s in scales}
+
+def forcing_block_shape(
+    u_v_dataset: xr.Dataset,
+    scales: Sequence[int],
+    tile_size: Optional[Union[int, Sequence[int]]] = None,
+) -> Tuple[int, ...]:
+    """
+    Shape of the largest block of "usurf" processed by a task of
+    `map_forcings_over_blocks`: an input chunk, or a tile with its halo.
+
+    Parameters
+    ----------
+    u_v_dataset : xarray Dataset
+        High-resolution velocity field in "usurf" and "vsurf".
+    scales : sequence of int
+        gaussian filtering & coarsening factors
+    tile_size : int or (int, int), optional
+        See `map_forcings_over_blocks`.
+
+    Returns
+    -------
+    shape : tuple of ints
+        Block shape, in the dimension order of "usurf".
+    """
+    u = u_v_dataset["usurf"]
+    shape = u.data.chunksize if u.chunks else u.shape
+    if tile_size is None:
+        return tuple(shape)
+    align = math.lcm(*scales)
+    tiles = dict(zip(
+        ["yu_ocean", "xu_ocean"],
+        (-(-int(t) // align) * align for t in np.broadcast_to(tile_size, 2))))
+    halo = forcing_halo(scales)
+    return tuple(
+        min(u.sizes[dim], tiles[dim] + 2 * halo) if dim in tiles else n
+        for dim, n in zip(u.dims, shape))
+
+def resolve_spatial_filter_backends(
+    filter_backend: Union[str, Mapping[int, str]],
+    block_shape: Sequence[int],
+    scales: Sequence[int],
+    dtype: np.dtype = np.float64,
+) -> Dict[int, str]:
+    """
+    Spatial filtering backend per factor, with "auto" replaced by the
+    fastest backend for `block_shape` (see `select_spatial_filter_backend`).
+
+    Parameters
+    ----------
+    filter_backend : str or mapping from int to str
+        Backend, or backend per factor, as taken by
+        `compute_forcings_and_coarsen_cm2_6_multi`.
+    block_shape : sequence of ints
+        Shape of the blocks to filter, time first, e.g. from
+        `forcing_block_shape`.
+    scales : sequence of int
+        gaussian filtering & coarsening factors
+    dtype : numpy dtype, optional
+        Data type of the blocks. The default is float64.
+
+    Returns
+    -------
+    backends : dict from int to str
+        Key of `SPATIAL_FILTER_BACKENDS` per factor.
+    """
+    backends = {}
+    for scale in scales:
+        backend = _backend_for(filter_backend, scale)
+        if backend == "auto":
+            backend = select_spatial_filter_backend(block_shape, scale / 2, dtype=dtype)
+        backends[scale] = backend
+    return backends
+
+def _pack_factor(ds: xr.Dataset, scale: int) -> xr.Dataset:
+    """
+    Tag the variables and spatial dimensions of a forcing dataset with its
+    factor, so that datasets for several factors fit in one dataset.
+    """
+    suffix = f"__factor_{scale}"
+    spatial = {"xu_ocean", "yu_ocean"}
+    names = [k for k, v in ds.variables.items() if k in ds.data_vars or spatial & set(v.dims)]
+    return ds.rename({k: f"{k}{suffix}" for k in names})
+
+def _unpack_factor(packed: xr.Dataset, scale: int) -> xr.Dataset:
+    """Inverse of `_pack_factor`, for one factor."""
+    suffix = f"__factor_{scale}"
+    ds = packed[[k for k in packed.data_vars if k.endswith(suffix)]]
+    return ds.rename({k: k[:-len(suffix)] for k in ds.variables if k.endswith(suffix)})
+
+# Peak memory of one forcing task, in arrays the size of its input block at
+# the computation's precision (about 17 to 22 measured with tracemalloc, the
+# higher for float32 as some temporaries stay float64).
+# Peak memory of a task of `map_forcings_over_blocks`, apart from the input
+# chunk it reads from. Per point of its block (time by space): arrays in the
+# precision of the computation, float64 temporaries whatever the precision,
+# and more of those for each further factor computed by the task; plus bytes
+# per spatial point of the grid-derived terms and masks, whatever the time
+# chunk. Fitted to the peaks measured with tracemalloc on synthetic CM2.6
+# blocks of 1 to 8 time points and 96x144 to 240x360 points, for 1 to 4
+# factors in float32 and float64, which the estimate exceeds by 5% to 50%
+# (see test_plan_forcing_chunks_peak).
+_FORCING_TASK_PEAK_ARRAYS = 12
+_FORCING_TASK_PEAK_FLOAT64_ARRAYS = 3
+_FORCING_TASK_PEAK_FLOAT64_ARRAYS_PER_FACTOR = 2
+_FORCING_TASK_PEAK_BYTES_PER_POINT = 64
+
+def plan_forcing_chunks(
+    u_v_dataset: xr.Dataset,
+    scales: Sequence[int],
+    memory_budget: Optional[int] = None,
+    concurrency: int = 1,
+    tile_size: Optional[Union[int, Sequence[int]]] = None,
+    dtype: Optional[np.dtype] = None,
+) -> Dict:
+    """
+    Estimate the cost of `map_forcings_over_blocks`, choosing time chunks and
+    tiles that fit a memory budget. Only uses the shape, chunks and dtype of
+    the (lazy) input, so computes nothing.
+
+    Without a budget, the chunking given is assessed as is. With one, the
+    time chunk is halved from the input's, then the tiles halved from
+    `tile_size` (or the input chunks), until the estimated peak memory of
+    `concurrency` tasks fits, preferring large tiles as their halos are
+    recomputed.
+
+    Parameters
+    ----------
+    u_v_dataset : xarray Dataset
+        High-resolution velocity field in "usurf" and "vsurf".
+    scales : sequence of int
+        gaussian filtering & coarsening factors
+    memory_budget : int, optional
+        Memory available to the computation, in bytes.
+    concurrency : int, optional
+        Number of tasks running at once. The default is 1.
+    tile_size : int or (int, int), optional
+        Tile size along "yu_ocean" and "xu_ocean", see
+        `map_forcings_over_blocks`. The default is to process input chunks
+        whole.
+    dtype : numpy dtype, optional
+        Precision of the computation. The default is the input's, see
+        `compute_forcings_and_coarsen_cm2_6`.
+
+    Returns
+    -------
+    plan : dict
+        "time_chunk" and "tile_size" (None for whole input chunks) to use,
+        "block_shape" of a task's input including halos, "n_tasks",
+        "input_bytes" read, "input_chunk_bytes" of one source chunk of both
+        fields (a chunk of the store the input was opened from, read whole
+        even when the input is sliced or rechunked smaller), "task_peak_bytes"
+        (including a source chunk) and total "peak_bytes" of the concurrent
+        tasks, uncompressed "output_bytes" per factor, "memory_budget", and
+        "fits" (None without a budget).
+    """
+    scales = list(scales)
+    dims = ["yu_ocean", "xu_ocean"]
+    u = u_v_dataset["usurf"]
+    sizes = u_v_dataset.sizes
+    n_time = sizes["time"]
+    chunksize = dict(zip(u.dims, u.data.chunksize if u.chunks else u.shape))
+    n_chunks = dict(zip(u.dims, [len(c) for c in u.chunks] if u.chunks else [1] * u.ndim))
+    itemsize = forcing_dtype(u_v_dataset, dtype).itemsize
+    align = math.lcm(*scales)
+    halo = forcing_halo(scales)
+
+    def cost(time_chunk, tile):
+        if tile is None:
+            block = [chunksize[dim] for dim in dims]
+            n_tiles = n_chunks["yu_ocean"] * n_chunks["xu_ocean"]
+        else:
+            block = [min(sizes[dim], t + 2 * halo) for dim, t in zip(dims, tile)]
+            n_tiles = math.prod(-(-sizes[dim] // t) for dim, t in zip(dims, tile))
+        n_tasks = -(-n_time // time_chunk) * n_tiles
+        float64_arrays = (_FORCING_TASK_PEAK_FLOAT64_ARRAYS
+                          + _FORCING_TASK_PEAK_FLOAT64_ARRAYS_PER_FACTOR * (len(scales) - 1))
+        point_bytes = _FORCING_TASK_PEAK_ARRAYS * itemsize + 8 * float64_arrays
+        # the source chunk a task reads from is held whole until sliced
+        task_peak = (point_bytes * time_chunk * math.prod(block)
+                     + _FORCING_TASK_PEAK_BYTES_PER_POINT * math.prod(block)
+                     + input_chunk_bytes)
+        return (time_chunk, *block), n_tasks, task_peak, task_peak * min(concurrency, n_tasks)
+
+    # chunks of the store the input was opened from, if any, are read and
+    # decoded whole, whatever the input's own (Dask) chunks
+    source_chunks = u.encoding.get("chunks")
+    if source_chunks is None or len(source_chunks) != u.ndim:
+        source_chunks = tuple(chunksize.values())
+    input_chunk_bytes = 2 * u.dtype.itemsize * math.prod(source_chunks)
+    if tile_size is not None:
+        tile_size = [-(-int(t) // align) * align for t in np.broadcast_to(tile_size, 2)]
+
+    time_chunks = [chunksize["time"]]
+    tiles = [tile_size]
+    if memory_budget is not None:
+        while time_chunks[-1] > 1:
+            time_chunks.append(time_chunks[-1] // 2)
+        tile = tile_size or [-(-chunksize[dim] // align) * align for dim in dims]
+        while max(tile) > align:
+            tile = [max(align, -(-t // 2 // align) * align) if t == max(tile) else t
+                    for t in tile]
+            tiles.append(tile)
+
+    # the largest tile, then the largest time chunk, that fits; else the smallest
+    for tile in tiles:
+        for time_chunk in time_chunks:
+            block_shape, n_tasks, task_peak, peak = cost(time_chunk, tile)
+            if memory_budget is None or peak <= memory_budget:
+                break
+        else:
+            continue
+        break
+
+    output_bytes = {
+        s: 4 * itemsize * n_time * (sizes["yu_ocean"] // s) * (sizes["xu_ocean"] // s)
+        for s in scales}
+    return {
+        "time_chunk": time_chunk,
+        "tile_size": tile,
+        "block_shape": block_shape,
+        "n_tasks": n_tasks,
+        "input_bytes": 2 * u.dtype.itemsize * u.size,
+        "input_chunk_bytes": input_chunk_bytes,
+        "task_peak_bytes": task_peak,
+        "peak_bytes": peak,
+        "output_bytes": output_bytes,
+        "memory_budget": memory_budget,
+        "fits": None if memory_budget is None else peak <= memory_budget,
+    }
+
+def format_chunk_plan(plan: Mapping) -> str:
+    """Human-readable summary of a `plan_forcing_chunks` plan."""
+    fmt = dask.utils.format_bytes
+    lines = [
+        f"time chunk:         {plan['time_chunk']}",
+        f"tile size:          {plan['tile_size'] or 'input chunks'}",
+        f"task input block:   {plan['block_shape']}",
+        f"tasks:              {plan['n_tasks']}",
+        f"input read:         {fmt(plan['input_bytes'])}",
+        f"source chunk:       {fmt(plan['input_chunk_bytes'])}",
+        f"peak memory / task: {fmt(plan['task_peak_bytes'])}",
+        f"peak memory:        {fmt(plan['peak_bytes'])}",
+    ]
+    for scale, n in plan["output_bytes"].items():
+        lines.append(f"output, factor {scale}: {fmt(n)} (uncompressed)")
+    if plan["memory_budget"] is not None:
+        verdict = "fits" if plan["fits"] else "DOES NOT FIT"
+        lines.append(f"memory budget:      {fmt(plan['memory_budget'])}, {verdict}")
+    return "\n".join(lines)
+
+def precision_report(
+    u_v_dataset: xr.Dataset,
+    grid_data: xr.Dataset,
+    scale: int,
+    dtype: np.dtype = np.float32,
+    n_times: int = 1,
+    size: int = 256,
+    nan_or_zero: str = "zero",
+    filter_backend: str = "direct",
+) -> Dict[str, Dict[str, float]]:
+    """
+    Compare forcings computed at precision `dtype` against a float64
+    reference, on a sample region.
+
+    The sample is the first `n_times` time points of a window of `size` by
+    `size` high-resolution points at the centre of the domain (or the whole
+    domain if smaller).
+
+    Parameters
+    ----------
+    u_v_dataset, grid_data, scale, nan_or_zero, filter_backend
+        See `compute_forcings_and_coarsen_cm2_6`.
+    dtype : numpy dtype, optional
+        Precision to assess. The default is float32.
+    n_times : int, optional
+        Number of time points in the sample. The default is 1.
+    size : int, optional
+        Size of the sample window along each spatial dimension, rounded up to
+        a multiple of `scale`. The default is 256.
+
+    Returns
+    -------
+    report : dict
+        Per output variable: "max_abs_error", "rms_error", "reference_rms",
+        "relative_rms_error" (error relative to the reference's RMS), and
+        "nan_mismatch" (points NaN in only one of the results), over the
+        "n_points" points finite in both.
+    """
+    size = -(-size // scale) * scale
+    window = {}
+    for dim in ("yu_ocean", "xu_ocean"):
+        n = u_v_dataset.sizes[dim]
+        start = max(n - size, 0) // 2
+        window[dim] = slice(start, start + size)
+    sample = u_v_dataset.isel(time=slice(0, n_times), **window).compute()
+    grid_sample = grid_data.sel({dim: sample[dim].values for dim in window})
+
+    results = [
+        compute_forcings_and_coarsen_cm2_6(
+            sample, grid_sample, scale, nan_or_zero, filter_backend, dtype=dt)
+        for dt in (np.float64, dtype)]
+    report = {}
+    for name in results[0].data_vars:
+        reference = results[0][name].values
+        values = results[1][name].transpose(*results[0][name].dims).values
+        finite = np.isfinite(reference) & np.isfinite(values)
+        error = values[finite].astype(np.float64) - reference[finite]
+        rms_error = float(np.sqrt(np.mean(error**2))) if error.size else 0.0
+        reference_rms = (
+            float(np.sqrt(np.mean(reference[finite]**2))) if error.size else 0.0)
+        report[name] = {
+            "max_abs_error": float(np.abs(error).max()) if error.size else 0.0,
+            "rms_error": rms_error,
+            "reference_rms": reference_rms,
+            "relative_rms_error": rms_error / reference_rms if reference_rms else 0.0,
+            "nan_mismatch": int((np.isnan(reference) != np.isnan(values)).sum()),
+            "n_points": int(finite.sum()),
+        }
+    return report
+
+ZARR_COMPRESSIONS = ("default", "blosc-zstd", "none")
+
+def training_output_chunks(batch_size: int) -> Dict[str, int]:
+    """
+    Output chunks for training reads: `batch_size` time points per chunk, and
+    the whole spatial extent (each subdomain is stored separately).
+    """
+    return {"time": batch_size, "yu_ocean": -1, "xu_ocean": -1}
+
+def zarr_output_layout(
+    ds: xr.Dataset,
+    chunks: Optional[Mapping[str, int]] = None,
+    compression: str = "default",
+    clevel: int = 5,
+    var_dtypes: Optional[Mapping[str, str]] = None,
+) -> Tuple[xr.Dataset, Dict[str, Dict]]:
+    """
+    Rechunk a dataset and build the `to_zarr` encoding for the given output
+    layout.
+
+    Parameters
+    ----------
+    ds : xarray Dataset
+        Dataset to write.
+    chunks : mapping from str to int, optional
+        Chunk size per dimension (-1 for the whole dimension). Dimensions not
+        given keep their current chunking.
+    compression : str, optional
+        One of `ZARR_COMPRESSIONS`: the zarr default codecs, Blosc zstd with
+        bit-shuffle, or no compression. The default is "default".
+    clevel : int, optional
+        Compression level for "blosc-zstd". The default is 5.
+    var_dtypes : mapping from str to str, optional
+        On-disk dtype per data variable, e.g. `{"S_x": "float32"}`.
+
+    Returns
+    -------
+    ds : xarray Dataset
+        Rechunked dataset.
+    encoding : dict
+        Encoding per data variable, for `to_zarr(encoding=...)`.
+    """
+    if compression not in ZARR_COMPRESSIONS:
+        raise ValueError(f"unknown compression: {compression}")
+    var_dtypes = dict(var_dtypes or {})
+    unknown = set(var_dtypes) - set(ds.data_vars)
+    if unknown:
+        raise ValueError(f"no such data variables: {sorted(unknown)}")
+    if chunks:
+        ds = ds.chunk({dim: size for dim, size in chunks.items() if dim in ds.dims})
+
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        enc = {}
+        if var.chunks is not None:
+            enc["chunks"] = tuple(c[0] for c in var.chunks)
+        enc.update(_zarr_compressor_encoding(compression, clevel))
+        if name in var_dtypes:
+            enc["dtype"] = np.dtype(var_dtypes[name])
+        encoding[name] = enc
+    return ds, encoding
+
+def _zarr_compressor_encoding(compression: str, clevel: int) -> Dict:
+    """Compressor part of a zarr variable encoding, for zarr-python 2 or 3."""
+    if compression == "default":
+        return {}
+    import zarr
+    zarr_v3 = int(zarr.__version__.split(".")[0]) >= 3
+    if compression == "none":
+        return {"compressors": None} if zarr_v3 else {"compressor": None}
+    if zarr_v3:
+        from zarr.codecs import BloscCodec
+        return {"compressors": (
+            BloscCodec(cname="zstd", clevel=clevel, shuffle="bitshuffle"),)}
+    from numcodecs import Blosc
+    return {"compressor": Blosc(cname="zstd", clevel=clevel, shuffle=Blosc.BITSHUFFLE)}
+
+SLAB_MANIFEST_NAME = "gz21_slabs.json"
+
+def write_forcings_in_slabs(
+    forcings: Union[xr.Dataset, Mapping[str, xr.Dataset]],
+    out_dir: str,
+    slab_size: Optional[int] = None,
+    encoding: Optional[Mapping] = None,
+    prefetch: Optional[Callable[[slice], Any]] = None,
+    prefetch_slabs: int = 1,
+    release: Optional[Callable[[slice], Any]] = None,
+) -> List[int]:
+    """
+    Write the dataset to a zarr store slab by slab along time, so that an
+    interrupted write can be resumed.
+
+    The store's schema (metadata and coordinates) is created up front. Each
+    slab of `slab_size` time points is then computed and written on its own
+    with `to_zarr(region=...)`, and recorded in a manifest file in the store
+    directory. When called again on the same store, only slabs missing from
+    the manifest are computed.
+
+    Parameters
+    ----------
+    forcings : xarray Dataset, or mapping from str to xarray Dataset
+        Dataset to write, with a "time" dimension. Usually lazy (Dask-backed).
+        A mapping writes one zarr group per entry, named by its key. The
+        datasets must share their time coordinate, and each slab of all
+        groups is computed together, so shared work is done once.
+    out_dir : str
+        Path of the zarr store. Must not exist, be empty, or hold a store
+        previously written by this function for the same dataset.
+    slab_size : int, optional
+        Number of time points per slab, rounded up to a multiple of the
+        datasets' time chunk sizes. The default is the time chunk size.
+    encoding : mapping, optional
+        `to_zarr` encoding (see `zarr_output_layout`), used when creating the
+        store. For a mapping of datasets, a mapping of encodings per group.
+    prefetch : callable, optional
+        Called with the time region of each slab, and of the next
+        `prefetch_slabs` slabs, before computing it, e.g. to read its input
+        ahead with `common.read_ahead.ReadAhead.prefetch`.
+    prefetch_slabs : int, optional
+        Number of slabs to prefetch ahead of the one computed. The default is
+        1.
+    release : callable, optional
+        Called with the time region of each slab once written, e.g. to drop
+        input read ahead for it but not used, with
+        `common.read_ahead.ReadAhead.release_before`.
+
+    Returns
+    -------
+    written : list of int
+        Indices of the slabs written by this call.
+
+    Raises
+    ------
+    ValueError
+        If `out_dir` holds other data, or a store for a different dataset.
+    """
+    if isinstance(forcings, xr.Dataset):
+        groups, encodings = {None: forcings}, {None: encoding}
+    else:
+        groups, encodings = dict(forcings), dict(encoding or {})
+    n_times = next(iter(groups.values())).sizes["time"]
+    chunk = math.lcm(*(
+        ds.chunks["time"][0] if ds.chunks else n_times for ds in groups.values()))
+    if slab_size is None:
+        slab_size = chunk
+    # slabs must not share zarr chunks, or writes of one would clobber another
+    slab_size = -(-slab_size // chunk) * chunk
+    n_slabs = -(-n_times // slab_size)
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(slab_size).encode())
+    for group, ds in sorted(groups.items(), key=lambda item: str(item[0])):
+        h.update(repr((group, dict(ds.sizes), sorted(
+            (k, str(v.dtype), v.dims) for k, v in ds.variables.items()
+        ))).encode())
+        for k in sorted(ds.indexes):
+            # via repr, as time coordinates may be (cftime) objects
+            h.update(repr(ds[k].values.tolist()).encode())
+    fingerprint = h.hexdigest()
+
+    manifest_path = os.path.join(out_dir, SLAB_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["fingerprint"] != fingerprint:
+            raise ValueError(
+                f"{out_dir} holds slabs of a different dataset or slab size")
+        logger.info(
+            f"resuming: {len(manifest['completed'])}/{n_slabs} slabs already written")
+    elif os.path.exists(out_dir) and os.listdir(out_dir):
+        raise ValueError(f"{out_dir} is not empty and has no slab manifest")
+    else:
+        logger.debug(f"creating zarr store schema in {out_dir}")
+        for group, ds in groups.items():
+            ds.to_zarr(out_dir, group=group, mode="w" if group is None else "a",
+                       encoding=encodings.get(group), compute=False)
+        manifest = {
+            "fingerprint": fingerprint, "slab_size": slab_size,
+            "n_slabs": n_slabs, "completed": [],
+        }
+        _write_json_atomic(manifest_path, manifest)
+
+    def slab_region(i):
+        return slice(i * slab_size, min((i + 1) * slab_size, n_times))
+
+    pending = [i for i in range(n_slabs) if i not in manifest["completed"]]
+    written = []
+    for position, i in enumerate(pending):
+        region = slab_region(i)
+        if prefetch is not None:
+            for j in pending[position:position + 1 + prefetch_slabs]:
+                prefetch(slab_region(j))
+        logger.info(f"writing slab {i + 1}/{n_slabs} (time {region.start}:{region.stop})")
+        writes = []
+        for group, ds in groups.items():
+            # variables without time were written by the schema step already
+            static_vars = [k for k, v in ds.variables.items() if "time" not in v.dims]
+            slab = ds.isel(time=region).drop_vars(static_vars)
+            writes.append(slab.to_zarr(
+                out_dir, group=group, region={"time": region}, compute=False))
+        dask.compute(*writes)
+        if release is not None:
+            release(region)
+        manifest["completed"].append(i)
+        _write_json_atomic(manifest_path, manifest)
+        written.append(i)
+    return written
+
+def _write_json_atomic(path: str, obj) -> None:
+    """Write `obj` as JSON to `path`, via a temporary file and a rename."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+GRID_TERMS_MEMO_SIZE = 8
+_grid_terms_memo: "OrderedDict[tuple, xr.Dataset]" = OrderedDict()
+
+def grid_filter_terms(
+        grid_data: xr.Dataset, sigma: Union[float, Sequence[float]],
+        dtype: np.dtype = np.float64, cache_dir: Optional[str] = None,
+        ) -> xr.Dataset:
+    """
+    Grid-derived terms of the forcing computation, which depend only on the
+    grid and the filter scale.
+
+    Results are memoized in-process, keyed by the grid bounding box, sigma,
+    dtype and a digest of the grid contents. If `cache_dir` is given, they are
+    also stored there as `.npz` files, so that later runs on the same region
+    skip the computation.
+
+    Parameters
+    ----------
+    grid_data : xarray Dataset
+        High-resolution grid details, must include variables "dxu" and "dyu".
+    sigma : float or sequence of floats
+        Scale of the Gaussian filter, see `_spatial_filter`.
+    dtype : numpy dtype, optional
+        Data type of the terms. The default is float64.
+    cache_dir : str, optional
+        Directory for the on-disk cache. The default is no on-disk cache.
+
+    Returns
+    -------
+    terms : xarray Dataset
+        Variables "area_u" (cell area), "norm" (Gaussian-filtered cell area),
+        "inv_dxu" and "inv_dyu" (inverse grid spacings), on the grid's
+        coordinates. Attributes "sigma" and "digest" identify the terms.
+    """
+    dtype = np.dtype(dtype)
+    if np.ndim(sigma) == 0:
+        sigma = float(sigma)
+    else:
+        sigma = tuple(float(s) for s in sigma)
+    dxu, dyu = grid_data["dxu"], grid_data["dyu"].transpose(*grid_data["dxu"].dims)
+    dxu_values, dyu_values = dxu.values, dyu.values
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((_GRID_TERMS_VERSION, dxu.dims, sigma, dtype.str)).encode())
+    for dim in dxu.dims:
+        h.update(np.ascontiguousarray(dxu[dim].values).tobytes())
+    h.update(np.ascontiguousarray(dxu_values).tobytes())
+    h.update(np.ascontiguousarray(dyu_values).tobytes())
+    digest = h.hexdigest()
+    bbox = tuple(
+        (float(dxu[dim][0]), float(dxu[dim][-1]), dxu.sizes[dim])
+        for dim in dxu.dims)
+    key = (bbox, sigma, dtype.str, digest)
+
+    terms = _grid_terms_memo.get(key)
+    if terms is not None:
+        _grid_terms_memo.move_to_end(key)
+        return terms
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"grid-terms-{digest}.npz")
+    if path is not None and os.path.exists(path):
+        logger.debug(f"loading grid terms from {path}")
+        with np.load(path) as cached:
+            variables = {name: cached[name] for name in _GRID_TERMS_VARIABLES}
+    else:
+        area_u = dxu_values * dyu_values / 1e8
+        # Normalisation term, so that if the quantity we filter is constant
+        # over the domain, the filtered quantity is constant with the same value
+        norm = _spatial_filter(area_u[np.newaxis], sigma)[0]
+        with np.errstate(divide="ignore"):
+            variables = {
+                "area_u": area_u, "norm": norm,
+                "inv_dxu": 1.0 / dxu_values, "inv_dyu": 1.0 / dyu_values,
+            }
+        variables = {k: v.astype(dtype) for k, v in variables.items()}
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write then rename, so that concurrent runs never read a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, **variables)
+            os.replace(tmp_path, path)
+            logger.debug(f"saved grid terms to {path}")
+
+    terms = xr.Dataset(
+        {k: (dxu.dims, v) for k, v in variables.items()},
+        coords={dim: dxu[dim].values for dim in dxu.dims},
+        attrs={"sigma": sigma, "digest": digest},
+    )
+    _grid_terms_memo[key] = terms
+    if len(_grid_terms_memo) > GRID_TERMS_MEMO_SIZE:
+        _grid_terms_memo.popitem(last=False)
+    return terms
+
+_GRID_TERMS_VERSION = 1
+_GRID_TERMS_VARIABLES = ("area_u", "norm", "inv_dxu", "inv_dyu")
+
+def advections(
+        u_v_field: xr.Dataset, grid_data: xr.Dataset,
+        metrics: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+        ) -> xr.Dataset:
     """
     Compute advection terms corresponding to the passed velocity field.
 
+    Gradients are backward differences, evaluated at the upper grid point of
+    each pair and scaled by the grid spacing there. The first row and column
+    are undefined (NaN). See `_advection_kernel`.
+
     Parameters
     ----------
     u_v_field : xarray Dataset
@@ -206,32 +1356,141 @@ def _advections(u_v_field: xr.Dataset, grid_data: xr.Dataset) -> xr.Dataset:
         "xu_ocean" and "yu_ocean"
     grid_data : xarray Dataset
         grid data, must contain variables "dxu" and "dyu"
+    metrics : tuple of numpy arrays, optional
+        Inverse grid spacings `(1/dxu, 1/dyu)` on the field's grid, as returned
+        by `_advection_metrics`. Computed from `grid_data` if not given.
 
     Returns
     -------
     result : xarray Dataset
         Advection components, under variable names "adv_x" and "adv_y"
     """
-    dxu = grid_data["dxu"]
-    dyu = grid_data["dyu"]
-    gradient_x = u_v_field.diff(dim="xu_ocean") / dxu
-    gradient_y = u_v_field.diff(dim="yu_ocean") / dyu
-    # Interpolate back the gradients
-    interp_coords = {
-        "xu_ocean": u_v_field.coords["xu_ocean"],
-        "yu_ocean": u_v_field.coords["yu_ocean"],
-    }
-    gradient_x = gradient_x.interp(interp_coords)
-    gradient_y = gradient_y.interp(interp_coords)
+    if metrics is None:
+        metrics = _advection_metrics(u_v_field, grid_data)
+    inv_dx, inv_dy = metrics
+    dims = ["yu_ocean", "xu_ocean"]
     u, v = u_v_field["usurf"], u_v_field["vsurf"]
-    adv_x = u * gradient_x["usurf"] + v * gradient_y["usurf"]
-    adv_y = u * gradient_x["vsurf"] + v * gradient_y["vsurf"]
-    result = xr.Dataset({"adv_x": adv_x, "adv_y": adv_y})
-    # can these ops add chunks to our underlying Dask array? (should not)
+    adv_x, adv_y = xr.apply_ufunc(
+        lambda u, v: _advection_kernel(u, v, inv_dx, inv_dy),
+        u, v,
+        input_core_dims=[dims, dims],
+        output_core_dims=[dims, dims],
+        dask="parallelized",
+        output_dtypes=[u.dtype, u.dtype],
+        dask_gufunc_kwargs={"allow_rechunk": True},
+    )
+    result = xr.Dataset({
+        "adv_x": adv_x.transpose(*u.dims),
+        "adv_y": adv_y.transpose(*u.dims),
+    })
     return result
 
-def _spatial_filter_dataset(
-        dataset: xr.Dataset, grid_data: xr.Dataset, sigma: float
+def _advection_metrics(
+        u_v_field: xr.Dataset, grid_data: xr.Dataset,
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inverse grid spacings `(1/dxu, 1/dyu)` as (y, x) numpy arrays on the grid
+    of the passed field. Points the grid data does not cover are NaN.
+
+    Takes them from "inv_dxu" and "inv_dyu" if `grid_data` holds grid terms
+    (see `grid_filter_terms`), else inverts "dxu" and "dyu".
+    """
+    like = u_v_field[["xu_ocean", "yu_ocean"]]
+    inv = []
+    for name in ("dxu", "dyu"):
+        if f"inv_{name}" in grid_data:
+            d = grid_data[f"inv_{name}"].reindex_like(like)
+            inv.append(d.transpose("yu_ocean", "xu_ocean").values)
+        else:
+            d = grid_data[name].reindex_like(like)
+            inv.append(1.0 / d.transpose("yu_ocean", "xu_ocean").values)
+    return inv[0], inv[1]
+
+# how far back (in grid points, along each axis) advection terms depend on the
+# velocities: one for the backward difference, one more for NaN propagation
+_ADVECTION_STENCIL_REACH = 2
+
+def _advection_kernel(
+        u: np.ndarray, v: np.ndarray, inv_dx: np.ndarray, inv_dy: np.ndarray,
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Advection terms `u d/dx + v d/dy` of (u, v), on arrays of shape (..., y, x).
+
+    Parameters
+    ----------
+    u, v : numpy arrays
+        Velocity components, spatial dimensions last in (y, x) order.
+    inv_dx, inv_dy : numpy arrays
+        Inverse grid spacings, shape (y, x).
+
+    Returns
+    -------
+    adv_x, adv_y : numpy arrays
+        Advection terms, same shape as u. The first row and column are NaN.
+
+    Notes
+    -----
+    The gradient of f along x at point i is `(f[i] - f[i-1]) / dx[i]`, and
+    likewise along y. NaNs spread as in the earlier implementation, which
+    took gradients between grid points and linearly interpolated them back:
+    an interpolated gradient is NaN if either of the gradients bracketing it
+    is, along each axis.
+    """
+    adv_x = np.empty_like(u)
+    adv_y = np.empty_like(u)
+    inner = (Ellipsis, slice(1, None), slice(1, None))
+    left = (Ellipsis, slice(1, None), slice(None, -1))
+    below = (Ellipsis, slice(None, -1), slice(1, None))
+    u_in, v_in = u[inner], v[inner]
+    inv_dx_in, inv_dy_in = inv_dx[1:, 1:], inv_dy[1:, 1:]
+    tmp = np.empty_like(u_in)
+    for f, out in ((u, adv_x), (v, adv_y)):
+        o = out[inner]
+        np.subtract(f[inner], f[left], out=o)
+        o *= inv_dx_in
+        o *= u_in
+        np.subtract(f[inner], f[below], out=tmp)
+        tmp *= inv_dy_in
+        tmp *= v_in
+        o += tmp
+        out[..., 0, :] = np.nan
+        out[..., :, 0] = np.nan
+
+    for f, out in ((u, adv_x), (v, adv_y)):
+        nans = np.isnan(f)
+        if not nans.any():
+            continue
+        # NaN gradients along x (resp. y), then spread as by interpolation
+        grad_x = np.zeros_like(nans)
+        grad_x[..., 1:] = nans[..., 1:] | nans[..., :-1]
+        grad_y = np.zeros_like(nans)
+        grad_y[..., 1:, :] = nans[..., 1:, :] | nans[..., :-1, :]
+        spread = (_interp_nan_spread(grad_x, -1, -2)
+                  | _interp_nan_spread(grad_y, -2, -1))
+        out[spread] = np.nan
+    return adv_x, adv_y
+
+def _interp_nan_spread(
+        nans: np.ndarray, diff_axis: int, other_axis: int) -> np.ndarray:
+    """
+    NaN mask of a gradient after linear interpolation back onto the grid
+    points. Along each axis the value at grid point k comes from the
+    interval [k-1, k], or from the first interval of the gradient's own grid
+    at its lower end. The gradient along `diff_axis` is only defined from
+    index 1 on.
+    """
+    nans = np.moveaxis(nans, (diff_axis, other_axis), (-1, -2))
+    out = nans.copy()
+    out[..., 2:] |= nans[..., 1:-1]
+    out[..., 1] |= nans[..., 2]
+    spread = out.copy()
+    spread[..., 1:, :] |= out[..., :-1, :]
+    spread[..., 0, :] |= out[..., 1, :]
+    return np.moveaxis(spread, (-1, -2), (diff_axis, other_axis))
+
+def spatial_filter_dataset(
+        dataset: xr.Dataset, grid_data: xr.Dataset, sigma: float,
+        backend: str = "direct", grid_terms: Optional[xr.Dataset] = None,
         ) -> xr.Dataset:
     """
     Apply spatial filtering to the dataset across the spatial dimensions.
@@ -244,56 +1503,493 @@ def _spatial_filter_dataset(
         grid data,  must include variables "dxu" and "dyu"
     sigma : float
         Scale of the filtering, same unit as those of the grid (often, meters)
+    backend : str, optional
+        Filtering backend, one of `SPATIAL_FILTER_BACKENDS` or "auto" to pick
+        the fastest for the largest block (see `select_spatial_filter_backend`),
+        once for all blocks. The default is "direct".
+    grid_terms : xarray Dataset, optional
+        Grid-derived terms for `sigma`, see `grid_filter_terms`.
 
     Returns
     -------
     filt_dataset : xarray Dataset
         Filtered dataset
     """
-    area_u = grid_data["dxu"] * grid_data["dyu"] / 1e8
+    if backend != "auto" and backend not in SPATIAL_FILTER_BACKENDS:
+        raise ValueError(f"unknown spatial filter backend: {backend}")
+    if grid_terms is None:
+        grid_terms = grid_filter_terms(grid_data, sigma)
+    weighted = dataset * grid_terms["area_u"]
+    if backend == "auto":
+        # before building the graph, so that all blocks and workers agree
+        block = next(iter(weighted.data_vars.values()))
+        block_shape = block.data.chunksize if block.chunks else block.shape
+        backend = select_spatial_filter_backend(block_shape, sigma, dtype=block.dtype)
+    filter_block = SPATIAL_FILTER_BACKENDS[backend]
 
-    # Normalisation term, so that if the quantity we filter is constant
-    # over the domain, the filtered quantity is constant with the same value
-    norm = xr.apply_ufunc(
-        lambda x: gaussian_filter(x, sigma, mode="constant"),
-        area_u,
+    filtered = xr.apply_ufunc(
+        lambda x: filter_block(x, sigma),
+        weighted,
         dask="parallelized",
         output_dtypes=[
-            float,
+            np.result_type(*weighted.data_vars.values()),
         ],
     )
+    return filtered / grid_terms["norm"]
+
+def spatial_filter_and_coarsen_dataset(
+        dataset: xr.Dataset, grid_data: xr.Dataset, sigma: float, scale: int,
+        grid_terms: Optional[xr.Dataset] = None,
+        ) -> Optional[xr.Dataset]:
+    """
+    Spatially filter the dataset and coarsen the result, evaluating only the
+    coarse grid points.
+
+    Equivalent to `spatial_filter_dataset` followed by a
+    `coarsen(..., boundary="trim").mean()` over `scale` points along both
+    spatial dimensions, up to floating point error. Filtering then block
+    averaging is a strided convolution, applied here as one decimating pass per
+    spatial axis. Only NaN bookkeeping is done at full resolution.
+
+    The normalisation by the filtered cell areas happens before averaging, so
+    this only works when the cell area factors into a function of latitude
+    times a function of longitude (as on a regular latitude-longitude grid).
+    Otherwise, returns `None` and the caller should filter then coarsen.
+
+    Parameters
+    ----------
+    dataset : xarray Dataset
+        Dataset to filter, with spatial dimensions "yu_ocean" and "xu_ocean".
+    grid_data: xarray Dataset
+        grid data,  must include variables "dxu" and "dyu"
+    sigma : float
+        Scale of the filtering, same unit as those of the grid (often, meters)
+    scale : int
+        Coarsening factor
+    grid_terms : xarray Dataset, optional
+        Grid-derived terms for `sigma`, see `grid_filter_terms`.
+
+    Returns
+    -------
+    filt_dataset : xarray Dataset or None
+        Filtered and coarsened dataset, or `None` if the grid is not separable
+    """
+    dims = ["yu_ocean", "xu_ocean"]
+    if grid_terms is None:
+        grid_terms = grid_filter_terms(grid_data, sigma)
+    dataset, area_u = xr.align(dataset, grid_terms["area_u"], join="inner")
+    area_u = area_u.transpose(*dims).values
+    dtype = area_u.dtype
+    # factors in double precision, within the rounding of the areas
+    areas = _separable_factors(
+        area_u.astype(np.float64), rtol=max(1e-10, 16 * np.finfo(dtype).eps))
+    if areas is None:
+        logger.debug("cell area not separable, filtering at full resolution")
+        return None
+    kernels = [_gaussian_kernel_1d(s) for s in _spatial_sigmas(sigma, 2)]
+    norms = [
+        correlate1d(a, k, mode="constant", cval=0.0)
+        for a, k in zip(areas, kernels)]
+    weights = [
+        _decimating_filter_weights(k, a, n, scale).astype(dtype)
+        for k, a, n in zip(kernels, areas, norms)]
+
+    def filter_and_coarsen(x: np.ndarray) -> np.ndarray:
+        shape = x.shape
+        x = x.reshape((-1,) + shape[-2:])
+        nans = np.isnan(x)
+        has_nans = nans.any()
+        if has_nans:
+            x = np.where(nans, 0, x)
+        # longitude first, after which there are `scale` times fewer points
+        result = _decimating_filter_1d(x, weights[1], scale, axis=-1)
+        result = _decimating_filter_1d(result, weights[0], scale, axis=-2)
+        if has_nans:
+            _nanmean_blocks_with_nans(
+                result, x, nans, kernels, areas, norms, scale)
+        return result.reshape(shape[:-2] + result.shape[-2:])
+
+    coarse_dims = ["yu_ocean_coarse", "xu_ocean_coarse"]
     filtered = xr.apply_ufunc(
-        lambda x: _spatial_filter(x, sigma),
-        dataset * area_u,
+        filter_and_coarsen,
+        dataset,
+        input_core_dims=[dims],
+        output_core_dims=[coarse_dims],
         dask="parallelized",
-        output_dtypes=[
-            float,
-        ],
+        output_dtypes=[np.result_type(*dataset.data_vars.values(), dtype)],
+        dask_gufunc_kwargs={"output_sizes": {
+            coarse_dims[0]: len(weights[0]), coarse_dims[1]: len(weights[1])}},
     )
-    return filtered / norm
+    filtered = filtered.rename(dict(zip(coarse_dims, dims)))
+
+    # coordinates are coarsened as `coarsen(...).mean()` would
+    coords = xr.Dataset(coords=dataset.coords).coarsen(
+        {"xu_ocean": scale, "yu_ocean": scale}, boundary="trim").mean()
+    return filtered.assign_coords(coords.coords)
+
+def _separable_factors(
+        area: np.ndarray, rtol: float = 1e-10
+        ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Factor a 2D array into the outer product of two 1D arrays, if possible
+    (within relative tolerance `rtol`). Returns `None` otherwise.
+    """
+    total = area.mean()
+    if not np.isfinite(total) or total == 0:
+        return None
+    factor_0 = area.mean(axis=1)
+    factor_1 = area.mean(axis=0) / total
+    if not np.allclose(np.outer(factor_0, factor_1), area, rtol=rtol, atol=0):
+        return None
+    return factor_0, factor_1
+
+def _decimating_filter_weights(
+        kernel: np.ndarray, area: np.ndarray, norm: np.ndarray, scale: int
+        ) -> np.ndarray:
+    """
+    Weights of the 1D "filter, normalise then block average" operator.
+
+    Along one axis of length `n`, with cell areas `area`, coarse point `j` is
+    `sum(weights[j, t] * x[j*scale - radius + t])` over `t`, with `x` taken to
+    be zero outside the domain. This is the average over its `scale` fine
+    points of the area-weighted filter of `x`, each normalised by the filtered
+    area `norm` (as in `spatial_filter_dataset`).
+
+    Returns an array of shape `(n // scale, scale + 2*radius)`.
+    """
+    radius = len(kernel) // 2
+    n = len(area)
+    n_coarse = n // scale
+
+    # fine point `m` of coarse point `j` sees inputs at offsets `m:m+len(kernel)`
+    inv_norm = 1 / (scale * norm[:n_coarse * scale].reshape(n_coarse, scale))
+    weights = np.zeros((n_coarse, scale + 2 * radius))
+    for m in range(scale):
+        weights[:, m:m + len(kernel)] += inv_norm[:, m, np.newaxis] * kernel
+
+    # the area weighting of inputs, with zeros outside of the domain
+    padded_area = np.zeros(n_coarse * scale + 2 * radius)
+    stop = min(n, n_coarse * scale + radius)
+    padded_area[radius:radius + stop] = area[:stop]
+    windows = np.lib.stride_tricks.sliding_window_view(
+        padded_area, scale + 2 * radius)[::scale]
+    return weights * windows
+
+def _nanmean_blocks_with_nans(
+        result: np.ndarray,
+        data: np.ndarray,
+        nans: np.ndarray,
+        kernels: Sequence[np.ndarray],
+        areas: Sequence[np.ndarray],
+        norms: Sequence[np.ndarray],
+        scale: int,
+        ) -> None:
+    """
+    Correct the output of the decimating filter for NaNs in its input, in place.
+
+    `coarsen(...).mean()` skips NaNs, and direct filtering spreads NaNs over
+    the kernel footprint. So coarse points whose fine points all see a NaN are
+    NaN, and coarse points where only some do are the mean over the others.
+    The decimating filter was applied to `data` with NaNs replaced by zeros:
+    we set the former, and recompute the latter from their fine points
+    (normally few, along the edges of NaN regions).
+
+    `data` and `nans` are of shape `(time, y, x)`, `result` is the coarse
+    output. Other arguments are per spatial axis, as in
+    `spatial_filter_and_coarsen_dataset`.
+    """
+    n_coarse_y, n_coarse_x = result.shape[-2:]
+    radius_y, radius_x = (len(k) // 2 for k in kernels)
+    valid = ~_dilate_spatial(nans, [len(k) for k in kernels])
+    valid = valid[:, :n_coarse_y * scale, :n_coarse_x * scale].reshape(
+        -1, n_coarse_y, scale, n_coarse_x, scale)
+    counts = valid.sum(axis=(2, 4))
+    result[counts == 0] = np.nan
+    partial = np.nonzero((counts > 0) & (counts < scale * scale))
+    if len(partial[0]) == 0:
+        return
+
+    # area-weighted fine data around each partial block, zero outside the domain
+    def window_indices(coarse, radius, n, area):
+        indices = coarse[:, np.newaxis] * scale - radius + np.arange(
+            scale + 2 * radius)
+        inside = (indices >= 0) & (indices < n)
+        indices = np.clip(indices, 0, n - 1)
+        return indices, np.where(inside, area[indices], 0)
+    rows, row_weights = window_indices(partial[1], radius_y, data.shape[1], areas[0])
+    cols, col_weights = window_indices(partial[2], radius_x, data.shape[2], areas[1])
+    windows = (
+        data[partial[0][:, np.newaxis, np.newaxis],
+             rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+        * row_weights[:, :, np.newaxis] * col_weights[:, np.newaxis, :])
+
+    # filter each block's fine points, then normalise and average the valid ones
+    filtered = np.lib.stride_tricks.sliding_window_view(
+        windows, len(kernels[1]), axis=2) @ kernels[1]
+    filtered = np.lib.stride_tricks.sliding_window_view(
+        filtered, len(kernels[0]), axis=1) @ kernels[0]
+    norm_y = norms[0][:n_coarse_y * scale].reshape(n_coarse_y, scale)[partial[1]]
+    norm_x = norms[1][:n_coarse_x * scale].reshape(n_coarse_x, scale)[partial[2]]
+    filtered /= norm_y[:, :, np.newaxis] * norm_x[:, np.newaxis, :]
+    block_valid = valid[partial[0], partial[1], :, partial[2], :]
+    result[partial] = (
+        np.where(block_valid, filtered, 0).sum(axis=(1, 2)) / counts[partial])
+
+def _decimating_filter_1d(
+        data: np.ndarray, weights: np.ndarray, scale: int, axis: int
+        ) -> np.ndarray:
+    """
+    Apply the operator described by `_decimating_filter_weights` along the
+    given axis (-1 or -2) of `data`.
+
+    The operator is a banded matrix. We apply it as dense matrix products over
+    groups of consecutive coarse points, which is much faster than a loop over
+    the window and wastes little work.
+    """
+    n_coarse, window = weights.shape
+    radius = (window - scale) // 2
+    n = data.shape[axis]
+    group = max(1, 128 // scale)
+
+    shape = list(data.shape)
+    shape[axis] = n_coarse
+    result = np.empty(shape, dtype=np.result_type(data, weights))
+    for start in range(0, n_coarse, group):
+        stop = min(start + group, n_coarse)
+        # input range seen by these coarse points, and its part in the domain
+        lo = start * scale - radius
+        hi = (stop - 1) * scale - radius + window
+        lo_in, hi_in = max(lo, 0), min(hi, n)
+        matrix = np.zeros((stop - start, hi - lo), dtype=weights.dtype)
+        for j in range(stop - start):
+            matrix[j, j * scale:j * scale + window] = weights[start + j]
+        matrix = matrix[:, lo_in - lo:hi_in - lo]
+        if axis == -1:
+            result[..., start:stop] = data[..., lo_in:hi_in] @ matrix.T
+        else:
+            result[..., start:stop, :] = matrix @ data[..., lo_in:hi_in, :]
+    return result
 
-def _spatial_filter(data: np.ndarray, sigma: float) -> np.ndarray:
+@lru_cache(maxsize=None)
+def _gaussian_kernel_1d(sigma: float, truncate: float = 4.0) -> np.ndarray:
+    """
+    Compute the weights of a normalised, truncated 1D Gaussian kernel.
+
+    Matches the kernel used by `scipy.ndimage.gaussian_filter`, so that both
+    give the same results. Weights are memoised per `(sigma, truncate)`, as the
+    data step filters many blocks with the same few sigmas.
+
+    The returned array is shared between calls and must not be modified.
+    """
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 / (sigma * sigma) * x**2)
+    weights /= weights.sum()
+    weights.flags.writeable = False
+    return weights
+
+def _spatial_sigmas(
+        sigma: Union[float, Sequence[float]], n_spatial_dims: int
+        ) -> Tuple[float, ...]:
+    """Expand a scalar or per-axis sigma into one sigma per spatial axis."""
+    if np.ndim(sigma) == 0:
+        return (float(sigma),) * n_spatial_dims
+    sigmas = tuple(float(s) for s in sigma)
+    if len(sigmas) != n_spatial_dims:
+        raise ValueError(
+            f"expected {n_spatial_dims} sigmas (one per spatial axis), "
+            f"got {len(sigmas)}")
+    return sigmas
+
+def _spatial_filter(
+        data: np.ndarray,
+        sigma: Union[float, Sequence[float]],
+        out: Optional[np.ndarray] = None,
+        ) -> np.ndarray:
     """
     Apply a Gaussian filter to spatial data.
 
-    Apply scipy Gaussian filter to along all dimensions except first one, which
-    corresponds to time.
+    Apply a Gaussian filter along all dimensions except the first one, which
+    corresponds to time. The whole block is filtered at once, as a sequence of
+    separable 1D passes (one per spatial axis) with precomputed kernel weights.
+    Values outside the domain are taken to be zero (`mode="constant"`).
+
+    Results match applying `scipy.ndimage.gaussian_filter` to each time step.
 
     Parameters
     ----------
     data : ndarray
         Data to filter.
-    sigma : float
-        Unitless scale of the filter.
+    sigma : float or sequence of floats
+        Unitless scale of the filter. May be given per spatial axis.
+    out : ndarray, optional
+        Array to write the result to, of the same shape as `data`. May be
+        reused across calls to avoid allocating a new array for each block.
+        Passing `data` itself filters in place.
 
     Returns
     -------
     result : ndarray
         Filtered data
     """
-    result = np.zeros_like(data)
-    for t in range(data.shape[0]):
-        data_t = data[t, ...]
-        result_t = gaussian_filter(data_t, sigma, mode="constant")
-        result[t, ...] = result_t
-    return result
+    sigmas = _spatial_sigmas(sigma, data.ndim - 1)
+    if out is None:
+        dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else float
+        out = np.empty(data.shape, dtype=dtype)
+    elif out.shape != data.shape:
+        raise ValueError(
+            f"output buffer shape {out.shape} does not match data shape {data.shape}")
+
+    # like `gaussian_filter`, each pass reads from the previous pass's output,
+    # so we need no buffer beyond `out`
+    src = data
+    for axis, s in enumerate(sigmas, start=1):
+        if s <= 1e-15:
+            # no filtering requested along this axis
+            continue
+        correlate1d(src, _gaussian_kernel_1d(s), axis=axis, output=out,
+                    mode="constant", cval=0.0)
+        src = out
+    if src is data and out is not data:
+        # every sigma was zero: nothing filtered, copy input through
+        np.copyto(out, data)
+    return out
+
+def _spatial_filter_fft(
+        data: np.ndarray,
+        sigma: Union[float, Sequence[float]],
+        out: Optional[np.ndarray] = None,
+        ) -> np.ndarray:
+    """
+    Apply a Gaussian filter to spatial data using FFT convolution.
+
+    Same interface and results (up to floating point error) as
+    `_spatial_filter`, including the zero padding of `mode="constant"`. The
+    cost does not depend on the kernel radius, so this is faster for the large
+    sigmas used with high coarsening factors.
+
+    Points the kernel cannot reach from any non-zero input are set to exactly
+    zero, and NaNs spread over the kernel footprint only, like with direct
+    convolution. (Plain FFT convolution leaves round-off noise everywhere, and
+    a single NaN would fill the whole block.)
+
+    Parameters
+    ----------
+    data : ndarray
+        Data to filter.
+    sigma : float or sequence of floats
+        Unitless scale of the filter. May be given per spatial axis.
+    out : ndarray, optional
+        Array to write the result to, of the same shape as `data`.
+
+    Returns
+    -------
+    result : ndarray
+        Filtered data
+    """
+    sigmas = _spatial_sigmas(sigma, data.ndim - 1)
+    dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else float
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    elif out.shape != data.shape:
+        raise ValueError(
+            f"output buffer shape {out.shape} does not match data shape {data.shape}")
+
+    # the kernel is the outer product of the per-axis 1D kernels, with a
+    # leading axis of length 1 so that time steps are filtered independently
+    kernel = np.ones((1,) * data.ndim, dtype=dtype)
+    sizes = []
+    for axis, s in enumerate(sigmas, start=1):
+        weights = _gaussian_kernel_1d(s) if s > 1e-15 else np.ones(1)
+        shape = [1] * data.ndim
+        shape[axis] = len(weights)
+        kernel = kernel * weights.reshape(shape).astype(dtype)
+        sizes.append(len(weights))
+    axes = tuple(range(1, data.ndim))
+
+    nans = np.isnan(data)
+    has_nans = nans.any()
+    if has_nans:
+        data = np.where(nans, 0, data)
+
+    result = fftconvolve(data, kernel, mode="same", axes=axes)
+    result[~_dilate_spatial(data != 0, sizes)] = 0
+    if has_nans:
+        result[_dilate_spatial(nans, sizes)] = np.nan
+    np.copyto(out, result, casting="same_kind")
+    return out
+
+def _dilate_spatial(mask: np.ndarray, sizes: Sequence[int]) -> np.ndarray:
+    """
+    Dilate a boolean mask over a rectangular footprint along the spatial axes
+    (all but the first), with the given footprint size per axis.
+    """
+    dilated = mask.view(np.uint8)
+    for axis, size in enumerate(sizes, start=1):
+        if size > 1:
+            dilated = maximum_filter1d(dilated, size, axis=axis, mode="constant")
+    return dilated.astype(bool)
+
+# Filtering implementations with a common `(data, sigma, out=None)` interface,
+# selectable with the `backend` argument of `spatial_filter_dataset`.
+SPATIAL_FILTER_BACKENDS = {
+    "direct": _spatial_filter,
+    "fft": _spatial_filter_fft,
+}
+
+@lru_cache(maxsize=None)
+def _select_spatial_filter_backend(
+        shape: Tuple[int, ...], sigmas: Tuple[float, ...], repeats: int,
+        dtype: str,
+        ) -> str:
+    # only a few time steps are needed, cost is linear in the time dimension
+    sample_shape = (min(shape[0], 2),) + tuple(shape[1:])
+    sample = np.random.default_rng(0).standard_normal(sample_shape).astype(dtype)
+    out = np.empty_like(sample)
+    timings = {}
+    for name, spatial_filter in SPATIAL_FILTER_BACKENDS.items():
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            spatial_filter(sample, sigmas, out=out)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    chosen = min(timings, key=timings.get)
+    logger.debug(
+        f"spatial filter calibration for block {shape} of {dtype}, sigma {sigmas}: "
+        f"{timings} -> {chosen}")
+    return chosen
+
+def select_spatial_filter_backend(
+        shape: Tuple[int, ...],
+        sigma: Union[float, Sequence[float]],
+        repeats: int = 3,
+        dtype: np.dtype = np.float64,
+        ) -> str:
+    """
+    Pick the fastest spatial filtering backend for the given block shape and
+    sigma by timing each backend on random data.
+
+    Calibration runs once per `(shape, sigma, dtype)` in a process, later calls
+    return the memoised choice.
+
+    Parameters
+    ----------
+    shape : tuple of ints
+        Shape of the blocks to filter, time first.
+    sigma : float or sequence of floats
+        Unitless scale of the filter. May be given per spatial axis.
+    repeats : int, optional
+        Number of timed runs per backend, the fastest run is kept.
+        The default is 3.
+    dtype : numpy dtype, optional
+        Data type of the blocks. The default is float64.
+
+    Returns
+    -------
+    backend : str
+        Name of the chosen backend, a key of `SPATIAL_FILTER_BACKENDS`.
+    """
+    sigmas = _spatial_sigmas(sigma, len(shape) - 1)
+    return _select_spatial_filter_backend(
+        tuple(shape), sigmas, repeats, np.dtype(dtype).str)
@@ -4,6 +4,11 @@ import xarray as xr
 import numpy as np
 import torch.utils.data as torch
 
+import json
+import os
+import shutil
+import tempfile
+
 from gz21_ocean_momentum.common.assorted import at_idx_pct
 
 from gz21_ocean_momentum.data.datasets import (
@@ -13,6 +18,7 @@ from gz21_ocean_momentum.data.datasets import (
     ConcatDataset_,
     Subset_,
     ComposeTransforms,
+    ShardDataset,
 )
 
 def cm26_xarray_to_torch(ds_xr: xr.Dataset) -> torch.Dataset:
@@ -28,7 +34,8 @@ def cm26_xarray_to_torch(ds_xr: xr.Dataset) -> torch.Dataset:
     ds_torch.add_output("S_y")
     return ds_torch
 
-def gz21_train_data_subdomain_xr_to_torch(ds_xr: xr.Dataset) -> torch.Dataset:
+def gz21_train_data_subdomain_xr_to_torch(
+        ds_xr: xr.Dataset, materialize: bool = False) -> torch.Dataset:
     """
     Convert GZ21 training data (coarsened CM2.6 data with diagnosed forcings)
     into a PyTorch dataset.
@@ -36,8 +43,15 @@ def gz21_train_data_subdomain_xr_to_torch(ds_xr: xr.Dataset) -> torch.Dataset:
     Intended to take in a single spatial subdomain of the "main" dataset.
     Apply submodel transforms first.
     Perform dataset splits after.
+
+    With `materialize`, the subdomain's features and targets are loaded once
+    into contiguous float32 arrays (see `RawDataFromXrDataset.materialize`),
+    so that samples are array slices instead of per-sample reads of the
+    xarray dataset. The subdomain must then fit in memory.
     """
     ds_torch = cm26_xarray_to_torch(ds_xr)
+    if materialize:
+        ds_torch.materialize(np.float32)
 
     # prep empty transform, filled in later by custom torch DataLoaders
     features_transform = ComposeTransforms()
@@ -91,3 +105,82 @@ def prep_train_test_dataloaders(
     )
 
     return train_dataloader, test_dataloader
+
+def write_training_shards(
+        dss: list,
+        out_dir: str,
+        shard_size: int = 256,
+        dtype=np.float32) -> None:
+    """
+    Write the samples of PyTorch datasets, with their transforms applied, to
+    fixed-shape `.npy` shards, for reading with `load_training_shards`.
+
+    Intended for the subdomain datasets once prepared for training, i.e.
+    scaled, cropped to a common shape and with the transforms from the model
+    added (targets cropped to its output shape), so that training from the
+    shards skips all of this.
+
+    Each dataset is written to `<out_dir>/subdomain_<i>`, as shards
+    `features_<k>.npy` and `targets_<k>.npy` of `shard_size` samples (fewer
+    for the last), and an index file. The shards are written to a temporary
+    directory renamed to `out_dir` when complete.
+
+    Parameters
+    ----------
+    dss: list
+        Datasets to write, e.g. one per subdomain.
+
+    out_dir: str
+        Shard directory to create. Must not exist.
+
+    shard_size: int
+        Number of samples per shard.
+
+    dtype
+        Data type of the shards.
+    """
+    if os.path.exists(out_dir):
+        raise FileExistsError(f"shard directory {out_dir} already exists")
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".shards.", suffix=".tmp")
+    try:
+        for i, ds in enumerate(dss):
+            subdomain_dir = os.path.join(tmp_dir, f"subdomain_{i}")
+            if len(ds) == 0:
+                raise ValueError(f"dataset {i} has no samples to write")
+            os.mkdir(subdomain_dir)
+            shards = []
+            for k, start in enumerate(range(0, len(ds), shard_size)):
+                features, targets = ds[np.arange(start, min(start + shard_size, len(ds)))]
+                shard = {
+                    "features": f"features_{k:05d}.npy",
+                    "targets": f"targets_{k:05d}.npy",
+                    "n_samples": len(features),
+                }
+                np.save(os.path.join(subdomain_dir, shard["features"]), features.astype(dtype))
+                np.save(os.path.join(subdomain_dir, shard["targets"]), targets.astype(dtype))
+                shards.append(shard)
+            index = {
+                "shards": shards,
+                "features_shape": list(features.shape[1:]),
+                "targets_shape": list(targets.shape[1:]),
+                "dtype": np.dtype(dtype).name,
+            }
+            with open(os.path.join(subdomain_dir, ShardDataset.INDEX_NAME), "w") as f:
+                json.dump(index, f, indent=2)
+        os.rename(tmp_dir, out_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+def load_training_shards(shards_dir: str) -> list:
+    """
+    Load the datasets written by `write_training_shards`, one
+    `ShardDataset` per subdomain, in order.
+    """
+    names = [name for name in os.listdir(shards_dir) if name.startswith("subdomain_")]
+    if not names:
+        raise FileNotFoundError(f"no subdomain shards in {shards_dir}")
+    names.sort(key=lambda name: int(name.split("_")[1]))
+    return [ShardDataset(os.path.join(shards_dir, name)) for name in names]
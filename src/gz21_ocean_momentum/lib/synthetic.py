@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Synthetic CM2.6 data: a local, offline stand-in for the Pangeo datasets."""
+
+import xarray as xr
+import dask
+import dask.array as da
+import numpy as np
+import scipy.fft
+import yaml
+
+import os
+from typing import Sequence
+from typing import Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6.371e6
+
+# intake catalog layout of the Pangeo ocean catalog, as used by
+# `lib.data.retrieve_cm2_6`
+CATALOG_NAME = "catalog.yaml"
+CM2_6_CATALOG_NAME = "GFDL_CM2.6.yaml"
+CM2_6_STORES = {
+    "GFDL_CM2_6_control_ocean_surface": "control_ocean_surface.zarr",
+    "GFDL_CM2_6_one_percent_ocean_surface": "one_percent_ocean_surface.zarr",
+    "GFDL_CM2_6_grid": "grid.zarr",
+}
+
+def synthetic_cm2_6_grid(
+    ny: int = 2700,
+    nx: int = 3600,
+    land_fraction: float = 0.3,
+    seed: int = 0,
+    lat_range: Tuple[float, float] = (-81.1, 90.0),
+    long_range: Tuple[float, float] = (-280.0, 80.0),
+) -> xr.Dataset:
+    """
+    Generate a grid dataset laid out like `GFDL_CM2_6_grid`.
+
+    The B-grid has velocity points ("yu_ocean", "xu_ocean") at the north-east
+    corners of the tracer cells ("yt_ocean", "xt_ocean"). Longitudes are
+    evenly spaced over one cycle; latitude spacing follows the Mercator
+    projection up to 65 degrees, and is constant beyond. The land mask has
+    continents from smooth random noise, plus Antarctica south of 78S.
+
+    Parameters
+    ----------
+    ny, nx : int, optional
+        Number of points along latitude and longitude. The defaults are those
+        of CM2.6.
+    land_fraction : float, optional
+        Fraction of the tracer cells north of Antarctica that are land. The
+        default is 0.3.
+    seed : int, optional
+        Random seed for the land mask. The default is 0.
+    lat_range, long_range : (float, float), optional
+        Southern and northern, western and eastern edges of the domain, in
+        degrees. The longitude range should span 360 degrees.
+
+    Returns
+    -------
+    grid : xarray Dataset
+        Grid with coordinates "dxu", "dyu" (in m, on velocity points) and
+        "wet" (1 for ocean tracer cells, else 0).
+    """
+    # latitude of the cell edges, from the inverse of the stretched coordinate
+    lats = np.linspace(*lat_range, 100 * ny + 1)
+    stretch = 1 / np.maximum(np.cos(np.deg2rad(lats)), np.cos(np.deg2rad(65)))
+    stretched = np.concatenate(([0], np.cumsum((stretch[1:] + stretch[:-1]) / 2)))
+    edges = np.interp(np.linspace(0, stretched[-1], ny + 1), stretched, lats)
+    dx = (long_range[1] - long_range[0]) / nx
+    coords = {
+        "yu_ocean": edges[1:],
+        "xu_ocean": long_range[0] + dx * np.arange(1, nx + 1),
+        "yt_ocean": (edges[1:] + edges[:-1]) / 2,
+        "xt_ocean": long_range[0] + dx * (np.arange(nx) + 0.5),
+    }
+
+    dxu = (EARTH_RADIUS * np.deg2rad(dx)
+           * np.cos(np.deg2rad(coords["yu_ocean"]))[:, None] * np.ones(nx))
+    dyu = (EARTH_RADIUS * np.deg2rad(np.gradient(coords["yu_ocean"]))[:, None]
+           * np.ones(nx))
+
+    # continents: large-scale noise above a threshold
+    rng = np.random.default_rng(seed)
+    noise = _smooth_noise(rng, (ny, nx), max(ny, nx) / 16)
+    antarctica = coords["yt_ocean"] < -78
+    threshold = np.quantile(noise[~antarctica], 1 - land_fraction)
+    land = (noise > threshold) | antarctica[:, None]
+
+    attrs = {"units": "m"}
+    return xr.Dataset(
+        coords={
+            **{dim: (dim, values, {"units": "degrees"}) for dim, values in coords.items()},
+            "dxu": (("yu_ocean", "xu_ocean"), dxu, attrs),
+            "dyu": (("yu_ocean", "xu_ocean"), dyu, attrs),
+            "wet": (("yt_ocean", "xt_ocean"), (~land).astype(np.float64)),
+        },
+        attrs={"title": "synthetic CM2.6 grid"},
+    )
+
+def synthetic_cm2_6_surface(
+    grid: xr.Dataset,
+    n_times: int,
+    time_chunk: int = 1,
+    speed: float = 0.2,
+    seed: int = 0,
+) -> xr.Dataset:
+    """
+    Generate a lazy surface velocity dataset laid out like
+    `GFDL_CM2_6_control_ocean_surface`, on a grid from `synthetic_cm2_6_grid`.
+
+    Velocities derive from a streamfunction with a k^-3 energy spectrum
+    beyond an eddy scale of about 1 degree (at least 8 points), so they are
+    non-divergent, with phases drifting over about a month at that scale.
+    A zonal jet stands for the Antarctic Circumpolar Current. Velocity points
+    next to land are NaN, as in CM2.6.
+
+    Parameters
+    ----------
+    grid : xarray Dataset
+        Grid dataset from `synthetic_cm2_6_grid`.
+    n_times : int
+        Number of daily time points.
+    time_chunk : int, optional
+        Time points per chunk. The default is 1.
+    speed : float, optional
+        RMS speed of the eddies, in m/s. The default is 0.2.
+    seed : int, optional
+        Random seed for the eddy field. The default is 0.
+
+    Returns
+    -------
+    surface : xarray Dataset
+        Dask-backed float32 "usurf" and "vsurf" over ("time", "yu_ocean",
+        "xu_ocean"), chunked along time only.
+    """
+    ny, nx = grid.sizes["yu_ocean"], grid.sizes["xu_ocean"]
+    # velocity points are land if any neighbouring tracer cell is, with the
+    # domain periodic in longitude
+    land = grid["wet"].values == 0
+    land = land | np.roll(land, -1, axis=1)
+    land[:-1] |= land[1:]
+    jet = 0.3 * np.exp(-((grid["yu_ocean"].values + 55) / 5)**2)
+    fields = dask.delayed({"land": land, "jet": jet})
+
+    blocks = []
+    for start in range(0, n_times, time_chunk):
+        stop = min(start + time_chunk, n_times)
+        block = dask.delayed(_synthetic_velocities)(
+            range(start, stop), (ny, nx), speed, seed, fields)
+        blocks.append(da.from_delayed(
+            block, shape=(2, stop - start, ny, nx), dtype=np.float32))
+    u_v = da.concatenate(blocks, axis=1)
+
+    times = xr.date_range(
+        "0181-01-01", periods=n_times, freq="D", calendar="julian",
+        use_cftime=True)
+    dims = ("time", "yu_ocean", "xu_ocean")
+    coords = {"time": times, "yu_ocean": grid["yu_ocean"], "xu_ocean": grid["xu_ocean"]}
+    return xr.Dataset(
+        {
+            "usurf": (dims, u_v[0], {"long_name": "i-current", "units": "m/sec"}),
+            "vsurf": (dims, u_v[1], {"long_name": "j-current", "units": "m/sec"}),
+        },
+        coords=coords,
+        attrs={"title": "synthetic CM2.6 ocean surface"},
+    )
+
+def write_synthetic_cm2_6(
+    out_dir: str,
+    n_times: int = 10,
+    ny: int = 2700,
+    nx: int = 3600,
+    time_chunk: int = 1,
+    land_fraction: float = 0.3,
+    speed: float = 0.2,
+    seed: int = 0,
+) -> str:
+    """
+    Write synthetic CM2.6 grid and surface zarr stores to `out_dir`, with an
+    intake catalog usable in place of the Pangeo ocean catalog by
+    `lib.data.retrieve_cm2_6`.
+
+    The control and 1% CO2 increase datasets share the grid, and differ by
+    their random seed.
+
+    Parameters
+    ----------
+    out_dir : str
+        Output directory.
+    n_times, time_chunk, speed, seed
+        See `synthetic_cm2_6_surface`.
+    ny, nx, land_fraction
+        See `synthetic_cm2_6_grid`, which uses `seed` too.
+
+    Returns
+    -------
+    catalog_path : str
+        Path to the top-level intake catalog.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    grid = synthetic_cm2_6_grid(ny, nx, land_fraction, seed)
+    logger.info(f"writing synthetic CM2.6 grid of {ny}x{nx} points...")
+    grid.to_zarr(os.path.join(out_dir, CM2_6_STORES["GFDL_CM2_6_grid"]), mode="w")
+    for offset, name in enumerate((
+            "GFDL_CM2_6_control_ocean_surface",
+            "GFDL_CM2_6_one_percent_ocean_surface")):
+        logger.info(f"writing {n_times} time points of synthetic {name}...")
+        surface = synthetic_cm2_6_surface(grid, n_times, time_chunk, speed, seed + offset)
+        surface.to_zarr(os.path.join(out_dir, CM2_6_STORES[name]), mode="w")
+
+    cm2_6_catalog = {
+        "metadata": {"version": 1},
+        "sources": {
+            name: {
+                "description": f"synthetic stand-in for {name}",
+                "driver": "zarr",
+                "args": {"urlpath": f"{{{{ CATALOG_DIR }}}}/{store}", "consolidated": True},
+            }
+            for name, store in CM2_6_STORES.items()},
+    }
+    catalog = {
+        "metadata": {"version": 1},
+        "sources": {
+            "GFDL_CM2_6": {
+                "description": "synthetic CM2.6 datasets",
+                "driver": "intake.catalog.local.YAMLFileCatalog",
+                "args": {"path": f"{{{{ CATALOG_DIR }}}}/{CM2_6_CATALOG_NAME}"},
+            },
+        },
+    }
+    with open(os.path.join(out_dir, CM2_6_CATALOG_NAME), "w") as f:
+        yaml.safe_dump(cm2_6_catalog, f, sort_keys=False)
+    catalog_path = os.path.join(out_dir, CATALOG_NAME)
+    with open(catalog_path, "w") as f:
+        yaml.safe_dump(catalog, f, sort_keys=False)
+    return catalog_path
+
+def _synthetic_velocities(
+    times: Sequence[int],
+    shape: Tuple[int, int],
+    speed: float,
+    seed: int,
+    fields: dict,
+) -> np.ndarray:
+    """
+    Velocities `(usurf, vsurf)` at the given time indices, stacked along the
+    first axis. The spectral coefficients depend on `seed` only, so blocks of
+    time points can be generated independently.
+    """
+    ny, nx = shape
+    k0 = 1 / max(8.0, nx / 360)
+    ky = np.fft.fftfreq(ny)[:, None]
+    kx = np.fft.fftfreq(nx)[None, :]
+    k = np.sqrt(kx**2 + ky**2)
+    amplitude = (1 + (k / k0)**2)**-1.5
+    rng = np.random.default_rng(seed)
+    phase = rng.uniform(0, 2 * np.pi, shape)
+    # eddies at the eddy scale drift over 30 days, smaller ones faster
+    frequency = rng.choice((-1, 1), shape) * 2 * np.pi / 30 * np.sqrt(k / k0)
+    # u = -dpsi/dy and v = dpsi/dx, normalised for the RMS speed
+    u_coef = -2j * np.pi * ky * amplitude
+    v_coef = 2j * np.pi * kx * amplitude
+    norm = speed / np.sqrt((np.sum(np.abs(u_coef)**2) + np.sum(np.abs(v_coef)**2))
+                           / (2 * (ny * nx)**2))
+
+    u_v = np.empty((2, len(times), ny, nx), dtype=np.float32)
+    for i, t in enumerate(times):
+        rotation = np.exp(1j * (phase + frequency * t)).astype(np.complex64)
+        for j, coef in enumerate((u_coef, v_coef)):
+            u_v[j, i] = norm * scipy.fft.ifft2(coef.astype(np.complex64) * rotation).real
+    u_v[0] += fields["jet"][:, None]
+    u_v[:, :, fields["land"]] = np.nan
+    return u_v
+
+def _smooth_noise(rng: np.random.Generator, shape: Tuple[int, int], scale: float) -> np.ndarray:
+    """Gaussian noise smoothed over about `scale` points, periodic in both axes."""
+    ky = np.fft.fftfreq(shape[0])[:, None]
+    kx = np.fft.fftfreq(shape[1])[None, :]
+    spectrum = np.fft.fft2(rng.standard_normal(shape))
+    return np.fft.ifft2(spectrum * np.exp(-(kx**2 + ky**2) * (np.pi * scale)**2)).real
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the on-disk chunk cache."""
+
+import fsspec
+import os
+import xarray as xr
+import gz21_ocean_momentum.common.chunk_cache as chunk_cache
+import gz21_ocean_momentum.lib.data as lib
+import gz21_ocean_momentum.lib.synthetic as synthetic
+
+class TestChunkCache:
+    "Class to test the chunk cache filesystem."
+
+    def test_chunk_cache(self, tmp_path):
+        """
+        Check that the chunk cache serves repeated reads without the target
+        filesystem, refetches corrupt entries, and evicts the least recently
+        used entries to stay under its size bound.
+        """
+        target = fsspec.filesystem("memory")
+        for i in range(4):
+            target.pipe_file(f"/store/{i}", bytes([i]) * 100)
+        cache_dir = str(tmp_path / "cache")
+        cached = chunk_cache.ChunkCacheFileSystem(target, cache_dir, 1000)
+
+        assert cached.cat_file("/store/0") == bytes([0]) * 100
+        assert cached.cat_file("/store/0") == bytes([0]) * 100
+        assert (cached.hits, cached.misses) == (1, 1)
+        target.pipe_file("/store/0", b"changed")
+        assert cached.cat_file("/store/0") == bytes([0]) * 100
+
+        entry = cached._entry_path("/store/0")
+        with open(entry, "r+b") as f:
+            f.seek(-1, 2)
+            f.write(b"x")
+        assert cached.cat_file("/store/0") == b"changed"
+        assert cached.misses == 2
+
+        # room for two entries: the least recently read is evicted
+        small = chunk_cache.ChunkCacheFileSystem(target, str(tmp_path / "small"), 300)
+        small.cat_file("/store/1")
+        small.cat_file("/store/2")
+        os.utime(small._entry_path("/store/1"), (0, 0))
+        small.cat_file("/store/3")
+        assert not os.path.exists(small._entry_path("/store/1"))
+        assert os.path.exists(small._entry_path("/store/3"))
+        assert sum(size for _, size, _ in small._directory.entries()) <= 300
+
+        # full, the cache is evicted down to its low-water mark, so that the
+        # next writes do not evict again; instances share a directory's
+        # accounting
+        for i in range(4):
+            target.pipe_file(f"/other/{i}", bytes([i]) * 100)
+        bound = 4 * 132
+        first = chunk_cache.ChunkCacheFileSystem(target, str(tmp_path / "shared"), bound)
+        second = chunk_cache.ChunkCacheFileSystem(target, str(tmp_path / "shared"), bound)
+        assert first._directory is second._directory
+        for i in range(4):
+            first.cat_file(f"/store/{i}")
+        second.cat_file("/other/0")
+        entries = list(first._directory.entries())
+        assert first._directory.size == sum(size for _, size, _ in entries)
+        assert first._directory.size <= chunk_cache.EVICTION_LOW_WATER * bound
+        n_entries = len(entries)
+        second.cat_file("/other/1")
+        assert len(list(first._directory.entries())) == n_entries + 1
+
+        catalog = synthetic.write_synthetic_cm2_6(
+            str(tmp_path / "data"), n_times=2, ny=40, nx=60)
+        surface_fields, grid = lib.retrieve_cm2_6(catalog, co2_increase=False)
+        for _ in range(2):
+            cached_fields, cached_grid = lib.retrieve_cm2_6(
+                catalog, co2_increase=False, cache_dir=cache_dir)
+            xr.testing.assert_identical(cached_fields.compute(), surface_fields.compute())
+            xr.testing.assert_identical(cached_grid.compute(), grid.compute())
+        assert len(list(cached._directory.entries())) > 1
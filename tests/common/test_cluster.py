@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the Dask cluster setup."""
+
+import dask
+import pytest
+import gz21_ocean_momentum.common.cluster as cluster
+
+class TestCluster:
+    "Class to test the Dask cluster setup."
+
+    def test_start_dask_client(self, tmp_path):
+        """
+        Check that a local cluster's workers get the memory thresholds and
+        spill directory, and that the Dask configuration is left as it was.
+        """
+        pytest.importorskip("distributed")
+        thresholds = cluster.WORKER_MEMORY_THRESHOLDS
+        with dask.config.set({key: 0.5 for key in thresholds}):
+            client = cluster.start_dask_client(
+                    n_workers=1, memory_limit="1GB", spill_dir=str(tmp_path),
+                    processes=False)
+            try:
+                def worker_settings(dask_worker):
+                    manager = dask_worker.memory_manager
+                    return (manager.memory_target_fraction,
+                            manager.memory_spill_fraction,
+                            manager.memory_pause_fraction,
+                            dask_worker.local_directory)
+                (settings,) = client.run(worker_settings).values()
+            finally:
+                client.close()
+                client.cluster.close()
+            assert all(dask.config.get(key) == 0.5 for key in thresholds)
+        assert settings[:3] == tuple(
+                thresholds[f"distributed.worker.memory.{name}"]
+                for name in ("target", "spill", "pause"))
+        assert settings[3].startswith(str(tmp_path))
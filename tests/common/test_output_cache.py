@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the cache of finished outputs."""
+
+import os
+import gz21_ocean_momentum.common.output_cache as output_cache
+
+class TestOutputCache:
+    "Class to test the output cache."
+
+    def test_output_cache(self, tmp_path):
+        """
+        Check that outputs are cached under a key of their parameters and the
+        library version, moved or copied into the cache, reused as copies or
+        links, listed and evicted.
+        """
+        params = {"factor": [4], "ntimes": 10, "co2_increase": False}
+        key = output_cache.output_key(params)
+        assert key == output_cache.output_key(dict(reversed(list(params.items()))))
+        assert key != output_cache.output_key({**params, "ntimes": 11})
+        assert key != output_cache.output_key(params, version="0.0.0")
+
+        cache_dir = str(tmp_path / "cache")
+        assert output_cache.lookup_output(cache_dir, key) is None
+        out_dir = tmp_path / "out"
+        (out_dir / "S_x").mkdir(parents=True)
+        (out_dir / "S_x" / "0").write_bytes(b"x" * 100)
+        cached = output_cache.store_output(cache_dir, key, str(out_dir), params)
+        assert output_cache.lookup_output(cache_dir, key) == cached
+        # moved, with a link left in its place
+        assert os.path.islink(out_dir)
+        assert os.path.realpath(out_dir) == os.path.realpath(cached)
+        assert (out_dir / "S_x" / "0").read_bytes() == b"x" * 100
+
+        output_cache.reuse_output(cached, str(tmp_path / "copy"))
+        assert (tmp_path / "copy" / "S_x" / "0").read_bytes() == b"x" * 100
+        (tmp_path / "link").mkdir()
+        output_cache.reuse_output(cached, str(tmp_path / "link"), link=True)
+        assert os.path.islink(tmp_path / "link")
+        assert (tmp_path / "link" / "S_x" / "0").read_bytes() == b"x" * 100
+
+        other = output_cache.output_key({**params, "ntimes": 11})
+        copied = output_cache.store_output(cache_dir, other, str(out_dir), params, copy=True)
+        assert os.path.realpath(out_dir) == os.path.realpath(cached)
+        assert not os.path.islink(copied)
+        assert (tmp_path / "cache" / other / "output" / "S_x" / "0").read_bytes() == b"x" * 100
+        os.utime(os.path.join(cache_dir, key, output_cache.OUTPUT_CACHE_META_NAME), (0, 0))
+        entries = output_cache.list_outputs(cache_dir)
+        assert [meta["key"] for meta in entries] == [key, other]
+        assert entries[0]["params"] == params and entries[0]["size_bytes"] == 100
+
+        assert output_cache.evict_outputs(cache_dir, max_bytes=150) == [key]
+        assert output_cache.lookup_output(cache_dir, key) is None
+        assert (tmp_path / "copy" / "S_x" / "0").exists()
+        assert output_cache.evict_outputs(cache_dir, max_age=3600) == []
+        assert output_cache.evict_outputs(cache_dir, max_age=0) == [other]
+
+    def test_output_cache_input_file_param(self, tmp_path, monkeypatch):
+        """
+        Check that local input files stand in cache keys for their absolute
+        path and contents, and remote ones for their URI.
+        """
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "catalog.yaml").write_text("sources: {}\n")
+        monkeypatch.chdir(tmp_path / "a")
+        param = output_cache.input_file_param("catalog.yaml")
+        assert param.startswith(str(tmp_path / "a" / "catalog.yaml") + "#")
+        assert output_cache.input_file_param(f"file://{tmp_path}/a/catalog.yaml") == param
+        monkeypatch.chdir(tmp_path / "b")
+        assert output_cache.input_file_param("catalog.yaml") != param
+        (tmp_path / "a" / "catalog.yaml").write_text("sources: {other: {}}\n")
+        assert output_cache.input_file_param(str(tmp_path / "a" / "catalog.yaml")) != param
+        uri = "https://example.org/catalog.yaml"
+        assert output_cache.input_file_param(uri) == uri
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the read-ahead of dataset chunks."""
+
+import dask
+import fsspec.implementations.memory
+import numpy as np
+import threading
+import time
+import xarray as xr
+import gz21_ocean_momentum.common.read_ahead as lib_read_ahead
+import gz21_ocean_momentum.lib.data as lib
+
+class TestReadAhead:
+    "Class to test the read-ahead of dataset chunks."
+
+    def test_read_ahead(self, tmp_path):
+        """
+        Check that chunks of a store with latency are read ahead concurrently,
+        for slabs being written and along time, within the byte budget.
+        """
+        class SlowMemoryFileSystem(fsspec.implementations.memory.MemoryFileSystem):
+            """Memory filesystem with latency, counting reads of "u" chunks."""
+            protocol = "slowmemory"
+            u_reads = 0
+            active = peak_active = 0
+            lock = threading.Lock()
+            def cat_file(self, path, start=None, end=None, **kwargs):
+                if "/u/" in path:
+                    with self.lock:
+                        self.u_reads += 1
+                        self.active += 1
+                        self.peak_active = max(self.peak_active, self.active)
+                    time.sleep(0.05)
+                    with self.lock:
+                        self.active -= 1
+                return super().cat_file(path, start=start, end=end, **kwargs)
+
+        ds = xr.Dataset(
+            {"u": (("time", "y", "x"), np.random.randn(12, 20, 30))},
+            coords={"time": np.arange(12)}).chunk({"time": 1, "x": 15})
+        ds.to_zarr(f"memory://{tmp_path.name}.zarr", mode="w")
+        fs = SlowMemoryFileSystem()
+        opened = xr.open_zarr(fs.get_mapper(f"/{tmp_path.name}.zarr"))
+        chunk_bytes = 20 * 15 * 8
+
+        def write(read_ahead, out_dir):
+            u = opened if read_ahead is None else read_ahead.wrap(opened)
+            prefetch = release = None
+            if read_ahead is not None:
+                prefetch = lambda times: read_ahead.prefetch({"time": times})
+                release = lambda times: read_ahead.release_before(times.stop)
+            fs.peak_active = 0
+            with dask.config.set(scheduler="synchronous"):
+                lib.write_forcings_in_slabs(
+                    2 * u, str(tmp_path / out_dir), slab_size=2,
+                    prefetch=prefetch, prefetch_slabs=2, release=release)
+
+        # one chunk read at a time otherwise, concurrently when read ahead
+        write(None, "out")
+        assert fs.peak_active == 1
+        read_ahead = lib_read_ahead.ReadAhead(max_bytes=12 * chunk_bytes)
+        write(read_ahead, "out_read_ahead")
+        read_ahead.close()
+        assert (read_ahead.hits, read_ahead.misses) == (24, 0)
+        assert read_ahead.peak_reserved_bytes <= 12 * chunk_bytes
+        assert fs.peak_active > 1
+        xr.testing.assert_equal(
+            xr.open_zarr(str(tmp_path / "out_read_ahead")).compute(), 2 * ds)
+
+        read_ahead = lib_read_ahead.ReadAhead(max_bytes=3 * chunk_bytes)
+        read_ahead.wrap(opened)
+        assert read_ahead.prefetch({"time": slice(0, 4)}) == 3
+        read_ahead.close()
+
+        # chunks read ahead but passed unused give back their budget
+        read_ahead = lib_read_ahead.ReadAhead(max_bytes=4 * chunk_bytes)
+        read_ahead.wrap(opened)
+        assert read_ahead.prefetch({"time": slice(0, 2)}) == 4
+        assert read_ahead.prefetch({"time": slice(2, 4)}) == 0
+        assert read_ahead.release_before(1) == 2
+        assert read_ahead.release_before(2) == 2
+        assert read_ahead.reserved_bytes == 0
+        assert read_ahead.prefetch({"time": slice(2, 4)}) == 4
+        read_ahead.close()
+
+        read_ahead = lib_read_ahead.ReadAhead(depth=3, max_bytes=6 * chunk_bytes)
+        u = read_ahead.wrap(opened)["u"]
+        for t in range(12):
+            assert np.array_equal(u.isel(time=t).values, ds["u"].values[t])
+        read_ahead.close()
+        assert (read_ahead.hits, read_ahead.misses) == (22, 2)
+        assert read_ahead.peak_reserved_bytes <= 6 * chunk_bytes
+
+        read_ahead = lib_read_ahead.ReadAhead(depth=1, max_bytes=4 * chunk_bytes)
+        u = read_ahead.wrap(opened)["u"]
+        u.isel(time=0).values
+        u.isel(time=5).values
+        assert read_ahead.released == 2
+        assert read_ahead.reserved_bytes == 2 * chunk_bytes
+        read_ahead.close()
+
+        # wrapped before rechunking, store chunks are read once however
+        # they are split
+        ds.chunk({"time": 4, "x": 15}).to_zarr(f"memory://{tmp_path.name}-4.zarr", mode="w")
+        read_ahead = lib_read_ahead.ReadAhead()
+        u = read_ahead.wrap(xr.open_zarr(fs.get_mapper(f"/{tmp_path.name}-4.zarr")))["u"]
+        fs.u_reads = 0
+        with dask.config.set(scheduler="synchronous"):
+            assert np.array_equal(u.chunk({"time": 1}).values, ds["u"].values)
+        read_ahead.close()
+        assert fs.u_reads == read_ahead.misses == 6
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the data step benchmarks."""
+
+import json
+import pytest
+import gz21_ocean_momentum.lib.benchmark as benchmark
+
+class TestDataBenchmarks:
+    "Class to test the data step benchmarks."
+
+    def test_run_data_benchmarks(self):
+        """Check that the benchmarks cover each case, with a JSON report."""
+        report = benchmark.run_data_benchmarks(
+            ny=40, nx=60, n_times=2, scales=[4], workers=[1, 2],
+            time_chunks=[1, 2], repeats=1)
+        json.dumps(report)
+        stages = [r["stage"] for r in report["results"]]
+        assert stages == ["advection", "filter", "coarsen"] + ["end_to_end"] * 4
+        for result in report["results"]:
+            assert result["points_per_second"] > 0
+            assert result["peak_rss_bytes"] > 0
+        assert all(r["n_tasks"] > 0 for r in report["results"][3:])
+        with pytest.raises(ValueError):
+            benchmark.run_data_benchmarks(stages=["read"])
@@ -2,12 +2,17 @@
 # -*- coding: utf-8 -*-
 """Unit tests for the data step."""
 
+import dask
 import pytest
+import tracemalloc
 import xarray as xr
 import numpy as np
 from numpy import ma
+from scipy.ndimage import gaussian_filter
 import matplotlib.pyplot as plt
 import gz21_ocean_momentum.lib.data as lib
+import gz21_ocean_momentum.lib.synthetic as synthetic
+from gz21_ocean_momentum.common.bounding_box import BoundingBox
 
 class TestEddyForcing:
     "Class to test eddy forcing routines."
@@ -20,6 +25,75 @@ class TestEddyForcing:
         filtered_a = lib._spatial_filter(a, 5)
         assert a.ndim == filtered_a.ndim
 
+    def test_spatial_filter_matches_per_time_step(self):
+        """
+        Check that filtering a whole block matches filtering each time step
+        separately with scipy, including when writing into a reused buffer.
+        """
+        a = np.random.randn(6, 30, 40)
+        expected = np.stack([gaussian_filter(a_t, 3, mode="constant") for a_t in a])
+        assert lib._spatial_filter(a, 3) == pytest.approx(expected)
+
+        out = np.empty_like(a)
+        filtered_a = lib._spatial_filter(a, 3, out=out)
+        assert filtered_a is out
+        assert out == pytest.approx(expected)
+
+    def test_spatial_filter_fft_matches_direct(self):
+        """
+        Check that the FFT backend matches direct filtering, including exact
+        zeros away from the data and NaNs spreading over the kernel only.
+        """
+        a = np.random.randn(3, 60, 50)
+        a[:, :20, :] = 0
+        a[1, 40, 25] = np.nan
+        direct = lib._spatial_filter(a, 3)
+        fft = lib._spatial_filter_fft(a, 3)
+        assert np.array_equal(np.isnan(direct), np.isnan(fft))
+        assert np.array_equal(direct == 0, fft == 0)
+        assert fft[~np.isnan(fft)] == pytest.approx(direct[~np.isnan(direct)])
+
+    def test_select_spatial_filter_backend(self):
+        """Check that calibration picks a known backend, and is memoised."""
+        backend = lib.select_spatial_filter_backend((2, 40, 30), 2.0)
+        assert backend in lib.SPATIAL_FILTER_BACKENDS
+        assert lib.select_spatial_filter_backend((2, 40, 30), 2.0) == backend
+
+    def test_auto_spatial_filter_backend(self, monkeypatch):
+        """
+        Check that the "auto" backend is picked once, on the largest block,
+        before the graph is built, so that edge blocks use the same backend.
+        """
+        calls = []
+
+        def select(shape, sigma, repeats=3, dtype=np.float64):
+            calls.append(tuple(shape))
+            return "fft"
+
+        monkeypatch.setattr(lib, "select_spatial_filter_backend", select)
+        ys, xs = np.arange(30) * 2.0, np.arange(25) * 2.0
+        grid = xr.Dataset({
+            "dxu": xr.DataArray(np.full((30, 25), 2.0), dims=("yu_ocean", "xu_ocean")),
+            "dyu": xr.DataArray(np.full((30, 25), 2.0), dims=("yu_ocean", "xu_ocean")),
+        }, coords={"yu_ocean": ys, "xu_ocean": xs})
+        data = xr.Dataset(
+            {"a": (("time", "yu_ocean", "xu_ocean"), np.random.randn(5, 30, 25))},
+            coords={"time": np.arange(5), "yu_ocean": ys, "xu_ocean": xs},
+        ).chunk({"time": 2})
+
+        filtered = lib.spatial_filter_dataset(data, grid, 2.0, "auto")
+        assert calls == [(2, 30, 25)]
+        expected = lib.spatial_filter_dataset(data, grid, 2.0, "fft")
+        np.testing.assert_array_equal(filtered["a"].values, expected["a"].values)
+        assert calls == [(2, 30, 25)]
+
+        calls.clear()
+        backends = lib.resolve_spatial_filter_backends(
+            {2: "auto", 4: "direct"}, lib.forcing_block_shape(data.rename(a="usurf"), [2, 4]),
+            [2, 4])
+        assert backends == {2: "fft", 4: "direct"}
+        assert calls == [(2, 30, 25)]
+
     def test_spatial_filter_of_constant(self):
         """
         Check that a constant field is unchanged by spatial_filter() within tolerance.
@@ -48,7 +122,7 @@ class TestEddyForcing:
             }
         )
 
-        filtered_data = lib._spatial_filter_dataset(data, grid_info, (5, 5))
+        filtered_data = lib.spatial_filter_dataset(data, grid_info, (5, 5))
 
         assert data["a"].values == pytest.approx(filtered_data["a"].values)
 
@@ -96,6 +170,487 @@ class TestEddyForcing:
         assert np.all(usurf_0 == 0)
         assert not np.all(usurf_1 == 0)
 
+    def test_eddy_forcing_fused_coarsen(self):
+        """
+        Check that filtering the advection terms directly at low resolution
+        gives the same forcing as filtering then coarsening, including around
+        NaNs and for domains that are not a multiple of the coarsening factor.
+        """
+        ys = np.linspace(-60, 60, 61)
+        xs = np.linspace(-100, 0, 53)
+        times = np.arange(2)
+        dxs = np.outer(1e4 * np.cos(np.deg2rad(ys)), np.ones_like(xs))
+        dys = np.full((len(ys), len(xs)), 1e4)
+        grid_info = xr.Dataset(
+            {"dxu": (("yu_ocean", "xu_ocean"), dxs),
+             "dyu": (("yu_ocean", "xu_ocean"), dys)},
+            coords={"yu_ocean": ys, "xu_ocean": xs},
+        )
+        velocities = np.random.randn(2, 2, len(ys), len(xs))
+        velocities[:, :, 20:30, 10:15] = np.nan
+        data = xr.Dataset(
+            {
+                name: xr.DataArray(
+                    v,
+                    dims=("time", "yu_ocean", "xu_ocean"),
+                    coords={"time": times, "yu_ocean": ys, "xu_ocean": xs},
+                )
+                for name, v in zip(("usurf", "vsurf"), velocities)
+            }
+        )
+
+        for nan_or_zero in ("zero", "nan"):
+            fused = lib.compute_forcings_and_coarsen_cm2_6(
+                data, grid_info, 4, nan_or_zero=nan_or_zero)
+            unfused = lib.compute_forcings_and_coarsen_cm2_6(
+                data, grid_info, 4, nan_or_zero=nan_or_zero, fused_coarsen=False)
+            for var in ("S_x", "S_y"):
+                expected = unfused[var].values
+                actual = fused[var].transpose(*unfused[var].dims).values
+                assert np.array_equal(np.isnan(actual), np.isnan(expected))
+                assert actual[~np.isnan(actual)] == pytest.approx(
+                    expected[~np.isnan(expected)])
+
+        # only valid when the cell area is separable
+        grid_info["dxu"] = grid_info["dxu"] * (1 + np.random.rand(len(ys), len(xs)))
+        assert lib.spatial_filter_and_coarsen_dataset(
+            data, grid_info, 2.0, 4) is None
+
+    def test_advections(self):
+        """
+        Check the advection kernel against the earlier formulation (gradients
+        between grid points, interpolated back), including NaN propagation and
+        a transposed dimension order.
+        """
+        def advections_interp(u_v_field, grid_data):
+            gradient_x = u_v_field.diff(dim="xu_ocean") / grid_data["dxu"]
+            gradient_y = u_v_field.diff(dim="yu_ocean") / grid_data["dyu"]
+            interp_coords = {
+                "xu_ocean": u_v_field.coords["xu_ocean"],
+                "yu_ocean": u_v_field.coords["yu_ocean"],
+            }
+            gradient_x = gradient_x.interp(interp_coords)
+            gradient_y = gradient_y.interp(interp_coords)
+            u, v = u_v_field["usurf"], u_v_field["vsurf"]
+            return xr.Dataset({
+                "adv_x": u * gradient_x["usurf"] + v * gradient_y["usurf"],
+                "adv_y": u * gradient_x["vsurf"] + v * gradient_y["vsurf"],
+            })
+
+        rng = np.random.default_rng(0)
+        ny, nx = 30, 40
+        dims = ("time", "yu_ocean", "xu_ocean")
+        coords = {
+            "time": np.arange(3),
+            "yu_ocean": np.sort(rng.uniform(-50, 50, ny)),
+            "xu_ocean": np.sort(rng.uniform(-100, 0, nx)),
+        }
+        grid = xr.Dataset(
+            {name: (dims[1:], rng.uniform(1, 2, (ny, nx))) for name in ("dxu", "dyu")},
+            coords={k: coords[k] for k in dims[1:]},
+        )
+        u = rng.standard_normal((3, ny, nx))
+        v = rng.standard_normal((3, ny, nx))
+        u[rng.random(u.shape) < 0.03] = np.nan
+        v[rng.random(v.shape) < 0.03] = np.nan
+        u[0, 0, 5] = v[1, 7, 0] = u[2, 1, 1] = np.nan
+        ds = xr.Dataset({"usurf": (dims, u), "vsurf": (dims, v)}, coords=coords)
+        for ds_ in (ds, ds.transpose("time", "xu_ocean", "yu_ocean")):
+            expected = advections_interp(ds_, grid)
+            adv = lib.advections(ds_, grid)
+            for name in ("adv_x", "adv_y"):
+                assert adv[name].dims == ds_["usurf"].dims
+                np.testing.assert_allclose(
+                    adv[name].values,
+                    expected[name].transpose(*adv[name].dims).values,
+                    rtol=1e-12, atol=1e-12,
+                )
+
+    def test_grid_filter_terms_cache(self, tmp_path):
+        """
+        Check grid terms are memoized in-process, round-trip through the
+        on-disk cache, and are not shared between different grids.
+        """
+        rng = np.random.default_rng(0)
+        coords = {"yu_ocean": np.arange(20) * 0.1, "xu_ocean": np.arange(30) * 0.1}
+        dims = ("yu_ocean", "xu_ocean")
+        grid = xr.Dataset(
+            {name: (dims, rng.uniform(1, 2, (20, 30))) for name in ("dxu", "dyu")},
+            coords=coords,
+        )
+        terms = lib.grid_filter_terms(grid, 2.0, cache_dir=str(tmp_path))
+        assert lib.grid_filter_terms(grid, 2.0, cache_dir=str(tmp_path)) is terms
+        area_u = grid["dxu"].values * grid["dyu"].values / 1e8
+        np.testing.assert_allclose(terms["area_u"].values, area_u)
+        np.testing.assert_allclose(
+            terms["norm"].values, gaussian_filter(area_u, 2.0, mode="constant"))
+
+        lib._grid_terms_memo.clear()
+        assert len(list(tmp_path.iterdir())) == 1
+        cached = lib.grid_filter_terms(grid, 2.0, cache_dir=str(tmp_path))
+        assert cached is not terms
+        xr.testing.assert_identical(cached, terms)
+
+        other = grid.copy(deep=True)
+        other["dxu"][0, 0] = 3.0
+        assert lib.grid_filter_terms(other, 2.0).attrs["digest"] != terms.attrs["digest"]
+        assert lib.grid_filter_terms(grid, 3.0).attrs["digest"] != terms.attrs["digest"]
+
+    def test_eddy_forcing_tiled(self):
+        """
+        Check that computing forcings tile by tile with a halo matches the
+        computation over the whole domain, for in-memory and Dask input.
+        """
+        rng = np.random.default_rng(0)
+        ny, nx, scale = 70, 93, 4
+        dims = ("yu_ocean", "xu_ocean")
+        coords = {"yu_ocean": np.linspace(-30, 30, ny), "xu_ocean": np.linspace(-80, -10, nx)}
+        grid = xr.Dataset(
+            {name: (dims, rng.uniform(1, 2, (ny, nx)) * 1e4) for name in ("dxu", "dyu")},
+            coords=coords,
+        )
+        u_v = rng.standard_normal((2, 3, ny, nx))
+        u_v[:, :, 20:30, 40:55] = np.nan
+        ds = xr.Dataset(
+            {"usurf": (("time",) + dims, u_v[0]), "vsurf": (("time",) + dims, u_v[1])},
+            coords=dict(coords, time=np.arange(3)),
+        )
+        for nan_or_zero in ("zero", "nan"):
+            expected = lib.compute_forcings_and_coarsen_cm2_6(
+                ds, grid, scale, nan_or_zero=nan_or_zero)
+            for ds_ in (ds, ds.chunk({"time": 2})):
+                forcings = lib.compute_forcings_and_coarsen_cm2_6_tiled(
+                    ds_, grid, scale, (20, 33), nan_or_zero=nan_or_zero).compute()
+                xr.testing.assert_allclose(forcings, expected, rtol=1e-9, atol=1e-12)
+
+    def test_write_forcings_in_slabs_resumes(self, tmp_path):
+        """
+        Check that an interrupted slab write resumes with only the missing
+        slabs, and refuses to resume into a store of another dataset.
+        """
+        ds = xr.Dataset(
+            {"S_x": (("time", "xu_ocean"), np.arange(20.0).reshape(10, 2))},
+            coords={"time": np.arange(10), "xu_ocean": [0.0, 1.0]},
+        ).chunk({"time": 2})
+        out_dir = str(tmp_path / "forcings.zarr")
+
+        def fail_late(block):
+            if block["time"][0] >= 4:
+                raise RuntimeError("interrupted")
+            return block
+        with pytest.raises(RuntimeError):
+            lib.write_forcings_in_slabs(
+                xr.map_blocks(fail_late, ds, template=ds), out_dir, slab_size=3)
+
+        assert lib.write_forcings_in_slabs(ds, out_dir, slab_size=3) == [1, 2]
+        xr.testing.assert_identical(xr.open_zarr(out_dir).compute(), ds.compute())
+        assert lib.write_forcings_in_slabs(ds, out_dir, slab_size=3) == []
+        with pytest.raises(ValueError):
+            lib.write_forcings_in_slabs(ds.isel(time=slice(0, 8)), out_dir)
+
+    def test_eddy_forcing_multi_factor(self, tmp_path):
+        """
+        Check that forcings for several factors computed together match those
+        computed one factor at a time, and can be written as zarr groups.
+        """
+        rng = np.random.default_rng(0)
+        ny, nx = 75, 101
+        dims = ("yu_ocean", "xu_ocean")
+        coords = {"yu_ocean": np.linspace(-30, 30, ny), "xu_ocean": np.linspace(-80, -10, nx)}
+        grid = xr.Dataset(
+            {name: (dims, rng.uniform(1, 2, (ny, nx)) * 1e4) for name in ("dxu", "dyu")},
+            coords=coords,
+        )
+        u_v = rng.standard_normal((2, 4, ny, nx))
+        u_v[:, :, 20:30, 40:55] = np.nan
+        ds = xr.Dataset(
+            {"usurf": (("time",) + dims, u_v[0]), "vsurf": (("time",) + dims, u_v[1])},
+            coords=dict(coords, time=np.arange(4)),
+        ).chunk({"time": 2})
+        scales = [3, 4]
+        expected = {
+            scale: lib.compute_forcings_and_coarsen_cm2_6(ds, grid, scale).compute()
+            for scale in scales}
+        for tile_size in (None, (30, 40)):
+            forcings = lib.map_forcings_over_blocks(ds, grid, scales, tile_size)
+            for scale in scales:
+                xr.testing.assert_allclose(
+                    forcings[scale].compute(), expected[scale], rtol=1e-9, atol=1e-12)
+
+        out_dir = str(tmp_path / "forcings.zarr")
+        groups = {f"factor_{scale}": forcings[scale] for scale in scales}
+        assert lib.write_forcings_in_slabs(groups, out_dir) == [0, 1]
+        for scale in scales:
+            written = xr.open_zarr(out_dir, group=f"factor_{scale}").compute()
+            xr.testing.assert_allclose(written, expected[scale], rtol=1e-9, atol=1e-12)
+
+    def test_cyclize_periodic_forcing(self):
+        """
+        Check that forcings computed on cyclized global data are periodic:
+        shifting the input by whole coarse cells shifts the forcings alike.
+        Also check that cyclize keeps the longitude chunking.
+        """
+        rng = np.random.default_rng(0)
+        ny, nx, scale = 24, 90, 3
+        dims = ("time", "yu_ocean", "xu_ocean")
+        coords = {
+            "time": np.arange(2),
+            "yu_ocean": np.linspace(-30, 30, ny),
+            "xu_ocean": np.arange(nx) * 4.0 - 178.0,
+        }
+        grid = xr.Dataset(
+            {"dxu": (dims[1:], np.outer(rng.uniform(1, 2, ny), np.ones(nx)) * 1e4),
+             "dyu": (dims[1:], np.full((ny, nx), 1e4))},
+            coords={k: coords[k] for k in dims[1:]},
+        )
+        u_v = rng.standard_normal((2, 2, ny, nx))
+        u_v[:, :, 5:9, 0:4] = np.nan
+
+        def periodic_forcing(shift):
+            values = np.roll(u_v, shift * scale, axis=-1)
+            ds = xr.Dataset(
+                {"usurf": (dims, values[0]), "vsurf": (dims, values[1])}, coords=coords,
+            ).chunk({"xu_ocean": 30})
+            halo = lib.forcing_halo(scale)
+            ds = lib.cyclize("xu_ocean", ds, halo)
+            assert ds.chunks["xu_ocean"] == (halo, 30, 30, 30, halo)
+            forcing = lib.compute_forcings_and_coarsen_cm2_6_tiled(
+                ds, lib.cyclize("xu_ocean", grid, halo), scale, (ny, 30))
+            return forcing.isel(xu_ocean=slice(halo // scale, -(halo // scale)))
+
+        expected = periodic_forcing(0)
+        shifted = periodic_forcing(4)
+        for name in expected:
+            np.testing.assert_allclose(
+                shifted[name].values, np.roll(expected[name].values, 4, axis=-1),
+                rtol=1e-9, atol=1e-12)
+
+    def test_eddy_forcing_float32(self):
+        """
+        Check that float32 mode computes and returns float32, close to the
+        float64 results, and that the precision report says so.
+        """
+        rng = np.random.default_rng(0)
+        ny, nx = 60, 80
+        dims = ("time", "yu_ocean", "xu_ocean")
+        coords = {
+            "time": np.arange(2),
+            "yu_ocean": np.linspace(-30, 30, ny),
+            "xu_ocean": np.linspace(-80, -10, nx),
+        }
+        grid = xr.Dataset(
+            {"dxu": (dims[1:], np.outer(rng.uniform(1, 2, ny), np.ones(nx)) * 1e4),
+             "dyu": (dims[1:], np.full((ny, nx), 1e4))},
+            coords={k: coords[k] for k in dims[1:]},
+        )
+        u_v = rng.standard_normal((2, 2, ny, nx))
+        u_v[:, :, 20:30, 30:45] = np.nan
+        ds = xr.Dataset(
+            {"usurf": (dims, u_v[0]), "vsurf": (dims, u_v[1])}, coords=coords)
+        expected = lib.compute_forcings_and_coarsen_cm2_6(ds, grid, 4)
+        forcings = lib.compute_forcings_and_coarsen_cm2_6(ds, grid, 4, dtype=np.float32)
+        for name in expected:
+            assert forcings[name].dtype == np.float32
+            scale = np.nanmax(np.abs(expected[name].values))
+            np.testing.assert_allclose(
+                forcings[name].values, expected[name].values, rtol=0, atol=1e-5 * scale)
+
+        report = lib.precision_report(ds, grid, 4, size=40)
+        assert set(report) == set(expected.data_vars)
+        for stats in report.values():
+            assert stats["n_points"] > 0
+            assert stats["nan_mismatch"] == 0
+            assert stats["relative_rms_error"] < 1e-5
+
+    def test_zarr_output_layout(self, tmp_path):
+        """
+        Check that the output layout sets chunks, compression and on-disk
+        dtypes, and that the data reads back.
+        """
+        dims = ("time", "yu_ocean", "xu_ocean")
+        ds = xr.Dataset(
+            {name: (dims, np.random.randn(10, 20, 30)) for name in ("S_x", "usurf")},
+            coords={"time": np.arange(10)},
+        ).chunk({"time": 3, "yu_ocean": 5})
+        ds_out, encoding = lib.zarr_output_layout(
+            ds, lib.training_output_chunks(4), "blosc-zstd",
+            var_dtypes={"usurf": "float32"})
+        assert ds_out.chunks["time"] == (4, 4, 2)
+        assert ds_out.chunks["yu_ocean"] == (20,)
+        assert encoding["S_x"]["chunks"] == (4, 20, 30)
+        ds_out.to_zarr(tmp_path / "out.zarr", encoding=encoding)
+
+        written = xr.open_zarr(tmp_path / "out.zarr")
+        assert written["usurf"].dtype == np.float32
+        assert written["S_x"].encoding["chunks"] == (4, 20, 30)
+        xr.testing.assert_equal(written["S_x"], ds["S_x"])
+        with pytest.raises(ValueError):
+            lib.zarr_output_layout(ds, var_dtypes={"S_z": "float32"})
+
+    def test_plan_forcing_chunks(self):
+        """
+        Check that the chunk planner keeps fitting chunkings, and shrinks
+        time chunks then tiles, aligned with the factors, to fit a budget.
+        """
+        dims = ("time", "yu_ocean", "xu_ocean")
+        # float32 input, planned for a float64 computation
+        u = np.zeros((8, 200, 300), dtype=np.float32)
+        ds = xr.Dataset(
+            {"usurf": (dims, u), "vsurf": (dims, u)}).chunk({"time": 4})
+        plan = lib.plan_forcing_chunks(ds, [4, 6], dtype=np.float64)
+        assert plan["fits"] is None
+        assert (plan["time_chunk"], plan["tile_size"]) == (4, None)
+        assert plan["block_shape"] == (4, 200, 300)
+        assert plan["n_tasks"] == 2
+        assert plan["input_bytes"] == 2 * u.nbytes
+        assert plan["output_bytes"] == {4: 8 * 8 * 50 * 75 * 4, 6: 8 * 8 * 33 * 50 * 4}
+
+        budget = plan["task_peak_bytes"] * 2 // 3
+        plan = lib.plan_forcing_chunks(ds, [4, 6], budget, dtype=np.float64)
+        assert plan["fits"] and plan["peak_bytes"] <= budget
+        assert (plan["time_chunk"], plan["tile_size"]) == (2, None)
+
+        budget = plan["task_peak_bytes"] // 4
+        plan = lib.plan_forcing_chunks(ds, [4, 6], budget, concurrency=2, dtype=np.float64)
+        assert plan["fits"] and plan["peak_bytes"] <= budget
+        assert plan["time_chunk"] == 1
+        assert all(t % 12 == 0 for t in plan["tile_size"])
+
+        assert not lib.plan_forcing_chunks(ds, [4, 6], 1, dtype=np.float64)["fits"]
+
+        # the store chunks the input was opened from are read whole
+        ds["usurf"].encoding["chunks"] = (8, 200, 300)
+        plan = lib.plan_forcing_chunks(ds.chunk({"time": 1}), [4, 6])
+        assert plan["input_chunk_bytes"] == 2 * u.nbytes
+        assert plan["task_peak_bytes"] > 2 * u.nbytes
+
+    def test_plan_forcing_chunks_peak(self, tmp_path):
+        """
+        Check the planner's estimate of a task's peak memory against the
+        peak measured when computing forcings on a block.
+        """
+        catalog = synthetic.write_synthetic_cm2_6(
+            str(tmp_path), n_times=2, ny=96, nx=144, time_chunk=2)
+        surface_fields, grid = lib.retrieve_cm2_6(catalog, co2_increase=False)
+        grid = grid.compute()
+        for dtype in (np.float32, np.float64):
+            for scales in ([4], [4, 8, 12]):
+                u_v = surface_fields[["usurf", "vsurf"]].astype(dtype).compute()
+                terms = {s: lib.grid_filter_terms(grid, s / 2, dtype) for s in scales}
+                plan = lib.plan_forcing_chunks(u_v.chunk(), scales)
+                estimate = plan["task_peak_bytes"] - plan["input_chunk_bytes"]
+                tracemalloc.start()
+                try:
+                    with dask.config.set(scheduler="synchronous"):
+                        forcings = lib.compute_forcings_and_coarsen_cm2_6_multi(
+                            u_v, grid, scales, grid_terms=terms, dtype=dtype)
+                        for ds in forcings.values():
+                            ds.compute()
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                assert peak <= estimate <= 1.6 * peak, (dtype, scales, peak, estimate)
+
+    def test_bounding_box_regions(self):
+        """
+        Check that forcings over a bounding box's region, trimmed to the box,
+        match those computed over a much larger region, and that regions
+        report the input chunks they read.
+        """
+        grid = synthetic.synthetic_cm2_6_grid(90, 120, seed=1)
+        # in float64, to compare to rounding errors
+        u_v = synthetic.synthetic_cm2_6_surface(grid, 1, seed=1).compute().astype(np.float64)
+        grid = grid.reset_coords()[["dxu", "dyu"]]
+        bboxes = [BoundingBox(-30, 10, -200, -150), BoundingBox(-80, -50, -280, -240)]
+        regions = lib.bounding_box_regions(u_v, bboxes, [4])
+        for bbox, (region, keep) in zip(bboxes, regions):
+            u_v_region = u_v.isel(region)
+            forcings = lib.compute_forcings_and_coarsen_cm2_6(
+                u_v_region, grid.sel(yu_ocean=u_v_region["yu_ocean"],
+                                     xu_ocean=u_v_region["xu_ocean"]), 4).isel(keep[4])
+            assert forcings["yu_ocean"].min() >= bbox.lat_min
+            assert forcings["xu_ocean"].max() <= bbox.long_max
+
+            # same coarse grid, with 40 more points on each side
+            larger = {dim: slice(max(s.start - 40, s.start % 4), s.stop + 40)
+                      for dim, s in region.items()}
+            u_v_larger = u_v.isel(larger)
+            expected = lib.compute_forcings_and_coarsen_cm2_6(
+                u_v_larger, grid.sel(yu_ocean=u_v_larger["yu_ocean"],
+                                     xu_ocean=u_v_larger["xu_ocean"]), 4)
+            expected = expected.sel(
+                yu_ocean=forcings["yu_ocean"], xu_ocean=forcings["xu_ocean"])
+            for name in ("S_x", "S_y"):
+                np.testing.assert_allclose(
+                    forcings[name].values, expected[name].values, rtol=1e-10,
+                    atol=1e-10 * np.nanmax(np.abs(expected[name].values)))
+
+        chunked = u_v.chunk({"yu_ocean": 30, "xu_ocean": 40})
+        assert lib.region_input_chunks(chunked, {
+            "yu_ocean": slice(25, 35), "xu_ocean": slice(0, 40)}) == {(0, 0), (1, 0)}
+        with pytest.raises(ValueError):
+            lib.bounding_box_regions(u_v, [BoundingBox(0, 0.1, 0, 0.1)], [4])
+
+    def test_select_times(self, caplog):
+        """
+        Check that a date range and stride select the expected time points,
+        read only the input chunks holding them, and warn on a stride
+        misaligned with the chunks.
+        """
+        import dask.array as da
+        read = []
+
+        def read_chunk(block_id=None):
+            read.append(block_id[0])
+            return np.full((1, 2, 2), block_id[0], dtype=float)
+
+        times = xr.date_range(
+            "0181-01-01", periods=20, calendar="julian", use_cftime=True)
+        u_v = xr.Dataset(
+            {"usurf": (("time", "yu_ocean", "xu_ocean"), da.map_blocks(
+                read_chunk, chunks=((1,) * 20, (2,), (2,)), dtype=float))},
+            coords={"time": times})
+
+        selected = lib.select_times(u_v, "0181-01-03", "0181-01-17", 5)
+        assert list(selected["time"].values) == list(times[[2, 7, 12]])
+        assert selected["usurf"].values[:, 0, 0].tolist() == [2, 7, 12]
+        assert sorted(read) == [2, 7, 12]
+        assert "misaligned" not in caplog.text
+
+        lib.select_times(u_v.chunk({"time": 4}), stride=3)
+        assert "misaligned" in caplog.text
+        with pytest.raises(ValueError):
+            lib.select_times(u_v, "0182-01-01")
+        with pytest.raises(ValueError):
+            lib.select_times(u_v, stride=0)
+
+    def test_eddy_forcing_default_precision(self, tmp_path):
+        """
+        Check that forcings are computed at the precision of the input by
+        default, so that float32 CM2.6 velocities give float32 outputs, and
+        only upcast to float64 when asked.
+        """
+        catalog = synthetic.write_synthetic_cm2_6(
+            str(tmp_path), n_times=2, ny=60, nx=80, time_chunk=2)
+        surface_fields, grid = lib.retrieve_cm2_6(catalog, co2_increase=False)
+        grid = grid.compute()
+        assert surface_fields["usurf"].dtype == np.float32
+        assert lib.forcing_dtype(surface_fields, None) == np.float32
+        assert lib.forcing_dtype(surface_fields.astype(int), None) == np.float64
+
+        forcings = lib.compute_forcings_and_coarsen_cm2_6(surface_fields, grid, 4)
+        tiled = lib.map_forcings_over_blocks(surface_fields, grid, [4], tile_size=40)[4]
+        for ds in (forcings, tiled):
+            for name in ("S_x", "S_y", "usurf", "vsurf"):
+                assert ds[name].dtype == np.float32
+        plan = lib.plan_forcing_chunks(surface_fields, [4])
+        assert plan == lib.plan_forcing_chunks(surface_fields, [4], dtype=np.float32)
+
+        upcast = lib.compute_forcings_and_coarsen_cm2_6(
+            surface_fields, grid, 4, dtype=np.float64)
+        for name in ("S_x", "S_y", "usurf", "vsurf"):
+            assert upcast[name].dtype == np.float64
+
     def test_eddy_forcing_chunking(self):
         """
         Assert that applying eddy_forcing using different chunking gives the
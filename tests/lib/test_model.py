@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the training data preparation."""
+
+import copy
+import pickle
+import numpy as np
+import pytest
+import xarray as xr
+import torch
+import gz21_ocean_momentum.lib.model as lib
+import gz21_ocean_momentum.models.models1 as models1
+import gz21_ocean_momentum.models.submodels as submodels
+import gz21_ocean_momentum.models.transforms as transforms
+import gz21_ocean_momentum.train.losses as losses
+from gz21_ocean_momentum.data.datasets import (
+    ArrayTransform,
+    ComposeTransforms,
+    CropToNewShape,
+    CyclicRepeat,
+    DatasetTransformer,
+    FeaturesTargetsDataset,
+    FixedVelocityNormalizer,
+    PerChannelNormalizer,
+    PerLocationNormalizer,
+    RawDataFromXrDataset,
+    RunningMoments,
+)
+
+def _training_data(n_times=12, ny=20, nx=24, seed=0):
+    """Small Dask-backed dataset shaped like the data step's output."""
+    rng = np.random.default_rng(seed)
+    dims = ("time", "yu_ocean", "xu_ocean")
+    return xr.Dataset(
+        {name: (dims, rng.standard_normal((n_times, ny, nx)) * scale)
+         for name, scale in (("usurf", 0.1), ("vsurf", 0.1), ("S_x", 1e-7), ("S_y", 1e-7))},
+        coords={
+            "time": np.arange(n_times),
+            "yu_ocean": np.linspace(-20, 20, ny),
+            "xu_ocean": np.linspace(-40, 40, nx),
+        }).chunk({"time": 4})
+
+class TestTrainingData:
+    "Class to test the conversion of training data to PyTorch datasets."
+
+    def test_materialized_subdomain(self):
+        """
+        Check that a materialized subdomain gives the same samples, as
+        float32 contiguous arrays, as one read from the xarray dataset.
+        """
+        ds_xr = copy.deepcopy(submodels.transform3).fit_transform(_training_data())
+        lazy = lib.gz21_train_data_subdomain_xr_to_torch(ds_xr)
+        materialized = lib.gz21_train_data_subdomain_xr_to_torch(ds_xr, materialize=True)
+        features = materialized.dataset._features_array
+        assert features.dtype == np.float32 and features.flags.c_contiguous
+        assert features.shape == (12, 2, 20, 24)
+
+        for index in (0, 7, np.arange(3, 9), slice(2, 5)):
+            for expected, actual in zip(lazy[index], materialized[index]):
+                assert actual.dtype == np.float32
+                assert actual.shape == expected.shape
+                np.testing.assert_allclose(actual, expected, rtol=1e-6)
+
+        # changing the inputs, outputs or index drops the materialized arrays
+        raw = RawDataFromXrDataset(_training_data())
+        raw.index = "time"
+        raw.input_arrays = ["usurf"]
+        raw.output_arrays = ["S_x"]
+        for name, value in (("input_arrays", ["vsurf"]), ("output_arrays", ["S_y"]),
+                            ("index", "time")):
+            raw.materialize()
+            setattr(raw, name, value)
+            assert raw._features_array is None and raw._targets_array is None
+        features, targets = raw[0]
+        np.testing.assert_array_equal(features[0], raw.xr_dataset["vsurf"][0])
+        np.testing.assert_array_equal(targets[0], raw.xr_dataset["S_y"][0])
+
+    def test_training_shards(self, tmp_path):
+        """
+        Check that shards hold the samples of the prepared subdomain
+        datasets, with all their transforms, and that datasets read from
+        them fit the train/test split as the originals.
+        """
+        full = _training_data(ny=44, nx=50)
+        subdomains = [full.isel(yu_ocean=slice(0, 40), xu_ocean=slice(0, 44)),
+                      full.isel(yu_ocean=slice(2, 44), xu_ocean=slice(4, 50))]
+        datasets = [
+            lib.gz21_train_data_subdomain_xr_to_torch(
+                copy.deepcopy(submodels.transform3).fit_transform(sd))
+            for sd in subdomains]
+        lib.prep_train_test_dataloaders(datasets, 0.5, 0.5, 2)
+        criterion = losses.HeteroskedasticGaussianLossV2(2)
+        net = models1.FullyCNN(2, criterion.n_required_channels)
+        net.final_transformation = transforms.SoftPlusTransform()
+        net.final_transformation.indices = criterion.precision_indices
+        for dataset in datasets:
+            dataset.add_transforms_from_model(net)
+
+        shards_dir = str(tmp_path / "shards")
+        lib.write_training_shards(datasets, shards_dir, shard_size=5)
+        shards = lib.load_training_shards(shards_dir)
+        assert len(shards) == 2
+        assert sorted(p.name for p in (tmp_path / "shards" / "subdomain_0").iterdir()) == [
+            "features_00000.npy", "features_00001.npy", "features_00002.npy", "index.json",
+            "targets_00000.npy", "targets_00001.npy", "targets_00002.npy"]
+
+        for dataset, shard in zip(datasets, shards):
+            assert len(shard) == len(dataset) == 12
+            assert (shard.n_features, shard.n_targets) == (2, 2)
+            assert (shard.height, shard.width) == (dataset.height, dataset.width) == (40, 44)
+            assert (shard.output_height, shard.output_width) == (
+                dataset.output_height, dataset.output_width)
+            for index in (0, 4, 5, 11, -1):
+                for expected, actual in zip(dataset[index], shard[index]):
+                    assert actual.dtype == torch.float32
+                    np.testing.assert_allclose(actual.numpy(), expected, rtol=1e-6)
+        for (expected_features, expected_targets), (features, targets) in zip(
+                [shards[1][i] for i in (11, 0, 5, 6)], shards[1].__getitems__([11, 0, 5, 6])):
+            np.testing.assert_array_equal(features, expected_features)
+            np.testing.assert_array_equal(targets, expected_targets)
+        # mapped again in each process rather than pickled with the data
+        assert pickle.loads(pickle.dumps(shards[0]))._shards is None
+
+        train, test = lib.prep_train_test_dataloaders(shards, 0.5, 0.5, 2)
+        assert len(train.dataset) == len(test.dataset) == 12
+        features, targets = next(iter(test))
+        assert features.shape == (2, 2, 40, 44)
+        assert targets.shape == (2, 2, shards[0].output_height, shards[0].output_width)
+
+    def test_batched_fetch(self, monkeypatch):
+        """
+        Check that batches fetched through the dataset wrappers hold the
+        same samples as fetched one by one, with one selection per
+        subdomain.
+        """
+        full = _training_data(ny=24, nx=30)
+        subdomains = [full.isel(yu_ocean=slice(0, 20), xu_ocean=slice(0, 24)),
+                      full.isel(yu_ocean=slice(2, 24), xu_ocean=slice(4, 30))]
+        datasets = [
+            lib.gz21_train_data_subdomain_xr_to_torch(
+                copy.deepcopy(submodels.transform3).fit_transform(sd))
+            for sd in subdomains]
+        train, _ = lib.prep_train_test_dataloaders(datasets, 0.75, 0.25, 2)
+        concat = train.dataset
+        assert len(concat) == 18
+
+        indices = [10, 0, 3, 10, 17, -1, 9, 1]
+        expected = [concat[i] for i in indices]
+        selections = []
+        getitem = RawDataFromXrDataset.__getitem__
+        def counting_getitem(self, index):
+            selections.append(index)
+            return getitem(self, index)
+        monkeypatch.setattr(RawDataFromXrDataset, "__getitem__", counting_getitem)
+        batch = concat.__getitems__(indices)
+
+        assert len(selections) == 2
+        np.testing.assert_array_equal(selections[0], [0, 1, 3])
+        np.testing.assert_array_equal(selections[1], [0, 1, 8])
+        assert len(batch) == len(indices)
+        for (expected_features, expected_targets), (features, targets) in zip(expected, batch):
+            assert features.shape == expected_features.shape == (2, 20, 24)
+            np.testing.assert_array_equal(features, expected_features)
+            np.testing.assert_array_equal(targets, expected_targets)
+
+    def test_compiled_transforms(self):
+        """
+        Check that chains of crops and cyclic repeats, compiled into
+        indexing plans, transform samples, batches and coordinates as the
+        transforms applied one after the other.
+        """
+        chain = [CropToNewShape(10, 16), CyclicRepeat(2, "width", 360.0, 3),
+                 CropToNewShape(8, 20)]
+        compose = ComposeTransforms(*chain)
+        rng = np.random.default_rng(0)
+        batch = rng.standard_normal((5, 2, 13, 18))
+
+        expected = batch[0]
+        for transform in chain:
+            expected = transform(expected)
+        np.testing.assert_array_equal(compose(batch[0]), expected)
+        np.testing.assert_array_equal(
+            compose.transform_batch(batch), np.stack([compose(x) for x in batch]))
+        plan, = compose.compile()
+        assert list(plan._indexers) == [(2, 13, 18)]
+
+        width = np.linspace(0.0, 340.0, 18)
+        expected = width
+        for transform in chain:
+            expected = transform.transform_coordinate(expected, "width")
+        np.testing.assert_array_equal(compose.transform_coordinate(width, "width"), expected)
+
+        # crops alone are views, and the plan follows parameter changes
+        crop = CropToNewShape(8, 12)
+        compose = ComposeTransforms(CropToNewShape(10, 16), crop)
+        cropped = compose.transform_batch(batch)
+        assert np.shares_memory(cropped, batch)
+        np.testing.assert_array_equal(cropped, batch[:, :, 2:10, 3:15])
+        crop.width = 6
+        np.testing.assert_array_equal(compose(batch[0]), batch[0][:, 2:10, 6:12])
+        # other attributes, even unhashable ones, are not plan parameters
+        crop.weights = np.ones(3)
+        plan = compose.compile()
+        crop.weights = [1.0, 2.0]
+        assert compose.compile() is plan
+
+        # point-selecting transforms must give the parameters of their plans
+        with pytest.raises(TypeError):
+            class Flip(ArrayTransform):
+                selects_points = True
+
+                def fit(self, x):
+                    pass
+
+                def select_points(self, axis, length):
+                    return np.arange(length)[::-1], np.zeros(length)
+
+                def transform(self, x):
+                    return x[:, ::-1]
+
+                def transform_coordinate(self, coord, dim):
+                    return coord[::-1]
+
+    def test_streaming_fit(self):
+        """
+        Check that normalizers fitted on streams of batches, or merged from
+        separate fits, have the moments of a fit on all the data at once.
+        """
+        rng = np.random.default_rng(0)
+        x = (rng.standard_normal((30, 2, 6, 8)) * [[[3.0]], [[0.5]]] + 1e3).astype(np.float32)
+        batches = [x[:7], x[7:20], x[20:]]
+
+        moments = RunningMoments((0, 2, 3))
+        for batch in batches[:2]:
+            moments.update(batch)
+        moments.merge(RunningMoments((0, 2, 3)).update(batches[2]))
+        assert moments.count == 30 * 6 * 8
+        x64 = x.astype(np.float64)
+        np.testing.assert_allclose(moments.mean, x64.mean(axis=(0, 2, 3), keepdims=True))
+        np.testing.assert_allclose(moments.std, x64.std(axis=(0, 2, 3), keepdims=True))
+
+        streamed = PerChannelNormalizer(use_mean=True)
+        streamed.fit_batches(batches)
+        assert streamed._mean.shape == (2, 1, 1) and streamed._mean.dtype == np.float32
+        np.testing.assert_allclose(streamed._std, x64.std(axis=(0, 2, 3))[:, None, None], rtol=1e-6)
+
+        merged = PerLocationNormalizer()
+        for batch in batches:
+            fitted = PerLocationNormalizer()
+            fitted.fit(batch)
+            merged.merge(fitted)
+        merged.merge(PerLocationNormalizer())
+        np.testing.assert_allclose(merged._mean, x64.mean(axis=0), rtol=1e-6)
+        np.testing.assert_allclose(merged._std, x64.std(axis=0), rtol=1e-5)
+        assert PerLocationNormalizer().merge(PerLocationNormalizer())._mean is None
+
+        # chains fit each transform on the batches transformed by the previous
+        chain = ComposeTransforms(CropToNewShape(4, 6), PerChannelNormalizer(use_mean=True),
+                                  PerLocationNormalizer())
+        chain.fit_batches(batches)
+        at_once = copy.deepcopy(chain)
+        at_once.fit(x)
+        for fitted, expected in zip(chain.transforms[1:], at_once.transforms[1:]):
+            np.testing.assert_allclose(fitted._mean, expected._mean, rtol=1e-5)
+            np.testing.assert_allclose(fitted._std, expected._std, rtol=1e-5)
+        normalized = chain.transform_batch(x)
+        np.testing.assert_allclose(normalized.mean(axis=0), 0, atol=1e-4)
+        with pytest.raises(TypeError):
+            chain.fit_batches(iter(batches))
+
+        class MaxNormalizer(FixedVelocityNormalizer):
+            """Fitted on the data values, without support for batches."""
+            fit_depends_on_values = True
+
+            def fit(self, x):
+                self.std = np.abs(x).max()
+
+            def transform_coordinate(self, coord, dim):
+                return coord
+
+        with pytest.raises(NotImplementedError):
+            MaxNormalizer().fit_batches(batches)
+        chain = ComposeTransforms(CropToNewShape(4, 6), MaxNormalizer())
+        chain.fit(x)
+        assert chain.transforms[1].std == np.abs(x[:, :, 1:5, 1:7]).max()
+
+        transformer = DatasetTransformer(PerChannelNormalizer(), PerChannelNormalizer())
+        transformer.fit(FeaturesTargetsDataset(x, 2 * x), batch_size=8)
+        np.testing.assert_allclose(
+            transformer.transforms["targets"]._std, 2 * streamed._std, rtol=1e-5)
+
+        # features and targets are fitted in the same passes over the
+        # dataset, one per transform depending on the data values
+        class CountingDataset(FeaturesTargetsDataset):
+            reads = 0
+
+            def __getitem__(self, index):
+                self.reads += 1
+                return super().__getitem__(index)
+
+        dataset = CountingDataset(x, 2 * x)
+        DatasetTransformer(
+            ComposeTransforms(CropToNewShape(4, 6), PerChannelNormalizer()),
+            PerLocationNormalizer(),
+        ).fit(dataset, batch_size=8)
+        assert dataset.reads == len(x)
+        dataset.reads = 0
+        chain = ComposeTransforms(CropToNewShape(4, 6), PerChannelNormalizer(use_mean=True),
+                                  PerLocationNormalizer())
+        transformer = DatasetTransformer(chain)
+        transformer.fit(dataset, batch_size=8)
+        assert dataset.reads == 2 * len(x)
+        np.testing.assert_allclose(
+            transformer.transforms["features"].transforms[2]._std,
+            at_once.transforms[2]._std, rtol=1e-5)
+        dataset.reads = 0
+        DatasetTransformer(CropToNewShape(4, 6)).fit(dataset, batch_size=8)
+        assert dataset.reads == 8
+
+        # transforms fitted on whole arrays only are fitted on the dataset
+        # read at once, the others still on batches
+        transformer = DatasetTransformer(MaxNormalizer(), PerChannelNormalizer())
+        transformer.fit(FeaturesTargetsDataset(x, 2 * x), batch_size=8)
+        assert transformer.transforms["features"].std == np.abs(x).max()
+        np.testing.assert_allclose(
+            transformer.transforms["targets"]._std, 2 * streamed._std, rtol=1e-5)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Unit tests for the synthetic CM2.6 data."""
+
+import numpy as np
+import gz21_ocean_momentum.lib.data as lib
+import gz21_ocean_momentum.lib.synthetic as synthetic
+
+class TestSyntheticData:
+    "Class to test the synthetic CM2.6 dataset."
+
+    def test_retrieve_synthetic_cm2_6(self, tmp_path):
+        """
+        Check that a synthetic CM2.6 catalog is read like the Pangeo one, with
+        NaN velocities over land, and that forcings can be computed from it.
+        """
+        catalog = synthetic.write_synthetic_cm2_6(
+            str(tmp_path), n_times=3, ny=60, nx=80, time_chunk=2)
+        surface_fields, grid = lib.retrieve_cm2_6(catalog, co2_increase=False)
+        assert surface_fields["usurf"].dims == ("time", "yu_ocean", "xu_ocean")
+        assert surface_fields["usurf"].shape == (3, 60, 80)
+        assert surface_fields.chunks["time"] == (2, 1)
+        assert set(grid.data_vars) == {"dxu", "dyu", "wet"}
+
+        u = surface_fields["usurf"].values
+        land = grid["wet"].values == 0
+        assert 0 < land.mean() < 1
+        assert np.isnan(u[:, land]).all()
+        assert np.isfinite(u).any()
+
+        one_percent, _ = lib.retrieve_cm2_6(catalog, co2_increase=True)
+        assert not np.array_equal(one_percent["usurf"].values, u, equal_nan=True)
+
+        forcings = lib.compute_forcings_and_coarsen_cm2_6(
+            surface_fields.isel(time=[0]), grid.compute(), 4)
+        assert np.isfinite(forcings["S_x"].values).any()